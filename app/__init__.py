@@ -5,6 +5,7 @@ import os
 import re
 import json
 import logging
+import threading
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor
@@ -17,7 +18,7 @@ from rq import Queue
 
 from flask import (
     Flask, Blueprint, render_template, request, jsonify, abort,
-    current_app, redirect, url_for
+    current_app, redirect, url_for, Response, stream_with_context
 )
 from flask_wtf.csrf import CSRFProtect, CSRFError
 from flask_limiter import Limiter
@@ -41,7 +42,14 @@ else:
     from services.gemini_client_http import GeminiClient, GeminiFallbackError
     logger.info("Using HTTP-based Gemini client")
 
-from services.search import SearchClient, SearchError
+from services.search import SearchClient, SearchError, dedupe_results
+from services.book_search_planner import BookSearchPlanner
+from services.ranking import fit_to_budget
+from services.rate_limiter import BACKGROUND, gemini_priority
+from services.chat_context import assemble_history
+from services.conversation_memory import memory_turns, schedule_memory_update
+from services.token_estimator import estimate_tokens
+from services.metrics import gemini_caller, metrics_authorized, render_prometheus
 
 # ===============================
 # Markdown/XSS Safe Renderer
@@ -103,12 +111,20 @@ def clean_and_shorten_title(text: str, max_length: int = 18) -> str:
 from typing import List, Dict, Any
 
 
-def _summarize_with_citations(gc, query: str, results: List[Dict[str, Any]], requested_model: str = "") -> Dict[str, Any]:
+def _summarize_with_citations(
+    gc, query: str, results: List[Dict[str, Any]], requested_model: str = "", rank_query: str = ""
+) -> Dict[str, Any]:
     """Prefer enriched summarizer if available, fallback to default.
 
     This allows HTTP client to use enriched_content-aware prompt without
     changing the Python client which already handles enrichment internally.
+    Near-duplicate sources are dropped first so they do not eat the prompt budget,
+    then sources are ordered by relevance to rank_query (the user's own words, without
+    the prompt guard) and trimmed to RANKING_SOURCE_BUDGET_TOKENS.
     """
+    results = dedupe_results(results)
+    if rank_query:
+        results = fit_to_budget(rank_query, results)
     try:
         if hasattr(gc, "summarize_with_citations_enriched"):
             return gc.summarize_with_citations_enriched(query, results, requested_model)
@@ -308,6 +324,21 @@ def create_app() -> Flask:
         except Exception:
             abort(400, description="Invalid JSON")
 
+    def _build_chat_history(conv: Conversation, user_msg: Message, model: str):
+        """
+        ローリングメモリの要約ターン + ウォーターマーク以降の直近履歴を返す。
+        returns (history, ctx)  ctx は assemble_history の結果（prompt_tokens は要約込み）
+        """
+        memory = memory_turns(conv)
+        memory_tokens = sum(estimate_tokens(t["content"]) for t in memory)
+        ctx = assemble_history(
+            conv.id, model,
+            before_id=user_msg.id,
+            reserve_tokens=estimate_tokens(user_msg.content) + memory_tokens,
+            after_id=conv.memory_watermark_id if memory else None,
+        )
+        return memory + ctx["history"], ctx
+
     def _generate_summary_sync(conversation_id: int):
         """同期的に要約とタイトルを生成（Redisがない場合の代替）"""
         try:
@@ -320,7 +351,9 @@ def create_app() -> Flask:
             # Gemini API: role は "user" または "model" である必要があります
             convo_dump = [{"role": "model" if m.sender == "assistant" else "user", "content": m.content} for m in msgs][-100:]
 
-            analysis = gc.analyze_conversation(convo_dump)
+            # 要約は補助的な処理なので、チャット本体よりレート制限の優先度を下げる
+            with gemini_priority(BACKGROUND), gemini_caller("conversation_summary"):
+                analysis = gc.analyze_conversation(convo_dump)
             new_summary = (analysis.get("summary") or "").strip()
 
             if new_summary:
@@ -333,6 +366,57 @@ def create_app() -> Flask:
         except Exception as e:
             logger.warning(f"Summary generation failed: {e}")
 
+    def _schedule_summary(conversation_id: int):
+        """
+        サイドバー要約の更新を応答の外で行う。
+        RQ があればワーカーへ（同じ会話のジョブが待機中なら積まない）、無ければバックグラウンドスレッドで。
+        """
+        rq_queue = current_app.extensions.get("rq_queue")
+        if rq_queue is not None:
+            job_id = f"conversation_summary_{conversation_id}"
+            try:
+                existing = rq_queue.fetch_job(job_id)
+                if existing is not None and existing.get_status() in ("queued", "deferred", "scheduled"):
+                    return
+                rq_queue.enqueue(
+                    "services.tasks.generate_summary_and_title", conversation_id,
+                    job_id=job_id, job_timeout="5m",
+                )
+                return
+            except Exception as e:
+                logger.warning(f"Summary enqueue failed, generating in background thread: {e}")
+
+        app = current_app._get_current_object()
+
+        def _run():
+            with app.app_context():
+                try:
+                    _generate_summary_sync(conversation_id)
+                finally:
+                    db.session.remove()
+
+        threading.Thread(target=_run, name=f"summary-{conversation_id}", daemon=True).start()
+
+    def _detect_search_route(msg: str) -> str:
+        """
+        メッセージが検索パスに回るかを判定する。
+        returns "book" / "weather_news" / ""（通常チャット）
+        """
+        book_keywords = ["要約", "まとめ", "内容", "について", "目次", "章"]
+        has_book_request = any(kw in msg for kw in book_keywords) and any(kw in msg for kw in ["本", "書籍", "著書"])
+        if re.search(r'[「『]([^」』]+)[」』]', msg) or has_book_request:
+            return "book"
+        q_lower = msg.lower()
+        is_weather = any(w in msg for w in ["天気", "天候", "予報"]) or "weather" in q_lower or "forecast" in q_lower
+        is_news = any(w in msg for w in ["ニュース", "速報"]) or "news" in q_lower or "headline" in q_lower
+        if is_weather or is_news:
+            return "weather_news"
+        return ""
+
+    def _sse(payload: Dict[str, Any], event: str = "") -> str:
+        head = f"event: {event}\n" if event else ""
+        return f"{head}data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
     def _admin_required():
         if not (current_user.is_authenticated and getattr(current_user, "is_admin", False)):
             abort(403, description="admin required")
@@ -342,6 +426,15 @@ def create_app() -> Flask:
     def healthz():
         return jsonify(status="ok")
 
+    # ----------------- Metrics (Prometheus) -----------------
+    @bp.route("/metrics")
+    @limiter.exempt
+    def metrics():
+        # METRICS_TOKEN を設定した場合は Bearer ヘッダか ?token= が必要
+        if not metrics_authorized(request.headers.get("Authorization", ""), request.args.get("token", "")):
+            return Response("unauthorized\n", status=401, mimetype="text/plain")
+        return Response(render_prometheus(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
     # ----------------- Pages -----------------
     @bp.route("/")
     def index():
@@ -391,9 +484,23 @@ def create_app() -> Flask:
         announcements = db.session.query(Announcement).order_by(
             Announcement.timestamp.desc().nullslast()
         ).all()
+        # Gemini モデルのヘルス（サーキットブレーカーの判断材料）
+        try:
+            from services.circuit_breaker import circuit_breaker
+            model_health = circuit_breaker.scoreboard()
+        except Exception as e:
+            logger.warning(f"[Admin] model health unavailable: {e}")
+            model_health = []
+        try:
+            from services.backfill import backfill_status
+            summary_backfill = backfill_status()
+        except Exception as e:
+            logger.warning(f"[Admin] backfill status unavailable: {e}")
+            summary_backfill = {"status": "idle"}
         return render_template(
             "admin_dashboard.html",
-            users=users_with_stats, conversations=conversations, announcements=announcements
+            users=users_with_stats, conversations=conversations, announcements=announcements,
+            model_health=model_health, summary_backfill=summary_backfill
         )
 
     @bp.route("/admin/user/<int:user_id>")
@@ -534,6 +641,41 @@ def create_app() -> Flask:
         db.session.commit()
         return redirect(url_for("core.admin_dashboard"))
 
+    # ----------------- 会話サマリーの一括再生成 -----------------
+    @bp.route("/admin/backfill/summaries/start", methods=["POST"])
+    @login_required
+    def start_summary_backfill():
+        _admin_required()
+        from services.backfill import start_backfill
+        try:
+            batch_size = max(1, min(500, int(request.form.get("batch_size") or 0))) if request.form.get("batch_size") else 0
+            concurrency = max(1, min(16, int(request.form.get("concurrency") or 0))) if request.form.get("concurrency") else 0
+        except ValueError:
+            abort(400, description="batch_size / concurrency must be integers")
+        start_backfill(
+            current_app.extensions["gemini_client"],
+            current_app.extensions.get("rq_queue"),
+            batch_size=batch_size,
+            concurrency=concurrency,
+            restart=bool(request.form.get("restart")),
+        )
+        return redirect(url_for("core.admin_dashboard"))
+
+    @bp.route("/admin/backfill/summaries/cancel", methods=["POST"])
+    @login_required
+    def cancel_summary_backfill():
+        _admin_required()
+        from services.backfill import request_cancel
+        request_cancel()
+        return redirect(url_for("core.admin_dashboard"))
+
+    @bp.route("/admin/backfill/summaries/status")
+    @login_required
+    def summary_backfill_status():
+        _admin_required()
+        from services.backfill import backfill_status
+        return jsonify(backfill_status())
+
     # ----------------- Conversations API -----------------
     @bp.route("/api/conversations", methods=["GET"])
     @login_required
@@ -635,23 +777,19 @@ def create_app() -> Flask:
             cid = conv.id
 
         # 保存（ユーザ発話）
-        db.session.add(Message(content=msg, sender="user", conversation_id=cid))
+        user_msg = Message(content=msg, sender="user", conversation_id=cid)
+        db.session.add(user_msg)
         db.session.commit()
 
         # 書籍要約判定 → 書籍専用検索パス
-        import re
-        q_lower = msg.lower()
-
-        # 書籍要約リクエストの検出
-        book_keywords = ["要約", "まとめ", "内容", "について", "目次", "章"]
-        has_book_request = any(kw in msg for kw in book_keywords) and any(kw in msg for kw in ["本", "書籍", "著書"])
+        route = _detect_search_route(msg)
 
         # 日本語引用符で囲まれた書籍タイトルを検出
         book_title_match = re.search(r'[「『]([^」』]+)[」』]', msg)
 
         # 明示的な書籍名パターン（例: "安岡定子 実践・論語塾"）
         # または引用符内のテキスト
-        if book_title_match or has_book_request:
+        if route == "book":
             try:
                 sc: SearchClient = current_app.extensions["search_client"]
                 gc: GeminiClient = current_app.extensions["gemini_client"]
@@ -728,17 +866,18 @@ def create_app() -> Flask:
                     db.session.commit()
                 else:
                     # 書籍専用要約を実行
-                    if has_toc and table_of_contents:
-                        summary = gc.summarize_book_with_toc(
-                            book_title,
-                            table_of_contents,
-                            results,
-                            (data.get("model") or "").strip()
-                        )
-                    else:
-                        # 目次がない場合は通常の要約
-                        query_for_summary = f"書籍「{book_title}」の内容を要約してください。出版社や書評サイトの情報を優先してください。"
-                        summary = _summarize_with_citations(gc, query_for_summary, results, (data.get("model") or "").strip())
+                    with gemini_caller("book_summary"):
+                        if has_toc and table_of_contents:
+                            summary = gc.summarize_book_with_toc(
+                                book_title,
+                                table_of_contents,
+                                fit_to_budget(book_title, dedupe_results(results)),
+                                (data.get("model") or "").strip()
+                            )
+                        else:
+                            # 目次がない場合は通常の要約
+                            query_for_summary = f"書籍「{book_title}」の内容を要約してください。出版社や書評サイトの情報を優先してください。"
+                            summary = _summarize_with_citations(gc, query_for_summary, results, (data.get("model") or "").strip(), rank_query=book_title)
 
                     reply = summary.get("answer") or summary.get("summary") or summary.get("text") or "要約を生成できませんでした。"
                     db.session.add(Message(content=reply, sender="assistant", conversation_id=cid))
@@ -771,10 +910,10 @@ def create_app() -> Flask:
                 return jsonify({"ok": True, "reply": reply, "reply_html": render_markdown_safe(reply), "conversation_id": cid})
 
         # 天気／ニュース判定 → 検索優先
+        q_lower = msg.lower()
         is_weather = any(w in msg for w in ["天気", "天候", "予報"]) or "weather" in q_lower or "forecast" in q_lower
-        is_news = any(w in msg for w in ["ニュース", "速報"]) or "news" in q_lower or "headline" in q_lower
 
-        if is_weather or is_news:
+        if route == "weather_news":
             try:
                 JST = timezone(timedelta(hours=9))
                 today = datetime.now(JST)
@@ -808,7 +947,7 @@ def create_app() -> Flask:
 
                 guard = f"今日は {iso1}（JST）です。今日の情報のみ採用してください。過去日付は除外。"
                 composed = guard + "\n\nユーザー入力: " + msg
-                summary = _summarize_with_citations(gc, composed, results, (data.get("model") or "").strip())
+                summary = _summarize_with_citations(gc, composed, results, (data.get("model") or "").strip(), rank_query=msg)
 
                 reply = summary.get("answer") or summary.get("summary") or summary.get("text") or "情報を取得できませんでした。"
                 db.session.add(Message(content=reply, sender="assistant", conversation_id=cid))
@@ -842,29 +981,115 @@ def create_app() -> Flask:
 
         # 通常チャット
         gc: GeminiClient = current_app.extensions["gemini_client"]
+        requested_model = (data.get("model") or "").strip()
         try:
-            # Gemini API: role は "user" または "model" である必要があります
-            # "assistant" は "model" に変換
-            history = [{"role": "model" if m.sender == "assistant" else "user", "content": m.content}
-                       for m in Message.query.filter_by(conversation_id=cid).order_by(Message.id.asc()).all()][-50:]
-            reply, used = gc.chat(history, msg, requested_model=(data.get("model") or "").strip())
+            # 要約済みメモリ + 今回の発話より前の直近履歴（トークン予算内）
+            history, ctx = _build_chat_history(conv, user_msg, requested_model or gc.primary_model)
+            new_summary = None
+            if os.getenv("CHAT_COMBINED_SUMMARY", "true").lower() == "true":
+                # 返信とサイドバー要約を1回の呼び出しで得る（履歴の再送を省く）
+                try:
+                    reply, new_summary, used = gc.chat_with_summary(
+                        history, msg, conv.summary or "", requested_model=requested_model
+                    )
+                except GeminiFallbackError as e:
+                    logger.warning(f"Combined reply+summary failed, falling back to plain chat: {e}")
+            if new_summary is None:
+                reply, used = gc.chat(history, msg, requested_model=requested_model, call_type="chat")
         except GeminiFallbackError as e:
             return jsonify({"ok": False, "error": str(e)}), 502
 
         db.session.add(Message(content=reply, sender="assistant", conversation_id=cid))
+        if new_summary:
+            conv.summary = new_summary
+            conv.updated_at = datetime.utcnow()
         db.session.commit()
 
-        # 同期的に要約を生成
-        _generate_summary_sync(cid)
+        if new_summary is None:
+            # 要約は応答を待たせずに更新する
+            _schedule_summary(cid)
+        schedule_memory_update(cid, gc, current_app.extensions.get("rq_queue"))
 
         return jsonify({
             "ok": True,
             "reply": reply,
             "reply_html": render_markdown_safe(reply),
             "model": used,
-            "conversation_id": cid
+            "conversation_id": cid,
+            "prompt_tokens": ctx["prompt_tokens"],
         })
 
+    # ----------------- Chat API（ストリーミング） -----------------
+    @bp.route("/api/chat/stream", methods=["POST"])
+    @login_required
+    def api_chat_stream():
+        """
+        通常チャットを streamGenerateContent で逐次返す（text/event-stream）。
+        - data: {"delta": "..."} を断片ごとに送出
+        - 完了時に Message を保存し event: done を送出
+        - 書籍/天気/ニュースなど検索パスに回るメッセージは /api/chat と同じ JSON 応答を返す
+        """
+        data = _json()
+        msg = (data.get("message") or "").strip()
+        if not msg:
+            abort(400, description="message is required")
+
+        if _detect_search_route(msg):
+            return api_chat()
+
+        cid = data.get("conversation_id")
+        conv = Conversation.query.filter_by(id=cid, user_id=current_user.id).first() if cid else None
+        if not conv:
+            conv = Conversation(
+                title=f"新しい会話 {datetime.utcnow().strftime('%H:%M:%S')}",
+                user_id=current_user.id, is_pinned=False
+            )
+            db.session.add(conv)
+            db.session.commit()
+            cid = conv.id
+
+        # 保存（ユーザ発話）
+        user_msg = Message(content=msg, sender="user", conversation_id=cid)
+        db.session.add(user_msg)
+        db.session.commit()
+
+        gc: GeminiClient = current_app.extensions["gemini_client"]
+        requested_model = (data.get("model") or "").strip()
+        history, ctx = _build_chat_history(conv, user_msg, requested_model or gc.primary_model)
+
+        def generate():
+            chunks: List[str] = []
+            used = ""
+            try:
+                for delta, model in gc.chat_stream(history, msg, requested_model=requested_model):
+                    used = model
+                    chunks.append(delta)
+                    yield _sse({"delta": delta})
+            except GeminiFallbackError as e:
+                logger.error(f"Chat stream failed: {e}")
+                yield _sse({"ok": False, "error": str(e)}, event="error")
+                return
+
+            reply = "".join(chunks).strip()
+            db.session.add(Message(content=reply, sender="assistant", conversation_id=cid))
+            db.session.commit()
+
+            yield _sse({
+                "ok": True,
+                "reply_html": render_markdown_safe(reply),
+                "model": used,
+                "conversation_id": cid,
+                "prompt_tokens": ctx["prompt_tokens"],
+            }, event="done")
+            # 要約とメモリの更新はワーカー / バックグラウンドスレッドに任せる（ストリームを引き延ばさない）
+            _schedule_summary(cid)
+            schedule_memory_update(cid, gc, current_app.extensions.get("rq_queue"))
+
+        resp = Response(stream_with_context(generate()), mimetype="text/event-stream")
+        resp.headers["Cache-Control"] = "no-cache"
+        resp.headers["X-Accel-Buffering"] = "no"  # プロキシでのバッファリングを抑止
+        return resp
+
     # ----------------- Search + Summarize（独立API） -----------------
     @bp.route("/api/search_summarize", methods=["POST"])
     @login_required
@@ -955,31 +1180,14 @@ def create_app() -> Flask:
                     book_name = book_name.replace(suffix, "")
                 book_name = book_name.strip()
 
-                # 本の情報検索: 複数のクエリで検索し、結果をマージ
-                book_queries = [
-                    f'"{book_name}"',  # 完全一致検索
-                    f"{book_name} 書評",
-                    f"{book_name} 内容 目次",
-                    f"{book_name} レビュー 感想",
-                    f"{book_name} 著者",
-                ]
-
-                seen_urls = set()
-                for bq in book_queries:
-                    try:
-                        partial = sc.search(bq, top_k=5, recency_days=recency)
-                        for item in partial:
-                            url = item.get("url", "")
-                            if url and url not in seen_urls:
-                                seen_urls.add(url)
-                                results.append(item)
-                                if len(results) >= 15:  # 最大15件
-                                    break
-                    except Exception as e:
-                        logger.warning(f"Book search query failed: {bq}, error: {e}")
-                        continue
-                    if len(results) >= 15:
-                        break
+                # 本の情報検索: 書籍 API・信頼ドメイン・書評キーワードを同時に検索してマージ（最大15件）
+                # WebFetch は BOOK_SEARCH_SUMMARIZE_MAX_FETCH で有効にしたときだけ（既定は検索結果のみ）
+                results = BookSearchPlanner(sc).run(
+                    book_name,
+                    top_k=15,
+                    max_fetch=int(os.getenv("BOOK_SEARCH_SUMMARIZE_MAX_FETCH", "0")),
+                    recency_days=recency,
+                )
             elif is_date_query:
                 results = sc.search(query, top_k=5, recency_days=recency)
             else:
@@ -1048,7 +1256,7 @@ def create_app() -> Flask:
                 guard = f"今日は {iso1}（JST）です。最新の情報を優先してください。"
 
             composed = guard + "\n\nユーザーの要望: " + query
-            summary = _summarize_with_citations(gc, composed, results, (data.get("model") or "").strip())
+            summary = _summarize_with_citations(gc, composed, results, (data.get("model") or "").strip(), rank_query=query)
 
             # アシスタントの応答を保存
             reply = summary.get("answer") or summary.get("summary") or summary.get("text") or "情報を取得できませんでした。"
@@ -25,6 +25,9 @@ class Conversation(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     summary = db.Column(db.Text, nullable=True)  # ✅ AIによる会話要約を保存
+    # ローリングメモリ: memory_watermark_id までのターンを要約したもの（services/conversation_memory.py）
+    memory_summary = db.Column(db.Text, nullable=True)
+    memory_watermark_id = db.Column(db.Integer, nullable=True)
 
     user = db.relationship("User", backref=db.backref("conversations", lazy=True))
 
@@ -34,6 +37,8 @@ class Conversation(db.Model):
 
 class Message(db.Model):
     __tablename__ = "message"
+    # 履歴をキーセットで新しい順に読むためのインデックス（services/chat_context.py）
+    __table_args__ = (db.Index("ix_message_conversation_id_id", "conversation_id", "id"),)
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
     sender = db.Column(db.String(10), nullable=False)
@@ -83,3 +88,29 @@ class ResearchJob(db.Model):
     def __repr__(self):
         return f"<ResearchJob {self.task_id} status={self.status}>"
 
+
+class BookCatalogEntry(db.Model):
+    """
+    Google Books / NDL から取得した書誌のローカルカタログ（services/book_catalog.py）
+    検索は title_norm / author_norm に対して行う（SQLite は FTS5 trigram、PostgreSQL は pg_trgm）
+    """
+    __tablename__ = "book_catalog"
+    __table_args__ = (db.UniqueConstraint("source", "source_key", name="uq_book_catalog_source_key"),)
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(20), nullable=False)  # google_books, ndl
+    source_key = db.Column(db.String(255), nullable=False)  # Google Books の volume id / NDL のリンク
+    isbn = db.Column(db.String(13), nullable=True, index=True)
+    title = db.Column(db.String(500), nullable=False)
+    title_norm = db.Column(db.String(500), nullable=False, index=True)
+    authors = db.Column(db.String(500), nullable=True)  # カンマ区切り
+    author_norm = db.Column(db.String(500), nullable=True)
+    publisher = db.Column(db.String(255), nullable=True)
+    published_date = db.Column(db.String(20), nullable=True)
+    description = db.Column(db.Text, nullable=True)
+    info_link = db.Column(db.String(1000), nullable=True)
+    thumbnail = db.Column(db.String(1000), nullable=True)
+    category = db.Column(db.String(255), nullable=True)
+    fetched_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f"<BookCatalogEntry {self.source} {self.title[:20]}>"
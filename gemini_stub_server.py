@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+"""
+Gemini API のローカルスタブサーバ（オフライン動作確認用）
+
+実装しているエンドポイント（{ver} は v1beta など任意）:
+    POST   /{ver}/models/{model}:generateContent
+    POST   /{ver}/models/{model}:streamGenerateContent?alt=sse
+    POST   /{ver}/cachedContents
+    GET    /{ver}/cachedContents
+    GET    /{ver}/cachedContents/{id}
+    PATCH  /{ver}/cachedContents/{id}?updateMask=ttl
+    DELETE /{ver}/cachedContents/{id}
+
+使い方:
+    python gemini_stub_server.py --port 8089
+    GEMINI_API_BASE_URL=http://127.0.0.1:8089 GEMINI_HTTP_PRECONNECT=false python app.py
+
+応答本文は受け取ったプロンプト末尾の抜粋（responseSchema 指定時はスキーマどおりのダミー JSON）。
+usageMetadata はローカルの推定トークン数。
+cachedContent を参照した generateContent は cachedContentTokenCount を返し、
+期限切れ・未登録の名前には 404 を返す（本番 API と同じくクライアント側で再作成させる）。
+"""
+import re
+import json
+import time
+import uuid
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from services.gemini_client_mock import mock_json_value
+from services.token_estimator import estimate_tokens
+
+_caches: Dict[str, Dict[str, Any]] = {}
+_lock = threading.Lock()
+
+_GENERATE_RE = re.compile(r"^/[^/]+/models/([^/:]+):(generateContent|streamGenerateContent)$")
+_CACHE_RE = re.compile(r"^/[^/]+/(cachedContents)(?:/([^/]+))?$")
+
+
+def _parse_ttl(value: str) -> float:
+    try:
+        return float(str(value).rstrip("s"))
+    except ValueError:
+        return 3600.0
+
+
+def _contents_text(contents: Any) -> str:
+    texts = []
+    for c in contents or []:
+        for p in c.get("parts", []):
+            texts.append(p.get("text") or "")
+    return "\n".join(texts)
+
+
+def _cache_view(name: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "name": name,
+        "model": entry["model"],
+        "expireTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(entry["expires_at"])),
+        "usageMetadata": {"totalTokenCount": entry["tokens"]},
+    }
+
+
+def _live_cache(name: str) -> Optional[Dict[str, Any]]:
+    with _lock:
+        entry = _caches.get(name)
+        if entry and entry["expires_at"] <= time.time():
+            _caches.pop(name, None)
+            return None
+        return entry
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+
+    # ---------------- 共通 ----------------
+    def _body(self) -> Dict[str, Any]:
+        n = int(self.headers.get("Content-Length") or 0)
+        if not n:
+            return {}
+        try:
+            return json.loads(self.rfile.read(n))
+        except json.JSONDecodeError:
+            return {}
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status: int, message: str) -> None:
+        self._send_json(status, {"error": {"code": status, "message": message}})
+
+    def _route(self) -> Tuple[str, Dict[str, Any]]:
+        parsed = urlparse(self.path)
+        return parsed.path, {k: v[0] for k, v in parse_qs(parsed.query).items()}
+
+    def log_message(self, fmt: str, *args: Any) -> None:
+        print(f"[stub] {self.command} {self.path.split('?')[0]} " + (fmt % args))
+
+    # ---------------- generateContent ----------------
+    def _generate(self, model: str, body: Dict[str, Any]) -> Tuple[Optional[str], Dict[str, Any]]:
+        prompt = _contents_text(body.get("contents"))
+        cached_tokens = 0
+        cached_name = body.get("cachedContent")
+        if cached_name:
+            entry = _live_cache(cached_name)
+            if entry is None:
+                self._error(404, f"CachedContent not found (or permission denied): {cached_name}")
+                return None, {}
+            cached_tokens = entry["tokens"]
+        prompt_tokens = estimate_tokens(prompt) + cached_tokens
+        excerpt = prompt.strip()[-80:].replace("\n", " ")
+        schema = (body.get("generationConfig") or {}).get("responseSchema")
+        if schema:
+            text = json.dumps(mock_json_value(schema, f"[stub:{model}]"), ensure_ascii=False)
+        else:
+            text = f"[stub:{model}] {excerpt}"
+        usage = {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": estimate_tokens(text),
+            "totalTokenCount": prompt_tokens + estimate_tokens(text),
+        }
+        if cached_tokens:
+            usage["cachedContentTokenCount"] = cached_tokens
+        return text, usage
+
+    # ---------------- HTTP メソッド ----------------
+    def do_POST(self) -> None:
+        path, query = self._route()
+        body = self._body()
+        if self.latency:
+            time.sleep(self.latency)
+
+        m = _GENERATE_RE.match(path)
+        if m:
+            model, method = m.group(1), m.group(2)
+            text, usage = self._generate(model, body)
+            if text is None:
+                return
+            if method == "generateContent":
+                self._send_json(200, {
+                    "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+                    "usageMetadata": usage,
+                    "modelVersion": model,
+                })
+                return
+            # SSE: 数文字ずつ data: 行で返す
+            chunks = [text[i:i + 16] for i in range(0, len(text), 16)] or [""]
+            out = b""
+            for i, chunk in enumerate(chunks):
+                payload: Dict[str, Any] = {"candidates": [{"content": {"role": "model", "parts": [{"text": chunk}]}}]}
+                if i == len(chunks) - 1:
+                    payload["usageMetadata"] = usage
+                out += b"data: " + json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\r\n\r\n"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+            return
+
+        m = _CACHE_RE.match(path)
+        if m and not m.group(2):
+            model = (body.get("model") or "").replace("models/", "")
+            if not model:
+                self._error(400, "model is required")
+                return
+            tokens = estimate_tokens(_contents_text(body.get("contents")))
+            name = f"cachedContents/{uuid.uuid4().hex[:16]}"
+            entry = {"model": f"models/{model}", "tokens": tokens,
+                     "expires_at": time.time() + _parse_ttl(body.get("ttl", "3600s"))}
+            with _lock:
+                _caches[name] = entry
+            self._send_json(200, _cache_view(name, entry))
+            return
+
+        self._error(404, f"unknown endpoint: {path}")
+
+    def do_GET(self) -> None:
+        path, _ = self._route()
+        m = _CACHE_RE.match(path)
+        if not m:
+            self._error(404, f"unknown endpoint: {path}")
+            return
+        if m.group(2):
+            name = f"cachedContents/{m.group(2)}"
+            entry = _live_cache(name)
+            if entry is None:
+                self._error(404, f"CachedContent not found: {name}")
+                return
+            self._send_json(200, _cache_view(name, entry))
+            return
+        with _lock:
+            names = list(_caches.keys())
+        items = [_cache_view(n, e) for n in names if (e := _live_cache(n)) is not None]
+        self._send_json(200, {"cachedContents": items})
+
+    def do_PATCH(self) -> None:
+        path, query = self._route()
+        body = self._body()
+        m = _CACHE_RE.match(path)
+        if not m or not m.group(2):
+            self._error(404, f"unknown endpoint: {path}")
+            return
+        name = f"cachedContents/{m.group(2)}"
+        entry = _live_cache(name)
+        if entry is None:
+            self._error(404, f"CachedContent not found: {name}")
+            return
+        if "ttl" in query.get("updateMask", "ttl") and body.get("ttl"):
+            with _lock:
+                entry["expires_at"] = time.time() + _parse_ttl(body["ttl"])
+        self._send_json(200, _cache_view(name, entry))
+
+    def do_DELETE(self) -> None:
+        path, _ = self._route()
+        m = _CACHE_RE.match(path)
+        if not m or not m.group(2):
+            self._error(404, f"unknown endpoint: {path}")
+            return
+        name = f"cachedContents/{m.group(2)}"
+        with _lock:
+            existed = _caches.pop(name, None)
+        if existed is None:
+            self._error(404, f"CachedContent not found: {name}")
+            return
+        self._send_json(200, {})
+
+    def do_HEAD(self) -> None:
+        # preconnect 用
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Gemini API local stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="POST ごとの人工的な遅延（秒）")
+    args = parser.parse_args()
+
+    StubHandler.latency = args.latency
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"Gemini stub listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""add book_catalog table (local Google Books / NDL catalog)
+
+Revision ID: add_book_catalog_20261016
+Revises: add_conversation_memory_20261016
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_book_catalog_20261016'
+down_revision = 'add_conversation_memory_20261016'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'book_catalog',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('source', sa.String(length=20), nullable=False),
+        sa.Column('source_key', sa.String(length=255), nullable=False),
+        sa.Column('isbn', sa.String(length=13), nullable=True),
+        sa.Column('title', sa.String(length=500), nullable=False),
+        sa.Column('title_norm', sa.String(length=500), nullable=False),
+        sa.Column('authors', sa.String(length=500), nullable=True),
+        sa.Column('author_norm', sa.String(length=500), nullable=True),
+        sa.Column('publisher', sa.String(length=255), nullable=True),
+        sa.Column('published_date', sa.String(length=20), nullable=True),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.Column('info_link', sa.String(length=1000), nullable=True),
+        sa.Column('thumbnail', sa.String(length=1000), nullable=True),
+        sa.Column('category', sa.String(length=255), nullable=True),
+        sa.Column('fetched_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('source', 'source_key', name='uq_book_catalog_source_key'),
+    )
+    with op.batch_alter_table('book_catalog', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_book_catalog_isbn'), ['isbn'], unique=False)
+        batch_op.create_index(batch_op.f('ix_book_catalog_title_norm'), ['title_norm'], unique=False)
+        batch_op.create_index(batch_op.f('ix_book_catalog_fetched_at'), ['fetched_at'], unique=False)
+
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.execute(
+            'CREATE INDEX IF NOT EXISTS ix_book_catalog_title_trgm '
+            'ON book_catalog USING gin (title_norm gin_trgm_ops)'
+        )
+        op.execute(
+            'CREATE INDEX IF NOT EXISTS ix_book_catalog_author_trgm '
+            'ON book_catalog USING gin (author_norm gin_trgm_ops)'
+        )
+    elif dialect == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS book_catalog_fts "
+            "USING fts5(title_norm, author_norm, tokenize='trigram')"
+        )
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_book_catalog_author_trgm')
+        op.execute('DROP INDEX IF EXISTS ix_book_catalog_title_trgm')
+    elif dialect == 'sqlite':
+        op.execute('DROP TABLE IF EXISTS book_catalog_fts')
+
+    with op.batch_alter_table('book_catalog', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_book_catalog_fetched_at'))
+        batch_op.drop_index(batch_op.f('ix_book_catalog_title_norm'))
+        batch_op.drop_index(batch_op.f('ix_book_catalog_isbn'))
+
+    op.drop_table('book_catalog')
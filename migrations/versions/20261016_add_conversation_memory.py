@@ -0,0 +1,26 @@
+"""add rolling memory columns to conversation
+
+Revision ID: add_conversation_memory_20261016
+Revises: restore_message_index_20261016
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_conversation_memory_20261016'
+down_revision = 'restore_message_index_20261016'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('conversation', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('memory_summary', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('memory_watermark_id', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('conversation', schema=None) as batch_op:
+        batch_op.drop_column('memory_watermark_id')
+        batch_op.drop_column('memory_summary')
@@ -0,0 +1,25 @@
+"""restore message(conversation_id, id) index
+
+Revision ID: restore_message_index_20261016
+Revises: 89e7a3aca8eb
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'restore_message_index_20261016'
+down_revision = '89e7a3aca8eb'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 89e7a3aca8eb の autogenerate で落ちたインデックスを戻す（モデル側にも宣言済み）
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.create_index('ix_message_conversation_id_id', ['conversation_id', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_index('ix_message_conversation_id_id')
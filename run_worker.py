@@ -147,6 +147,21 @@ def main():
                     self.send_header("Content-type", "text/plain")
                     self.end_headers()
                     self.wfile.write(b"OK")
+                elif self.path.split("?")[0] == "/metrics":
+                    # Prometheus 形式（このプロセスの値。ジョブは fork 先で動くため Gemini 呼び出しは含まれない）
+                    from urllib.parse import parse_qs, urlparse
+                    from services.metrics import metrics_authorized, render_prometheus
+                    token = (parse_qs(urlparse(self.path).query).get("token") or [""])[0]
+                    if not metrics_authorized(self.headers.get("Authorization", ""), token):
+                        self.send_response(401)
+                        self.end_headers()
+                        return
+                    body = render_prometheus().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
                 else:
                     self.send_response(404)
                     self.end_headers()
@@ -0,0 +1,371 @@
+# services/backfill.py
+"""
+会話サマリー（Conversation.summary）の一括再生成（要約プロンプトやモデルを変えたとき用）
+
+- Conversation.id のキーセットページングで batch_size 件ずつ処理（全件ロードしない）
+- 1バッチ内は analyze_conversation を最大 concurrency 並列で実行
+  （優先度 BACKGROUND で全ワーカー共通のレート制限に従う。チャットを押しのけない）
+- バッチごとにまとめてコミットし、最後に処理した id をチェックポイントとして保存
+  → 中断・失敗しても同じ位置から再開できる
+- 進捗（処理件数・失敗件数・ETA）は backfill_status() / 管理画面で確認
+- updated_at は更新しない（サイドバーの並び順を変えないため）
+- 実行中は状態の updated_at をハートビートとして更新する。SUMMARY_BACKFILL_STALE_SEC 以上
+  更新が無い queued / running / cancel_requested は stalled（ワーカーのクラッシュ・job_timeout）とみなし、
+  チェックポイントから再開・やり直しできる
+
+状態は REDIS_URL があれば Redis（全プロセス共通）、無ければプロセス内に保持する。
+プロセス内の状態（チェックポイント）はプロセスの再起動で消えるため、再起動をまたいだ再開には Redis が必要。
+"""
+import os
+import time
+import json
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.models import db, Conversation, Message
+from services.metrics import gemini_caller
+from services.rate_limiter import BACKGROUND, gemini_priority
+from services.redis_client import get_redis, mark_redis_failed
+
+logger = logging.getLogger(__name__)
+
+_STATE_KEY = "backfill:summaries"
+_LOCK_KEY = "backfill:summaries:lock"
+_LOCK_TTL_SEC = 600
+_HEARTBEAT_SEC = 30
+_ACTIVE_STATUSES = ("queued", "running", "cancel_requested")
+_MAX_MESSAGES = 100  # 1会話あたり要約に渡す直近メッセージ数（generate_summary_and_title と同じ）
+_MAX_FAILED_IDS = 50
+
+_local_state: Dict[str, str] = {}
+_local_lock = threading.Lock()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+# -------------------------------
+# 状態（チェックポイント）
+# -------------------------------
+def _load_state() -> Dict[str, str]:
+    r = get_redis()
+    if r is not None:
+        try:
+            return r.hgetall(_STATE_KEY) or {}
+        except Exception as e:
+            mark_redis_failed(e)
+    with _local_lock:
+        return dict(_local_state)
+
+
+def _save_state(fields: Dict[str, Any]) -> None:
+    data = {k: v if isinstance(v, str) else json.dumps(v) for k, v in fields.items()}
+    r = get_redis()
+    if r is not None:
+        try:
+            r.hset(_STATE_KEY, mapping=data)
+            return
+        except Exception as e:
+            mark_redis_failed(e)
+    with _local_lock:
+        _local_state.update(data)
+
+
+def _reset_state() -> None:
+    r = get_redis()
+    if r is not None:
+        try:
+            r.delete(_STATE_KEY)
+        except Exception as e:
+            mark_redis_failed(e)
+    with _local_lock:
+        _local_state.clear()
+
+
+def _acquire_lock(owner: str) -> bool:
+    r = get_redis()
+    if r is None:
+        return True  # 単一プロセス運用（RQ なし）では二重起動は start_backfill 側で防ぐ
+    try:
+        if r.set(_LOCK_KEY, owner, nx=True, ex=_LOCK_TTL_SEC):
+            return True
+        return r.get(_LOCK_KEY) == owner
+    except Exception as e:
+        mark_redis_failed(e)
+        return True
+
+
+def _refresh_lock(owner: str) -> None:
+    r = get_redis()
+    if r is None:
+        return
+    try:
+        if r.get(_LOCK_KEY) == owner:
+            r.expire(_LOCK_KEY, _LOCK_TTL_SEC)
+    except Exception as e:
+        mark_redis_failed(e)
+
+
+def _release_lock(owner: str) -> None:
+    r = get_redis()
+    if r is None:
+        return
+    try:
+        if r.get(_LOCK_KEY) == owner:
+            r.delete(_LOCK_KEY)
+    except Exception as e:
+        mark_redis_failed(e)
+
+
+def _heartbeat(owner: str) -> None:
+    _save_state({"updated_at": time.time()})
+    _refresh_lock(owner)
+
+
+def _int(state: Dict[str, str], key: str, default: int = 0) -> int:
+    try:
+        return int(float(state.get(key, default)))
+    except (TypeError, ValueError):
+        return default
+
+
+def _is_stale(state: Dict[str, str]) -> bool:
+    """実行中のはずの状態がハートビートを失っているか（ワーカーが落ちた・job_timeout で殺された）"""
+    if state.get("status") not in _ACTIVE_STATUSES:
+        return False
+    try:
+        updated_at = float(state.get("updated_at") or 0)
+    except ValueError:
+        updated_at = 0.0
+    return time.time() - updated_at > _env_int("SUMMARY_BACKFILL_STALE_SEC", _LOCK_TTL_SEC)
+
+
+def backfill_status() -> Dict[str, Any]:
+    """進捗レポート（管理画面・API 用）"""
+    state = _load_state()
+    if not state:
+        return {"status": "idle"}
+    total = _int(state, "total")
+    processed = _int(state, "processed")
+    started_at = float(state.get("started_at") or 0)
+    elapsed = (float(state.get("updated_at") or time.time()) - started_at) if started_at else 0.0
+    # ETA は今回の実行で処理した件数から見積もる（再開前の分は含めない）
+    run_processed = processed - _int(state, "resumed_from_processed")
+    remaining = max(0, total - processed)
+    eta = (elapsed / run_processed * remaining) if run_processed > 0 and state.get("status") == "running" else None
+    return {
+        "status": "stalled" if _is_stale(state) else state.get("status", "idle"),
+        "last_id": _int(state, "last_id"),
+        "total": total,
+        "processed": processed,
+        "updated": _int(state, "updated"),
+        "skipped": _int(state, "skipped"),
+        "failed": _int(state, "failed"),
+        "failed_ids": json.loads(state.get("failed_ids") or "[]"),
+        "percent": round(100.0 * processed / total, 1) if total else 0.0,
+        "elapsed_sec": round(elapsed, 1),
+        "eta_sec": round(eta, 1) if eta is not None else None,
+        "rate_per_min": round(run_processed / elapsed * 60, 1) if elapsed > 0 and run_processed > 0 else None,
+        "batch_size": _int(state, "batch_size"),
+        "concurrency": _int(state, "concurrency"),
+        "error": state.get("error", ""),
+    }
+
+
+def request_cancel() -> None:
+    """実行中のバックフィルを次のバッチ境界で止める（チェックポイントは残る）"""
+    state = _load_state()
+    if _is_stale(state):
+        # 止めるワーカーがいないので、その場で cancelled にする
+        _save_state({"status": "cancelled", "updated_at": time.time()})
+    elif state.get("status") in ("queued", "running"):
+        _save_state({"status": "cancel_requested", "updated_at": time.time()})
+
+
+# -------------------------------
+# 本体
+# -------------------------------
+def _conversation_dump(conversation_id: int) -> List[Dict[str, str]]:
+    """直近 _MAX_MESSAGES 件を (conversation_id, id) インデックスで取得し、古い順に並べる"""
+    rows = (
+        db.session.query(Message.sender, Message.content)
+        .filter(Message.conversation_id == conversation_id)
+        .order_by(Message.id.desc())
+        .limit(_MAX_MESSAGES)
+        .all()
+    )
+    rows.reverse()
+    return [{"role": sender, "content": content} for sender, content in rows]
+
+
+def _summarize_one(gc: Any, conversation_id: int, dump: List[Dict[str, str]]) -> Tuple[int, Optional[str], str]:
+    """returns (conversation_id, summary or None, error)"""
+    try:
+        with gemini_priority(BACKGROUND), gemini_caller("summary_backfill"):
+            analysis = gc.analyze_conversation(dump, use_cache=False)
+        return conversation_id, (analysis.get("summary") or "").strip(), ""
+    except Exception as e:
+        return conversation_id, None, str(e)
+
+
+def run_backfill(gc: Any, batch_size: int = 50, concurrency: int = 4, restart: bool = False) -> Dict[str, Any]:
+    """
+    チェックポイントから再開して全会話のサマリーを作り直す（アプリコンテキスト内で呼ぶ）。
+    restart=True なら先頭からやり直す。
+    """
+    owner = f"{os.getpid()}:{threading.get_ident()}:{time.time()}"
+    if not _acquire_lock(owner):
+        logger.warning("[Backfill] another run holds the lock; exiting")
+        return backfill_status()
+
+    try:
+        state = {} if restart else _load_state()
+        if state.get("status") == "done":
+            state = {}  # 完了済みなら新しい実行として最初から
+        last_id = _int(state, "last_id")
+        processed = _int(state, "processed")
+        updated = _int(state, "updated")
+        skipped = _int(state, "skipped")
+        failed = _int(state, "failed")
+        failed_ids: List[int] = json.loads(state.get("failed_ids") or "[]")
+        total = processed + db.session.query(Conversation.id).filter(Conversation.id > last_id).count()
+
+        now = time.time()
+        _save_state({
+            "status": "running", "last_id": last_id, "total": total,
+            "processed": processed, "updated": updated, "skipped": skipped, "failed": failed,
+            "failed_ids": failed_ids, "resumed_from_processed": processed,
+            "started_at": now, "updated_at": now,
+            "batch_size": batch_size, "concurrency": concurrency, "error": "",
+        })
+        logger.info(f"[Backfill] start from id>{last_id} total={total} batch={batch_size} concurrency={concurrency}")
+
+        executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="summary-backfill")
+        try:
+            while True:
+                if _load_state().get("status") == "cancel_requested":
+                    _save_state({"status": "cancelled", "updated_at": time.time()})
+                    logger.info(f"[Backfill] cancelled at id={last_id}")
+                    break
+
+                ids = [cid for (cid,) in db.session.query(Conversation.id)
+                       .filter(Conversation.id > last_id)
+                       .order_by(Conversation.id.asc())
+                       .limit(batch_size)
+                       .all()]
+                if not ids:
+                    _save_state({"status": "done", "updated_at": time.time()})
+                    logger.info(f"[Backfill] done processed={processed} updated={updated} failed={failed}")
+                    break
+
+                # DB 読み出しはこのスレッドで行い、並列にするのは Gemini 呼び出しだけ
+                dumps = {cid: _conversation_dump(cid) for cid in ids}
+                jobs = []
+                for cid in ids:
+                    if not dumps[cid]:
+                        skipped += 1
+                        continue
+                    ctx = contextvars.copy_context()
+                    jobs.append(executor.submit(ctx.run, _summarize_one, gc, cid, dumps[cid]))
+
+                beat = time.monotonic()
+                for fut in jobs:
+                    cid, summary, error = fut.result()
+                    if time.monotonic() - beat > _HEARTBEAT_SEC:
+                        _heartbeat(owner)
+                        beat = time.monotonic()
+                    if summary:
+                        # updated_at は onupdate で現在時刻になるので、元の値を明示して据え置く
+                        db.session.query(Conversation).filter(Conversation.id == cid).update(
+                            {Conversation.summary: summary, Conversation.updated_at: Conversation.updated_at},
+                            synchronize_session=False,
+                        )
+                        updated += 1
+                    elif error:
+                        failed += 1
+                        failed_ids = (failed_ids + [cid])[-_MAX_FAILED_IDS:]
+                        logger.warning(f"[Backfill] conversation {cid} failed: {error}")
+                    else:
+                        skipped += 1
+                db.session.commit()
+
+                processed += len(ids)
+                last_id = ids[-1]
+                _save_state({
+                    "last_id": last_id, "processed": processed, "updated": updated,
+                    "skipped": skipped, "failed": failed, "failed_ids": failed_ids,
+                    "updated_at": time.time(),
+                })
+                _refresh_lock(owner)
+                status = backfill_status()
+                logger.info(
+                    f"[Backfill] {processed}/{total} ({status['percent']}%) updated={updated} "
+                    f"failed={failed} eta={status['eta_sec']}s"
+                )
+        finally:
+            executor.shutdown(wait=True)
+    except Exception as e:
+        db.session.rollback()
+        _save_state({"status": "failed", "error": str(e)[:500], "updated_at": time.time()})
+        logger.error(f"[Backfill] failed: {e}")
+        raise
+    finally:
+        _release_lock(owner)
+    return backfill_status()
+
+
+def start_backfill(
+    gc: Any, rq_queue: Any = None, batch_size: int = 0, concurrency: int = 0, restart: bool = False
+) -> Dict[str, Any]:
+    """
+    管理画面から起動する。RQ があればワーカーへ、無ければアプリ内のバックグラウンドスレッドで実行。
+    既に実行中なら何もしない（ハートビートが途絶えた stalled の実行は引き継ぐ）。
+    """
+    status = backfill_status()["status"]
+    if status in _ACTIVE_STATUSES:
+        return backfill_status()
+    if status == "stalled":
+        logger.warning("[Backfill] previous run stopped sending heartbeats; taking over")
+    if get_redis() is None:
+        logger.info("[Backfill] no Redis: checkpoint is kept in this process only (lost on restart)")
+    batch_size = batch_size or _env_int("SUMMARY_BACKFILL_BATCH_SIZE", 50)
+    concurrency = concurrency or _env_int("SUMMARY_BACKFILL_CONCURRENCY", 4)
+    if restart:
+        _reset_state()
+    _save_state({
+        "status": "queued", "batch_size": batch_size, "concurrency": concurrency, "error": "",
+        "updated_at": time.time(),
+    })
+
+    if rq_queue is not None:
+        try:
+            rq_queue.enqueue(
+                "services.tasks.backfill_conversation_summaries",
+                batch_size, concurrency, restart,
+                job_timeout=6 * 3600,
+            )
+            return backfill_status()
+        except Exception as e:
+            logger.warning(f"[Backfill] enqueue failed, running in-process: {e}")
+
+    from flask import current_app
+    app = current_app._get_current_object()
+
+    def _run() -> None:
+        with app.app_context():
+            try:
+                run_backfill(gc, batch_size, concurrency, restart)
+            except Exception:
+                pass  # 状態は run_backfill 側で failed に更新済み
+            finally:
+                db.session.remove()
+
+    threading.Thread(target=_run, name="summary-backfill", daemon=True).start()
+    return backfill_status()
@@ -0,0 +1,342 @@
+# services/book_catalog.py
+"""
+書誌のローカルカタログ（Google Books / NDL の結果を DB に蓄積し、次からはネットワークに出ない）
+
+- GoogleBooksClient / NDLClient の正規化済み結果を (source, source_key) で upsert する
+  （ISBN・タイトル・著者・出版社・紹介文・リンク）
+- 検索は正規化したタイトル・著者（NFKC・小文字・空白と記号の除去・「著」「訳」などの役割表記の除去）で行う
+  - SQLite（開発）: FTS5 の trigram トークナイザ。クエリの 3-gram の OR で候補を引く
+  - PostgreSQL（本番）: pg_trgm の % 演算子（GIN インデックス。マイグレーションで作成）
+  - どちらも使えなければ LIKE
+  候補をタイトルの類似度（difflib）と著者の一致で採点し、BOOK_CATALOG_MIN_SCORE 以上を返す
+- fetched_at が BOOK_CATALOG_TTL_DAYS より古いエントリは stale（ネットワークで取り直して上書きする）
+- DB へはリクエストの db.session ではなく、呼び出しごとの Session で読み書きする
+  （fetch_executor のワーカースレッドから呼ばれても session を共有しない）。
+  アプリコンテキストが無い・テーブルが無い場合は何もしない（カタログなしで従来どおり動く）
+
+環境変数:
+    BOOK_CATALOG            true/false（既定 true）
+    BOOK_CATALOG_TTL_DAYS   エントリを新しいとみなす日数（既定 30）
+    BOOK_CATALOG_MIN_SCORE  一致とみなすスコア（0〜1。既定 0.75）
+"""
+import os
+import re
+import logging
+import threading
+import time
+import unicodedata
+from datetime import datetime, timedelta
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+SOURCES = ("google_books", "ndl")
+
+_CANDIDATES = 50
+_MAX_QUERY_GRAMS = 32
+_ROLE_RE = re.compile(r"[\[［(（]?(著|訳|編|監修|原作|作|文|絵|イラスト|著者|編著|共著|翻訳)[\]］)）]?$")
+_ISBN_RE = re.compile(r"97[89]\d{10}|\d{9}[\dX]")
+
+_PROBE_RETRY_SEC = 60
+
+_fts_lock = threading.Lock()
+_fts_ready: Dict[str, bool] = {}     # engine URL → FTS5 / pg_trgm が使える（成功だけを覚える）
+_fts_failed_at: Dict[str, float] = {}  # engine URL → 最後に使えなかった時刻（_PROBE_RETRY_SEC 後に再判定）
+
+
+def catalog_enabled() -> bool:
+    return os.getenv("BOOK_CATALOG", "true").lower() == "true"
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def normalize_title(title: str) -> str:
+    t = unicodedata.normalize("NFKC", title or "").lower()
+    return "".join(ch for ch in t if ch.isalnum())
+
+
+def normalize_author(author: str) -> str:
+    """'岸見 一郎 著, 古賀史健' → '岸見一郎,古賀史健'"""
+    names = []
+    for part in re.split(r"[,、，/・;]|\s{2,}", unicodedata.normalize("NFKC", author or "")):
+        name = _ROLE_RE.sub("", part.strip())
+        name = "".join(ch for ch in name.lower() if ch.isalnum())
+        if name:
+            names.append(name)
+    return ",".join(names)
+
+
+def _normalize_isbn(value: Any) -> Optional[str]:
+    if not value:
+        return None
+    m = _ISBN_RE.search(re.sub(r"[^0-9X]", "", str(value).upper()))
+    return m.group(0) if m else None
+
+
+def _source_key(source: str, r: Dict[str, Any]) -> Optional[str]:
+    link = r.get("info_link") or r.get("link") or r.get("url") or ""
+    if source == "google_books" and link:
+        volume = parse_qs(urlsplit(link).query).get("id")
+        if volume:
+            return volume[0]
+    return link[:255] or _normalize_isbn(r.get("isbn"))
+
+
+def _authors_text(r: Dict[str, Any]) -> str:
+    authors = r.get("authors")
+    if isinstance(authors, list):
+        return ", ".join(a for a in authors if a)
+    return r.get("author") or authors or ""
+
+
+def _session() -> Optional[Session]:
+    if not catalog_enabled():
+        return None
+    try:
+        from flask import has_app_context
+        if not has_app_context():
+            return None
+        from app.models import db
+        return Session(db.engine)
+    except Exception as e:
+        logger.debug(f"[Book Catalog] unavailable: {e}")
+        return None
+
+
+# -------------------------------
+# 全文検索インデックス（方言ごと）
+# -------------------------------
+def _search_backend(session: Session) -> str:
+    """
+    'fts5' / 'pg_trgm' / 'like'。SQLite の FTS5 テーブルは無ければ作る（create_all では作られない）
+    使えなかった場合は _PROBE_RETRY_SEC の間だけ LIKE にし、その後もう一度判定する
+    （マイグレーション前に判定が走っても、プロセスを再起動せずに索引を使い始める）
+    """
+    bind = session.get_bind()
+    key = str(bind.url)
+    dialect = bind.dialect.name
+    indexed = "fts5" if dialect == "sqlite" else "pg_trgm"
+    with _fts_lock:
+        if _fts_ready.get(key):
+            return indexed
+        if time.monotonic() - _fts_failed_at.get(key, float("-inf")) < _PROBE_RETRY_SEC:
+            return "like"
+        ok = False
+        try:
+            if dialect == "sqlite":
+                session.execute(text(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS book_catalog_fts "
+                    "USING fts5(title_norm, author_norm, tokenize='trigram')"
+                ))
+                # FTS テーブルより前に入っていた行を索引へ入れる
+                session.execute(text(
+                    "INSERT INTO book_catalog_fts(rowid, title_norm, author_norm) "
+                    "SELECT id, title_norm, COALESCE(author_norm, '') FROM book_catalog "
+                    "WHERE id NOT IN (SELECT rowid FROM book_catalog_fts)"
+                ))
+                session.commit()
+                ok = True
+            elif dialect == "postgresql":
+                ok = bool(session.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).scalar())
+        except Exception as e:
+            session.rollback()
+            logger.warning(f"[Book Catalog] full-text index unavailable on {dialect}, using LIKE: {e}")
+        if ok:
+            _fts_ready[key] = True
+            _fts_failed_at.pop(key, None)
+        else:
+            _fts_failed_at[key] = time.monotonic()
+    return indexed if ok else "like"
+
+
+def _fts_query(title_norm: str) -> str:
+    grams = list(dict.fromkeys(title_norm[i:i + 3] for i in range(len(title_norm) - 2)))[:_MAX_QUERY_GRAMS]
+    return "title_norm : (" + " OR ".join('"' + g.replace('"', '""') + '"' for g in grams) + ")"
+
+
+def _candidate_ids(session: Session, title_norm: str) -> List[int]:
+    backend = _search_backend(session)
+    params: Dict[str, Any] = {"limit": _CANDIDATES}
+    if backend == "fts5" and len(title_norm) >= 3:
+        sql = "SELECT rowid FROM book_catalog_fts WHERE book_catalog_fts MATCH :q ORDER BY rank LIMIT :limit"
+        params["q"] = _fts_query(title_norm)
+    elif backend == "pg_trgm":
+        sql = (
+            "SELECT id FROM book_catalog WHERE title_norm % :q "
+            "ORDER BY similarity(title_norm, :q) DESC LIMIT :limit"
+        )
+        params["q"] = title_norm
+    else:
+        return _like_ids(session, title_norm)
+    try:
+        return [row[0] for row in session.execute(text(sql), params)]
+    except Exception as e:
+        session.rollback()
+        logger.warning(f"[Book Catalog] {backend} query failed, using LIKE: {e}")
+        return _like_ids(session, title_norm)
+
+
+def _like_ids(session: Session, title_norm: str) -> List[int]:
+    sql = "SELECT id FROM book_catalog WHERE title_norm LIKE :q ORDER BY fetched_at DESC LIMIT :limit"
+    return [row[0] for row in session.execute(text(sql), {"q": f"%{title_norm}%", "limit": _CANDIDATES})]
+
+
+def _sync_fts(session: Session, entry_id: int, title_norm: str, author_norm: str) -> None:
+    if _search_backend(session) != "fts5":
+        return
+    session.execute(text("DELETE FROM book_catalog_fts WHERE rowid = :id"), {"id": entry_id})
+    session.execute(
+        text("INSERT INTO book_catalog_fts(rowid, title_norm, author_norm) VALUES (:id, :t, :a)"),
+        {"id": entry_id, "t": title_norm, "a": author_norm},
+    )
+
+
+# -------------------------------
+# 書き込み
+# -------------------------------
+def upsert_results(source: str, results: List[Dict[str, Any]]) -> int:
+    """GoogleBooksClient / NDLClient の正規化済み結果をカタログへ保存（更新した件数）"""
+    if source not in SOURCES or not results:
+        return 0
+    session = _session()
+    if session is None:
+        return 0
+    from app.models import BookCatalogEntry
+
+    saved = 0
+    now = datetime.utcnow()
+    try:
+        with session:
+            # 索引の判定（FTS5 テーブル作成・コミットを伴う）は書き込みを始める前に済ませる
+            _search_backend(session)
+            for r in results:
+                title = (r.get("title") or "").strip()
+                key = _source_key(source, r)
+                if not title or not key:
+                    continue
+                authors = _authors_text(r)
+                entry = session.query(BookCatalogEntry).filter_by(source=source, source_key=key).first()
+                if entry is None:
+                    entry = BookCatalogEntry(source=source, source_key=key)
+                    session.add(entry)
+                entry.title = title[:500]
+                entry.title_norm = normalize_title(title)[:500]
+                entry.authors = authors[:500] or None
+                entry.author_norm = normalize_author(authors)[:500] or None
+                entry.isbn = _normalize_isbn(r.get("isbn")) or entry.isbn
+                entry.publisher = (r.get("publisher") or entry.publisher or "")[:255] or None
+                entry.published_date = (r.get("published_date") or entry.published_date or "")[:20] or None
+                entry.description = r.get("description") or entry.description
+                entry.info_link = (r.get("info_link") or r.get("link") or r.get("url") or "")[:1000] or None
+                entry.thumbnail = (r.get("thumbnail") or "")[:1000] or None
+                entry.category = (r.get("category") or "")[:255] or None
+                entry.fetched_at = now
+                session.flush()
+                _sync_fts(session, entry.id, entry.title_norm, entry.author_norm or "")
+                saved += 1
+            session.commit()
+    except Exception as e:
+        logger.warning(f"[Book Catalog] upsert failed for {source}: {e}")
+        return 0
+    logger.info(f"[Book Catalog] upserted {saved} {source} entries")
+    return saved
+
+
+# -------------------------------
+# 読み出し
+# -------------------------------
+def _to_result(entry: Any) -> Dict[str, Any]:
+    """クライアントが返す形式に戻す（Google Books / NDL それぞれのキー）"""
+    if entry.source == "google_books":
+        return {
+            "title": entry.title,
+            "authors": [a.strip() for a in (entry.authors or "").split(",") if a.strip()],
+            "publisher": entry.publisher,
+            "published_date": entry.published_date,
+            "description": entry.description or "",
+            "snippet": entry.description or "",
+            "thumbnail": entry.thumbnail,
+            "info_link": entry.info_link,
+            "url": entry.info_link,
+            "isbn": entry.isbn,
+        }
+    return {
+        "title": entry.title,
+        "link": entry.info_link,
+        "url": entry.info_link,
+        "author": entry.authors,
+        "category": entry.category,
+        "publisher": entry.publisher,
+        "isbn": entry.isbn,
+    }
+
+
+def _match_score(q_title: str, q_author: str, entry: Any) -> float:
+    score = SequenceMatcher(None, q_title, entry.title_norm).ratio()
+    # 副題・シリーズ名付きのタイトル（「嫌われる勇気」→「嫌われる勇気 自己啓発の源流…」）
+    if q_title and q_title in entry.title_norm:
+        score = max(score, 0.9)
+    if q_author:
+        names = [n for n in (entry.author_norm or "").split(",") if n]
+        if names:
+            best = max(SequenceMatcher(None, q_author, n).ratio() for n in names)
+            if best < 0.6 and not any(q_author in n or n in q_author for n in names):
+                return 0.0
+    return score
+
+
+def lookup(
+    title: str,
+    author: Optional[str] = None,
+    top_k: int = 10,
+) -> Dict[str, Tuple[List[Dict[str, Any]], bool]]:
+    """
+    カタログから書誌を探す
+
+    Returns:
+        {source: (結果のリスト, すべて新しいか)}。一致が無い source は含まない
+    """
+    q_title = normalize_title(title)
+    if not q_title:
+        return {}
+    session = _session()
+    if session is None:
+        return {}
+    from app.models import BookCatalogEntry
+
+    q_author = normalize_author(author or "").split(",")[0] if author else ""
+    min_score = _env_float("BOOK_CATALOG_MIN_SCORE", 0.75)
+    stale_before = datetime.utcnow() - timedelta(days=_env_float("BOOK_CATALOG_TTL_DAYS", 30))
+    found: Dict[str, List[Tuple[float, Any]]] = {}
+    try:
+        with session:
+            ids = _candidate_ids(session, q_title)
+            if not ids:
+                return {}
+            for entry in session.query(BookCatalogEntry).filter(BookCatalogEntry.id.in_(ids)):
+                score = _match_score(q_title, q_author, entry)
+                if score >= min_score:
+                    found.setdefault(entry.source, []).append((score, entry))
+            out: Dict[str, Tuple[List[Dict[str, Any]], bool]] = {}
+            for source, scored in found.items():
+                scored.sort(key=lambda t: -t[0])
+                entries = [e for _, e in scored[:top_k]]
+                fresh = all(e.fetched_at and e.fetched_at >= stale_before for e in entries)
+                out[source] = ([_to_result(e) for e in entries], fresh)
+    except Exception as e:
+        logger.warning(f"[Book Catalog] lookup failed: {e}")
+        return {}
+    if out:
+        summary = ", ".join(f"{s}={len(r)}{'' if f else '(stale)'}" for s, (r, f) in out.items())
+        logger.info(f"[Book Catalog] hit for '{title}': {summary}")
+    return out
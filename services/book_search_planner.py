@@ -0,0 +1,296 @@
+# services/book_search_planner.py
+"""
+書籍検索プランナー（search_book / search_book_v2 / api_search_summarize の書籍検索を一本化）
+
+- Google Books・NDL・信頼ドメインの Web 検索（site:）・書評キーワードの Web 検索を
+  1つの期限（BOOK_SEARCH_DEADLINE_SEC）の中で同時に投げる（services/fetch_executor.py）
+- 結果は届いた順に正規化 URL で重複排除しながら集め、最後に本文の近似重複も落とす
+- 高品質なソースが BOOK_SEARCH_ENOUGH_SOURCES 件、うち信頼ドメインのページが
+  BOOK_SEARCH_MIN_TRUSTED_PAGES 件そろった時点で打ち切り、まだ始まっていない検索は取り下げる。
+  書籍 API・カタログの書誌は書名に合うものだけを数え、数えるのは API_QUALITY_CAP 件まで
+  （緩く一致した書誌だけで打ち切って Web ページと本文が取れなくなるのを防ぐ）
+- 書名に合う信頼ドメインの結果が届いたら、残りの検索を待たずにその場で WebFetch（enriched_content）を始める。
+  枠が余れば、最後に残りの結果から関連度（services/ranking.py）の高いものを取得する
+- 最終的な並びは WebFetch できた結果が先頭、残りはレイヤーの優先度順
+  （書籍 API → 信頼ドメイン → 書評キーワード）、同じレイヤー内は到着順
+- 書籍 API の書誌は先にローカルカタログ（services/book_catalog.py）を引き、新しい一致があれば
+  その API は呼ばない。API から取れた書誌はカタログへ保存する
+
+環境変数:
+    BOOK_SEARCH_DEADLINE_SEC      検索＋WebFetch 全体の期限（既定 15秒）
+    BOOK_SEARCH_ENOUGH_SOURCES    打ち切る高品質ソース数（既定 6）
+    BOOK_SEARCH_MIN_TRUSTED_PAGES 打ち切りに必要な信頼ドメインのページ数（既定 2）
+"""
+import os
+import time
+import logging
+from concurrent.futures import Future, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from services.book_catalog import lookup as catalog_lookup, upsert_results
+from services.fetch_executor import fetch_executor
+from services.ranking import select_fetch_targets, term_coverage
+from services.search_cache import cached_search
+
+logger = logging.getLogger(__name__)
+
+# レイヤーの優先度（小さいほど先に並べる）
+_LAYER_PRIORITY: Dict[str, int] = {
+    "google_books": 0,
+    "ndl": 1,
+    "trusted_web": 2,
+    "broad_web": 3,
+}
+
+# 届いた直後に WebFetch を始める信頼ドメインの結果が、書名の語をどれだけ含んでいるべきか
+MIN_TITLE_COVERAGE = 0.5
+# 書籍 API・カタログの書誌を高品質ソースとして数えるのに必要な、書名の語の被覆率と上限件数
+MIN_API_TITLE_COVERAGE = 0.6
+API_QUALITY_CAP = 2
+
+_DEFAULT_TRUSTED_DOMAINS = [
+    "amazon.co.jp",
+    "hanmoto.com",
+    "books.rakuten.co.jp",
+    "bookmeter.com",
+    "booklog.jp",
+    "honz.jp",
+]
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def trusted_book_domains() -> List[str]:
+    try:
+        from app.constants import TRUSTED_BOOK_SOURCES_DOMAINS, USE_TRUSTED_DOMAINS
+        return list(TRUSTED_BOOK_SOURCES_DOMAINS) if USE_TRUSTED_DOMAINS else []
+    except ImportError:
+        return list(_DEFAULT_TRUSTED_DOMAINS)
+
+
+def result_url(r: Dict[str, Any]) -> str:
+    return r.get("info_link") or r.get("link") or r.get("url") or ""
+
+
+def _saved(source: str, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """API から取れた書誌をカタログへ保存してそのまま返す"""
+    upsert_results(source, results)
+    return results
+
+
+class BookSearchPlanner:
+    """
+    書籍検索の計画と実行
+
+    plan() が (レイヤー, ラベル, 検索関数) の一覧を作り、run() がそれを同時に実行する。
+    """
+
+    def __init__(
+        self,
+        search_client: Any,
+        deadline_sec: Optional[float] = None,
+        enough_sources: Optional[int] = None,
+    ):
+        self.sc = search_client
+        self.deadline_sec = deadline_sec if deadline_sec is not None else _env_float("BOOK_SEARCH_DEADLINE_SEC", 15.0)
+        self.enough_sources = (
+            enough_sources if enough_sources is not None else int(_env_float("BOOK_SEARCH_ENOUGH_SOURCES", 6))
+        )
+        self.min_trusted_pages = int(_env_float("BOOK_SEARCH_MIN_TRUSTED_PAGES", 2))
+        self.trusted_domains = trusted_book_domains()
+
+    # ---------------- 計画 ----------------
+    def plan(
+        self,
+        book_title: str,
+        author: Optional[str] = None,
+        top_k: int = 10,
+        include_book_apis: bool = True,
+        include_broad: bool = True,
+        skip_sources: Tuple[str, ...] = (),
+        recency_days: Optional[int] = None,
+    ) -> List[Tuple[str, str, Callable[[], List[Dict[str, Any]]]]]:
+        """
+        優先度順の検索一覧。エグゼキュータのホスト枠が詰まったときは先頭から実行される
+
+        skip_sources に含まれる書籍 API（カタログで足りたもの）は呼ばない
+        recency_days は Web 検索（信頼ドメイン・書評キーワード）にだけ掛ける
+        """
+        steps: List[Tuple[str, str, Callable[[], List[Dict[str, Any]]]]] = []
+        api_query = f"{book_title} {author}" if author else book_title
+
+        if include_book_apis:
+            gb = None if "google_books" in skip_sources else self.sc._get_google_books_client()
+            if gb is not None:
+                steps.append(("google_books", "Google Books", lambda: cached_search(
+                    "google_books", api_query, top_k,
+                    lambda: _saved("google_books", gb.search_books(api_query, max_results=top_k)),
+                )))
+            ndl = None if "ndl" in skip_sources else self.sc._get_ndl_client()
+            if ndl is not None:
+                steps.append(("ndl", "NDL", lambda: cached_search(
+                    "ndl", book_title, top_k,
+                    lambda: _saved("ndl", ndl.search_books(book_title, max_records=top_k)),
+                )))
+
+        base_query = f'"{book_title}"'
+        if author:
+            base_query += f' "{author}"'
+        for domain in self.trusted_domains:
+            q = f"{base_query} site:{domain}"
+            steps.append(("trusted_web", domain, lambda q=q: self.sc.search(
+                q, top_k=2, recency_days=recency_days, gl="jp", lr="lang_ja"
+            )))
+
+        if include_broad:
+            broad = f"{book_title} {author}" if author else book_title
+            broad += " (書評 OR レビュー OR 要約 OR 内容紹介)"
+            steps.append(("broad_web", "書評キーワード", lambda: self.sc.search(
+                broad, top_k=top_k, recency_days=recency_days, gl="jp", lr="lang_ja"
+            )))
+        return steps
+
+    def _is_trusted(self, url: str) -> bool:
+        return bool(url) and any(domain in url for domain in self.trusted_domains)
+
+    def _is_quality(self, book_title: str, layer: str, r: Dict[str, Any]) -> bool:
+        if layer in ("google_books", "ndl"):
+            return bool(result_url(r)) and term_coverage(book_title, r.get("title") or "") >= MIN_API_TITLE_COVERAGE
+        return self._is_trusted(result_url(r)) and term_coverage(
+            book_title, f"{r.get('title') or ''} {r.get('snippet') or ''}"
+        ) >= MIN_TITLE_COVERAGE
+
+    # ---------------- 実行 ----------------
+    def run(
+        self,
+        book_title: str,
+        author: Optional[str] = None,
+        top_k: int = 10,
+        max_fetch: int = 3,
+        include_book_apis: bool = True,
+        include_broad: bool = True,
+        recency_days: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        計画した検索を同時に実行し、重複排除した結果（上位 max_fetch 件は enriched_content 付き）を返す
+
+        Args:
+            book_title: 書籍タイトル
+            author: 著者名（任意）
+            top_k: 返す件数
+            max_fetch: WebFetch する件数（0 で取得しない）
+            recency_days: Web 検索の鮮度フィルタ（日数。None で制限なし）
+        """
+        from services.search import canonicalize_url, dedupe_results
+
+        started = time.monotonic()
+        deadline = started + self.deadline_sec
+        executor = fetch_executor()
+        # カタログに新しい書誌があれば、その API の結果として扱い呼び出しを省く（古ければ取り直す）
+        cached_layers: List[Tuple[str, List[Dict[str, Any]]]] = []
+        if include_book_apis:
+            for source, (results, fresh) in catalog_lookup(book_title, author, top_k).items():
+                if fresh:
+                    cached_layers.append((source, results))
+        steps = self.plan(
+            book_title, author, top_k, include_book_apis, include_broad,
+            skip_sources=tuple(source for source, _ in cached_layers),
+            recency_days=recency_days,
+        )
+
+        collected: List[Tuple[int, int, Dict[str, Any]]] = []  # (優先度, 到着順, 結果)
+        seen_urls = set()
+        api_quality = 0    # 書名に合う書籍 API・カタログの書誌
+        trusted_pages = 0  # 書名に合う信頼ドメインのページ
+        fetches: Dict[Future, str] = {}  # WebFetch の Future → URL
+        enriched: Dict[str, Dict[str, Any]] = {}
+
+        def _start_fetch(r: Dict[str, Any]) -> None:
+            url = result_url(r)
+            fetches[executor.submit(self.sc._fetch_book_content, r, host=url, deadline=deadline, label="webfetch")] = url
+
+        def _quality() -> int:
+            return min(api_quality, API_QUALITY_CAP) + trusted_pages
+
+        def _collect(layer: str, name: str, results: List[Dict[str, Any]]) -> None:
+            nonlocal api_quality, trusted_pages
+            added = 0
+            for r in results:
+                url = result_url(r)
+                key = canonicalize_url(url)
+                if not key or key in seen_urls:
+                    continue
+                seen_urls.add(key)
+                collected.append((_LAYER_PRIORITY.get(layer, 9), len(collected), r))
+                added += 1
+                if not self._is_quality(book_title, layer, r):
+                    continue
+                if layer in ("google_books", "ndl"):
+                    api_quality += 1
+                    continue
+                trusted_pages += 1
+                # 書名に合う信頼ドメインのページは残りの検索を待たずに取得を始める
+                if len(fetches) < max_fetch:
+                    _start_fetch(r)
+            logger.info(
+                f"[Book Planner] {name}: {len(results)} results ({added} new, "
+                f"quality={_quality()}, trusted_pages={trusted_pages})"
+            )
+
+        for source, results in cached_layers:
+            _collect(source, f"{source} (catalog)", results)
+
+        stopped_early = False
+        stream = executor.fan_out(
+            lambda step: step[2](),
+            steps,
+            host_of=lambda step: self.sc.provider if step[0].endswith("_web") else step[0],
+            timeout=self.deadline_sec,
+            label="book_search",
+        )
+        for (layer, name, _), future in stream:
+            try:
+                results = future.result() or []
+            except Exception as e:
+                logger.warning(f"[Book Planner] {name} failed: {e}")
+                continue
+            _collect(layer, name, results)
+            if _quality() >= self.enough_sources and trusted_pages >= self.min_trusted_pages:
+                stopped_early = True
+                break
+        stream.close()
+
+        # 枠が余っていれば、残りの結果から関連度（BM25）の高いものを選んで取得する
+        if len(fetches) < max_fetch:
+            rest = [r for _, _, r in sorted(collected, key=lambda t: (t[0], t[1]))]
+            for r in select_fetch_targets(
+                book_title, rest, max_fetch - len(fetches), self.trusted_domains, exclude_urls=fetches.values()
+            ):
+                _start_fetch(r)
+
+        if fetches:
+            done, _ = wait(list(fetches), timeout=max(0.0, deadline - time.monotonic()))
+            for f in done:
+                try:
+                    r = f.result()
+                except Exception as e:
+                    logger.warning(f"[Book Planner] WebFetch failed for {fetches[f][:60]}: {e}")
+                    continue
+                if r and r.get("enriched_content"):
+                    enriched[fetches[f]] = r
+
+        # WebFetch できた結果を先頭に、残りはレイヤーの優先度順
+        ordered = [enriched[u] for u in fetches.values() if u in enriched]
+        ordered += [r for _, _, r in sorted(collected, key=lambda t: (t[0], t[1])) if result_url(r) not in enriched]
+        logger.info(
+            f"[Book Planner] '{book_title}': {len(ordered)} unique results, quality={_quality()}, "
+            f"enriched={len(enriched)}/{len(fetches)}, early_stop={stopped_early}, "
+            f"{time.monotonic() - started:.1f}s"
+        )
+        # 本文がそろったところで近似重複（転載・同じ商品の別ページ）を落とす
+        return dedupe_results(ordered)[:top_k]
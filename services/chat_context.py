@@ -0,0 +1,136 @@
+# services/chat_context.py
+"""
+チャット履歴をトークン予算内で組み立てる
+
+- 新しいメッセージから順に (conversation_id, id) インデックスでキーセット取得し、
+  予算（モデル別）を使い切ったところで打ち切る（全件ロードしない）
+- 1ターンが大きすぎる場合は切り詰める。直近以外の長文（過去の Deep Research レポート等）は
+  冒頭だけ残して省略する
+- 組み立て結果の推定トークン数などを返す（ログ・応答に載せる）
+
+予算（推定トークン）:
+    CHAT_CONTEXT_BUDGET_TOKENS              既定 8000
+    CHAT_CONTEXT_BUDGET_GEMINI_2_5_PRO など   モデル別の上書き
+    CHAT_CONTEXT_MAX_TURN_TOKENS            直近ターンの上限（既定 2000）
+    CHAT_CONTEXT_ELIDE_TOKENS               古い長文ターンを残す量（既定 300）
+"""
+import os
+import logging
+from typing import Any, Dict, List, Optional
+
+from services.token_estimator import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+_PAGE_SIZE = 20
+_MAX_TURNS = 50
+_RECENT_TURNS = 2  # 直近この数のターンは省略せず MAX_TURN_TOKENS まで残す
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def context_budget(model: str) -> int:
+    suffix = (model or "").upper().replace("-", "_").replace(".", "_")
+    if suffix:
+        specific = os.getenv(f"CHAT_CONTEXT_BUDGET_{suffix}")
+        if specific is not None:
+            try:
+                return int(specific)
+            except ValueError:
+                pass
+    return _env_int("CHAT_CONTEXT_BUDGET_TOKENS", 8000)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """推定トークン数が max_tokens 以下になるよう先頭を残して切り詰める"""
+    total = estimate_tokens(text)
+    if total <= max_tokens:
+        return text
+    # 文字あたりのトークン比で当たりをつけ、超えていれば縮める
+    cut = max(1, int(len(text) * max_tokens / total))
+    head = text[:cut]
+    while cut > 1 and estimate_tokens(head) > max_tokens:
+        cut = int(cut * 0.9)
+        head = text[:cut]
+    return f"{head.rstrip()}\n…（長文のため省略: 約{total}トークン）"
+
+
+def assemble_history(
+    conversation_id: int,
+    model: str = "",
+    before_id: Optional[int] = None,
+    reserve_tokens: int = 0,
+    after_id: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    conversation_id の履歴を新しい順に予算まで詰め、古い順に並べて返す。
+    before_id: このID未満のメッセージだけを対象にする（今回のユーザ発話を除外する用途）
+    reserve_tokens: 今回の発話など、履歴以外で使う分を予算から差し引く
+    after_id:  このIDより新しいメッセージだけを対象にする（ローリングメモリで要約済みの範囲を除外）
+
+    returns {"history": [{"role","content"}...], "prompt_tokens": int, "turns": int,
+             "truncated": int, "elided": int}
+    """
+    from app.models import db, Message
+
+    budget = max(0, context_budget(model) - reserve_tokens)
+    max_turn = _env_int("CHAT_CONTEXT_MAX_TURN_TOKENS", 2000)
+    elide_to = _env_int("CHAT_CONTEXT_ELIDE_TOKENS", 300)
+
+    picked: List[Dict[str, str]] = []
+    used = 0
+    truncated = 0
+    elided = 0
+    cursor = before_id
+    done = False
+
+    while not done and len(picked) < _MAX_TURNS:
+        q = db.session.query(Message.id, Message.sender, Message.content).filter(
+            Message.conversation_id == conversation_id
+        )
+        if cursor is not None:
+            q = q.filter(Message.id < cursor)
+        if after_id is not None:
+            q = q.filter(Message.id > after_id)
+        rows = q.order_by(Message.id.desc()).limit(_PAGE_SIZE).all()
+        if not rows:
+            break
+
+        for mid, sender, content in rows:
+            cursor = mid
+            text = content or ""
+            cap = max_turn if len(picked) < _RECENT_TURNS else elide_to
+            tokens = estimate_tokens(text)
+            if tokens > cap:
+                text = truncate_to_tokens(text, cap)
+                tokens = estimate_tokens(text)
+                if cap == max_turn:
+                    truncated += 1
+                else:
+                    elided += 1
+            if used + tokens > budget:
+                done = True
+                break
+            used += tokens
+            # Gemini API: role は "user" または "model"
+            picked.append({"role": "model" if sender == "assistant" else "user", "content": text})
+            if len(picked) >= _MAX_TURNS:
+                break
+
+    picked.reverse()
+    logger.info(
+        f"[ChatContext] conv={conversation_id} model={model} turns={len(picked)} "
+        f"tokens~{used}/{budget} truncated={truncated} elided={elided}"
+    )
+    return {
+        "history": picked,
+        "prompt_tokens": used + reserve_tokens,
+        "turns": len(picked),
+        "truncated": truncated,
+        "elided": elided,
+    }
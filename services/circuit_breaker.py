@@ -0,0 +1,333 @@
+# services/circuit_breaker.py
+"""
+Gemini モデル単位のサーキットブレーカーとヘルス集計
+
+- ブレーカーは (モデル, エラー種別) ごとに closed / open / half_open を持つ
+- 状態は Redis で gunicorn / RQ ワーカー間に共有（Redis が無ければプロセス内で保持）
+- open 中のモデルは候補から即スキップ（filter_models は状態を読むだけ）。open 期限が切れたら half_open とし、
+  実際に試す直前の allow() で probe 枠を取った1リクエストだけ試行させ、成功なら closed、失敗なら再び open
+  （probe 枠は成功・失敗のどちらでも解放する）
+- 管理画面向けに、直近数分の成功/エラー件数と平均レイテンシを集計する
+
+エラー種別と既定値（閾値=ウィンドウ内の失敗回数 / open 秒数）:
+    not_found   404         1回 / 600秒
+    rate_limit  429         3回 / 60秒
+    server      5xx         5回 / 30秒
+    timeout     タイムアウト 3回 / 60秒
+    network     接続エラー   5回 / 15秒
+    client      その他 4xx  ブレーカー対象外（リクエスト側の問題のため）
+    throttled / invalid_json / other  ブレーカー対象外（集計のみ）
+
+Redis への問い合わせは1回の判定・記録につき MGET / パイプライン1往復にまとめる
+"""
+import os
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.redis_client import get_redis, mark_redis_failed
+
+logger = logging.getLogger(__name__)
+
+# (閾値, open 秒数)
+_DEFAULT_POLICIES: Dict[str, Tuple[int, int]] = {
+    "not_found": (1, 600),
+    "rate_limit": (3, 60),
+    "server": (5, 30),
+    "timeout": (3, 60),
+    "network": (5, 15),
+}
+
+_FAILURE_WINDOW_SEC = int(os.getenv("GEMINI_CB_WINDOW_SEC", "60"))
+_PROBE_TIMEOUT_SEC = 130  # probe 中のリクエストが返るまで他を通さない（_run_generate の timeout + α）
+_STATS_BUCKET_SEC = 60
+_STATS_BUCKETS = 10  # 直近10分を集計
+# 集計するエラー種別（GeminiFallbackError.error_class が取りうる値）。未知の種別は other に数える
+ERROR_CLASSES: Tuple[str, ...] = tuple(_DEFAULT_POLICIES) + ("client", "throttled", "invalid_json", "other")
+_STAT_FIELDS = ("ok", "latency_ms") + tuple(f"err_{c}" for c in ERROR_CLASSES)
+
+
+def error_class_for_status(status_code: int) -> str:
+    if status_code == 404:
+        return "not_found"
+    if status_code == 429:
+        return "rate_limit"
+    if status_code >= 500:
+        return "server"
+    return "client"
+
+
+def _policy(error_class: str) -> Optional[Tuple[int, int]]:
+    base = _DEFAULT_POLICIES.get(error_class)
+    if base is None:
+        return None
+    prefix = f"GEMINI_CB_{error_class.upper()}"
+    try:
+        threshold = int(os.getenv(f"{prefix}_THRESHOLD", str(base[0])))
+        open_sec = int(os.getenv(f"{prefix}_OPEN_SEC", str(base[1])))
+    except ValueError:
+        return base
+    if threshold <= 0:
+        return None
+    return threshold, open_sec
+
+
+# -------------------------------
+# 状態ストア（Redis / プロセス内）
+# -------------------------------
+class _LocalStore:
+    """Redis が使えないときの代替（TTL 付き key-value + set）"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._data: Dict[str, Tuple[float, Any]] = {}
+        self._sets: Dict[str, set] = {}
+
+    def _alive(self, key: str, now: float) -> bool:
+        item = self._data.get(key)
+        if item is None:
+            return False
+        if item[0] and item[0] <= now:
+            self._data.pop(key, None)
+            return False
+        return True
+
+    def incr(self, key: str, amount: int, ttl: int) -> int:
+        now = time.monotonic()
+        with self._lock:
+            if self._alive(key, now):
+                expires_at, value = self._data[key]
+                value += amount
+            else:
+                expires_at, value = now + ttl, amount
+            self._data[key] = (expires_at, value)
+            return value
+
+    def set(self, key: str, ttl: int, nx: bool = False) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if nx and self._alive(key, now):
+                return False
+            self._data[key] = (now + ttl if ttl else 0.0, 1)
+            return True
+
+    def exists(self, key: str) -> bool:
+        with self._lock:
+            return self._alive(key, time.monotonic())
+
+    def delete(self, *keys: str) -> None:
+        with self._lock:
+            for k in keys:
+                self._data.pop(k, None)
+
+    def mget(self, keys: List[str]) -> List[int]:
+        now = time.monotonic()
+        with self._lock:
+            return [int(self._data[k][1]) if self._alive(k, now) else 0 for k in keys]
+
+    def incr_many(self, items: List[Tuple[str, int]], ttl: int, set_key: str, member: str) -> None:
+        for key, amount in items:
+            self.incr(key, amount, ttl)
+        self.sadd(set_key, member)
+
+    def sadd(self, key: str, member: str) -> None:
+        with self._lock:
+            self._sets.setdefault(key, set()).add(member)
+
+    def smembers(self, key: str) -> List[str]:
+        with self._lock:
+            return sorted(self._sets.get(key, set()))
+
+
+class _RedisStore:
+    def __init__(self, r: Any) -> None:
+        self.r = r
+
+    def incr(self, key: str, amount: int, ttl: int) -> int:
+        pipe = self.r.pipeline()
+        pipe.incrby(key, amount)
+        pipe.ttl(key)
+        value, current_ttl = pipe.execute()
+        if current_ttl is None or current_ttl < 0:
+            self.r.expire(key, ttl)
+        return int(value)
+
+    def set(self, key: str, ttl: int, nx: bool = False) -> bool:
+        return bool(self.r.set(key, "1", ex=ttl or None, nx=nx))
+
+    def exists(self, key: str) -> bool:
+        return bool(self.r.exists(key))
+
+    def delete(self, *keys: str) -> None:
+        self.r.delete(*keys)
+
+    def mget(self, keys: List[str]) -> List[int]:
+        return [int(v) if v else 0 for v in self.r.mget(keys)]
+
+    def incr_many(self, items: List[Tuple[str, int]], ttl: int, set_key: str, member: str) -> None:
+        pipe = self.r.pipeline(transaction=False)
+        for key, amount in items:
+            pipe.incrby(key, amount)
+            pipe.expire(key, ttl)
+        pipe.sadd(set_key, member)
+        pipe.execute()
+
+    def sadd(self, key: str, member: str) -> None:
+        self.r.sadd(key, member)
+
+    def smembers(self, key: str) -> List[str]:
+        return sorted(self.r.smembers(key))
+
+
+_local_store = _LocalStore()
+
+
+class CircuitBreaker:
+    def __init__(self, prefix: str = "gemini_cb") -> None:
+        self.prefix = prefix
+
+    # ---------------- 内部 ----------------
+    def _key(self, model: str, error_class: str, suffix: str) -> str:
+        return f"{self.prefix}:{model}:{error_class}:{suffix}"
+
+    def _run(self, op: str, *args: Any, **kwargs: Any) -> Any:
+        """Redis で実行し、失敗したらプロセス内ストアで実行する"""
+        r = get_redis()
+        if r is not None:
+            try:
+                return getattr(_RedisStore(r), op)(*args, **kwargs)
+            except Exception as e:
+                mark_redis_failed(e)
+        return getattr(_local_store, op)(*args, **kwargs)
+
+    def _states(self, model: str, error_classes: Tuple[str, ...] = tuple(_DEFAULT_POLICIES)) -> Dict[str, str]:
+        """各エラー種別の状態（open / tripped の印を1回の MGET で読む）"""
+        keys = []
+        for error_class in error_classes:
+            keys.append(self._key(model, error_class, "open"))
+            keys.append(self._key(model, error_class, "tripped"))
+        values = self._run("mget", keys)
+        states = {}
+        for i, error_class in enumerate(error_classes):
+            if values[2 * i]:
+                states[error_class] = "open"
+            elif values[2 * i + 1]:
+                states[error_class] = "half_open"
+            else:
+                states[error_class] = "closed"
+        return states
+
+    def _state(self, model: str, error_class: str) -> str:
+        return self._states(model, (error_class,))[error_class]
+
+    def _record_stats(self, model: str, amounts: Dict[str, int]) -> None:
+        bucket = int(time.time() // _STATS_BUCKET_SEC)
+        ttl = _STATS_BUCKET_SEC * (_STATS_BUCKETS + 1)
+        items = [(f"{self.prefix}:stats:{model}:{bucket}:{field}", amount) for field, amount in amounts.items()]
+        self._run("incr_many", items, ttl, f"{self.prefix}:models", model)
+
+    # ---------------- 公開 API ----------------
+    def allow(self, model: str) -> bool:
+        """
+        このモデルを今試してよいか。実際に呼び出す直前に呼ぶ（probe 枠を取るため）。
+        half_open のときは probe 枠を1つだけ取得できたプロセスが True を得る。
+        """
+        states = self._states(model)
+        if "open" in states.values():
+            return False
+        for error_class, state in states.items():
+            if state == "half_open":
+                if not self._run("set", self._key(model, error_class, "probe"), _PROBE_TIMEOUT_SEC, nx=True):
+                    return False
+                logger.info(f"[Gemini CB] half-open probe: model={model} class={error_class}")
+        return True
+
+    def record_success(self, model: str, latency_sec: float) -> None:
+        try:
+            for error_class, state in self._states(model).items():
+                if state == "half_open":
+                    logger.info(f"[Gemini CB] closed: model={model} class={error_class}")
+                    self._run(
+                        "delete",
+                        self._key(model, error_class, "tripped"),
+                        self._key(model, error_class, "probe"),
+                        self._key(model, error_class, "fails"),
+                    )
+            self._record_stats(model, {"ok": 1, "latency_ms": int(latency_sec * 1000)})
+        except Exception as e:
+            logger.warning(f"[Gemini CB] record_success failed: {e}")
+
+    def record_failure(self, model: str, error_class: str) -> None:
+        try:
+            stat_class = error_class if error_class in ERROR_CLASSES else "other"
+            self._record_stats(model, {f"err_{stat_class}": 1})
+            states = self._states(model)
+            # この試行で取った probe 枠は失敗した種別に関係なくすべて返す
+            held = [self._key(model, c, "probe") for c, st in states.items() if st == "half_open"]
+            if held:
+                self._run("delete", *held)
+            policy = _policy(error_class)
+            if policy is None:
+                return
+            threshold, open_sec = policy
+            half_open = states.get(error_class) == "half_open"
+            fails = self._run("incr", self._key(model, error_class, "fails"), 1, _FAILURE_WINDOW_SEC)
+            if half_open or fails >= threshold:
+                self._run("set", self._key(model, error_class, "open"), open_sec)
+                # tripped は open 期限切れ後に half_open と判定するための印（成功で消す）
+                self._run("set", self._key(model, error_class, "tripped"), open_sec + 3600)
+                self._run("delete", self._key(model, error_class, "probe"), self._key(model, error_class, "fails"))
+                logger.warning(
+                    f"[Gemini CB] open: model={model} class={error_class} fails={fails} for {open_sec}s"
+                )
+        except Exception as e:
+            logger.warning(f"[Gemini CB] record_failure failed: {e}")
+
+    def filter_models(self, models: List[str]) -> List[str]:
+        """
+        open のモデルを除外した候補リスト（状態を読むだけで probe 枠は取らない）。
+        全滅した場合は最後の候補だけ残す（ブレーカーで全リクエストを落とさないため）。
+        """
+        allowed = []
+        for m in models:
+            try:
+                ok = "open" not in self._states(m).values()
+            except Exception as e:
+                logger.warning(f"[Gemini CB] state check failed for {m}: {e}")
+                ok = True
+            if ok:
+                allowed.append(m)
+            else:
+                logger.warning(f"[Gemini CB] skip model={m} (circuit open)")
+        return allowed or models[-1:]
+
+    def scoreboard(self) -> List[Dict[str, Any]]:
+        """管理画面用: モデルごとの直近集計とブレーカー状態"""
+        now_bucket = int(time.time() // _STATS_BUCKET_SEC)
+        rows: List[Dict[str, Any]] = []
+        for model in self._run("smembers", f"{self.prefix}:models"):
+            buckets = range(now_bucket - _STATS_BUCKETS + 1, now_bucket + 1)
+            keys = [f"{self.prefix}:stats:{model}:{b}:{field}" for field in _STAT_FIELDS for b in buckets]
+            values = self._run("mget", keys)
+            totals = {
+                field: sum(values[i * _STATS_BUCKETS:(i + 1) * _STATS_BUCKETS])
+                for i, field in enumerate(_STAT_FIELDS)
+            }
+            errors = {f[4:]: totals[f] for f in _STAT_FIELDS if f.startswith("err_") and totals[f]}
+            total_errors = sum(errors.values())
+            requests_total = totals["ok"] + total_errors
+            states = self._states(model)
+            rows.append({
+                "model": model,
+                "requests": requests_total,
+                "ok": totals["ok"],
+                "errors": errors,
+                "error_rate": (total_errors / requests_total) if requests_total else 0.0,
+                "avg_latency_ms": (totals["latency_ms"] // totals["ok"]) if totals["ok"] else None,
+                "breakers": {c: s for c, s in states.items() if s != "closed"},
+            })
+        return rows
+
+
+circuit_breaker = CircuitBreaker()
@@ -0,0 +1,439 @@
+# services/content_extractor.py
+"""
+WebFetch したページから本文らしい部分だけを取り出す（readability 風）
+
+- html.parser で簡易 DOM を組み立てる（外部依存なし。feed() で逐次入力できる）
+- nav / header / footer / aside / form と、id・class がメニュー・フッター・cookie バナー・
+  関連商品などに見える要素は本文候補から外す
+- 段落ごとに文字数・句読点数でスコアを付けて親（1/2 を祖父）に加算し、
+  リンク密度で割り引いた最高スコアの要素（＋同じ親の高スコアな兄弟）を本文とする
+- 書籍系の信頼ドメイン（app.constants.TRUSTED_BOOK_SOURCES_DOMAINS）はサイト別ルールで
+  商品説明・内容紹介・目次・レビューを優先して拾う
+- 構造化フィールド: title / description / toc / reviews / main_text
+
+to_source_text() で Gemini に渡す enriched_content（文字数上限つき）に整形する。
+"""
+import re
+import logging
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+_VOID_TAGS = frozenset({
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta",
+    "param", "source", "track", "wbr",
+})
+_SKIP_TAGS = frozenset({"script", "style", "noscript", "template", "svg", "iframe", "head", "select", "button"})
+_BOILERPLATE_TAGS = frozenset({"nav", "header", "footer", "aside", "form", "menu", "dialog"})
+_BLOCK_TAGS = frozenset({
+    "address", "article", "blockquote", "br", "dd", "div", "dl", "dt", "figcaption", "h1", "h2", "h3",
+    "h4", "h5", "h6", "hr", "li", "main", "ol", "p", "pre", "section", "table", "td", "th", "tr", "ul",
+})
+_HEADING_TAGS = frozenset({"h1", "h2", "h3", "h4", "h5", "h6", "dt", "th"})
+_LABEL_TAGS = _HEADING_TAGS | {"strong", "b", "span", "p", "label"}
+_PARAGRAPH_TAGS = frozenset({"p", "pre", "td", "blockquote", "dd", "li"})
+_AUTO_CLOSE = {"p": {"p"}, "li": {"li"}, "dt": {"dt", "dd"}, "dd": {"dt", "dd"}, "tr": {"tr"}, "td": {"td", "th"}, "th": {"td", "th"}}
+
+_NEGATIVE_RE = re.compile(
+    r"nav|menu|footer|header|sidebar|side-bar|breadcrumb|cookie|consent|banner|promo|related|recommend|"
+    r"ranking|share|social|sns|\bads?\b|advert|sponsor|popup|modal|pager|pagination|widget|login|signup|subscribe",
+    re.IGNORECASE,
+)
+# "main" は nav-main のような id に当たるので含めない（<main> はタグで加点する）
+_POSITIVE_RE = re.compile(r"article|content|body|entry|post|text|description|story|detail|review", re.IGNORECASE)
+_SENTENCE_RE = re.compile(r"[、。,.!?！？]")
+_TOC_RE = re.compile(r"\btoc\b|mokuji|table-of-contents", re.IGNORECASE)
+
+Matcher = Tuple[str, "re.Pattern[str]"]
+
+# サイト別ルール: field -> [(種類, パターン)]。種類は id / class / label（見出し文字列の直後の要素）
+_SITE_RULES: Dict[str, Dict[str, List[Matcher]]] = {
+    "amazon.co.jp": {
+        "title": [("id", re.compile(r"^(productTitle|ebooksProductTitle)$"))],
+        "description": [
+            ("id", re.compile(r"^(bookDescription_feature_div|productDescription|editorialReviews_feature_div)$")),
+        ],
+        "reviews": [("class", re.compile(r"review-text-content"))],
+    },
+    "hanmoto.com": {
+        "description": [("label", re.compile(r"^(内容紹介|紹介)$"))],
+        "toc": [("label", re.compile(r"^目次$"))],
+    },
+    "books.rakuten.co.jp": {
+        "description": [("label", re.compile(r"^(商品説明|内容紹介|出版社からのコメント)$")),
+                        ("class", re.compile(r"productDescription|item-desc"))],
+        "toc": [("label", re.compile(r"^目次$"))],
+    },
+    "bookmeter.com": {
+        "description": [("class", re.compile(r"book-summary|bm-details-side__item--description"))],
+        "reviews": [("class", re.compile(r"frame__content__text|review.*(text|content|body)"))],
+    },
+    "booklog.jp": {
+        "description": [("label", re.compile(r"^(内容紹介|あらすじ)$"))],
+        "reviews": [("class", re.compile(r"review-?txt|review.*(text|content|body)"))],
+    },
+}
+_GENERIC_RULES: Dict[str, List[Matcher]] = {
+    "toc": [("label", re.compile(r"^目次$")), ("class", _TOC_RE), ("id", _TOC_RE)],
+}
+
+
+class _Node:
+    __slots__ = ("tag", "id", "cls", "parent", "children", "skip", "score")
+
+    def __init__(self, tag: str, node_id: str, cls: str, parent: Optional["_Node"], skip: bool) -> None:
+        self.tag = tag
+        self.id = node_id
+        self.cls = cls
+        self.parent = parent
+        self.children: List[Union["_Node", str]] = []
+        self.skip = skip
+        self.score = 0.0
+
+    def elements(self) -> List["_Node"]:
+        return [c for c in self.children if isinstance(c, _Node)]
+
+
+class PageParser(HTMLParser):
+    """
+    簡易 DOM ビルダー。閉じ忘れ・対応のない終了タグは読み飛ばす。
+    本文候補のテキストが text_budget 文字を超えたら full が立つ（以降は読まなくてよい）。
+    """
+
+    def __init__(self, text_budget: int = 80000) -> None:
+        super().__init__(convert_charrefs=True)
+        self.root = _Node("document", "", "", None, False)
+        self._stack: List[_Node] = [self.root]
+        self._raw_depth = 0  # script / style の中
+        self._title_parts: List[str] = []
+        self._in_title = False
+        self.h1 = ""
+        self._h1_parts: Optional[List[str]] = None
+        self.meta: Dict[str, str] = {}
+        self.text_budget = text_budget
+        self.text_total = 0
+        self.full = False
+
+    # ---------------- HTMLParser ----------------
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        a = {k: (v or "") for k, v in attrs}
+        if tag == "meta":
+            key = (a.get("property") or a.get("name") or "").lower()
+            if key in ("description", "og:description", "og:title") and a.get("content"):
+                self.meta.setdefault(key, a["content"].strip())
+            return
+        if tag == "title":
+            self._in_title = True
+            return
+        if tag in _VOID_TAGS:
+            if tag in ("br", "hr"):
+                self._stack[-1].children.append("\n")
+            return
+        if tag in ("script", "style"):
+            self._raw_depth += 1
+        top = self._stack[-1]
+        closes = _AUTO_CLOSE.get(tag)
+        if closes and top.tag in closes and len(self._stack) > 1:
+            self._stack.pop()
+            top = self._stack[-1]
+        marker = f"{a.get('id', '')} {a.get('class', '')} {a.get('role', '')}"
+        skip = (
+            top.skip
+            or tag in _SKIP_TAGS
+            or tag in _BOILERPLATE_TAGS
+            or a.get("role") in ("navigation", "banner", "contentinfo", "complementary")
+            or (bool(_NEGATIVE_RE.search(marker)) and not _POSITIVE_RE.search(marker))
+            or "display:none" in a.get("style", "").replace(" ", "")
+            or "hidden" in a
+        )
+        node = _Node(tag, a.get("id", ""), a.get("class", ""), top, skip)
+        top.children.append(node)
+        self._stack.append(node)
+        if tag == "h1" and not self.h1:
+            self._h1_parts = []
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == "title":
+            self._in_title = False
+            return
+        if tag in ("script", "style") and self._raw_depth:
+            self._raw_depth -= 1
+        if tag == "h1" and self._h1_parts is not None:
+            self.h1 = " ".join(" ".join(self._h1_parts).split())
+            self._h1_parts = None
+        for i in range(len(self._stack) - 1, 0, -1):
+            if self._stack[i].tag == tag:
+                del self._stack[i:]
+                return
+
+    def handle_data(self, data: str) -> None:
+        if self._in_title:
+            self._title_parts.append(data)
+            return
+        if self._raw_depth:
+            return
+        if self._h1_parts is not None:
+            self._h1_parts.append(data)
+        top = self._stack[-1]
+        if not data.strip():
+            if top.children and top.children[-1] != " ":
+                top.children.append(" ")
+            return
+        top.children.append(data)
+        if not top.skip:
+            self.text_total += len(data)
+            if self.text_total >= self.text_budget:
+                self.full = True
+
+    @property
+    def title(self) -> str:
+        return " ".join("".join(self._title_parts).split())
+
+
+# -------------------------------
+# テキスト化
+# -------------------------------
+def _collect(node: _Node, out: List[str], include_skipped: bool) -> None:
+    for c in node.children:
+        if isinstance(c, str):
+            out.append(c)
+        elif include_skipped or not c.skip:
+            block = c.tag in _BLOCK_TAGS
+            if block:
+                out.append("\n")
+            _collect(c, out, include_skipped)
+            if block:
+                out.append("\n")
+
+
+def node_text(node: _Node, include_skipped: bool = False) -> str:
+    out: List[str] = []
+    _collect(node, out, include_skipped)
+    lines = (" ".join(line.split()) for line in "".join(out).split("\n"))
+    return "\n".join(line for line in lines if line)
+
+
+def _inline_len(node: _Node, link: bool = False) -> Tuple[int, int]:
+    """(本文文字数, うちリンク文字数)"""
+    total = links = 0
+    for c in node.children:
+        if isinstance(c, str):
+            n = len(c.strip())
+            total += n
+            if link:
+                links += n
+        elif not c.skip:
+            t, lk = _inline_len(c, link or c.tag == "a")
+            total += t
+            links += lk
+    return total, links
+
+
+# -------------------------------
+# 本文スコアリング
+# -------------------------------
+def _walk(node: _Node) -> List[_Node]:
+    out = []
+    stack = [node]
+    while stack:
+        n = stack.pop()
+        out.append(n)
+        stack.extend(c for c in reversed(n.elements()) if not c.skip)
+    return out
+
+
+def _class_weight(node: _Node) -> float:
+    marker = f"{node.id} {node.cls}"
+    w = 0.0
+    if _POSITIVE_RE.search(marker):
+        w += 25
+    if _NEGATIVE_RE.search(marker):
+        w -= 25
+    return w
+
+
+def _main_content(root: _Node) -> str:
+    nodes = _walk(root)
+    scored: List[_Node] = []
+    scored_ids = set()
+    for n in nodes:
+        is_para = n.tag in _PARAGRAPH_TAGS or (
+            n.tag == "div" and not any(c.tag in _BLOCK_TAGS for c in n.elements())
+        )
+        if not is_para:
+            continue
+        length, _ = _inline_len(n)
+        if length < 25:
+            continue
+        text = node_text(n)
+        content = 1 + len(_SENTENCE_RE.findall(text)) + min(3, length // 100)
+        for parent, share in ((n.parent, 1.0), (n.parent.parent if n.parent else None, 0.5)):
+            if parent is None or parent.skip:
+                continue
+            if id(parent) not in scored_ids:
+                parent.score = _class_weight(parent) + {"article": 10, "main": 10, "div": 5}.get(parent.tag, 0)
+                scored.append(parent)
+                scored_ids.add(id(parent))
+            parent.score += content * share
+
+    best: Optional[_Node] = None
+    for n in scored:
+        total, links = _inline_len(n)
+        n.score *= 1 - (links / total if total else 0)
+        if best is None or n.score > best.score:
+            best = n
+    if best is None or best.score <= 0:
+        return node_text(root)
+
+    parts = []
+    threshold = max(10.0, best.score * 0.2)
+    siblings = best.parent.elements() if best.parent is not None and best.tag != "body" else [best]
+    for s in siblings:
+        if s is best or (not s.skip and s.score >= threshold):
+            parts.append(node_text(s))
+    return "\n".join(p for p in parts if p)
+
+
+# -------------------------------
+# サイト別ルール
+# -------------------------------
+def _following_text(node: _Node) -> str:
+    """見出し要素の直後から次の見出しまでのテキスト"""
+    parent = node.parent
+    if parent is None:
+        return ""
+    parts: List[str] = []
+    seen = False
+    for c in parent.children:
+        if c is node:
+            seen = True
+            continue
+        if not seen:
+            continue
+        if isinstance(c, _Node):
+            if c.tag in _HEADING_TAGS or c.tag == node.tag:
+                break
+            parts.append(node_text(c, include_skipped=True))
+        elif c.strip():
+            parts.append(" ".join(c.split()))
+    text = "\n".join(p for p in parts if p)
+    if not text and parent.tag not in ("body", "document"):
+        return _following_text(parent)
+    return text
+
+
+def _short_text(node: _Node, limit: int) -> str:
+    """limit 文字以内ならそのテキスト、超えたら空文字（長い要素は途中で打ち切る）"""
+    parts: List[str] = []
+    length = 0
+    stack: List[Union[_Node, str]] = [node]
+    while stack:
+        c = stack.pop()
+        if isinstance(c, str):
+            t = c.strip()
+            length += len(t)
+            if length > limit:
+                return ""
+            if t:
+                parts.append(t)
+        else:
+            stack.extend(reversed(c.children))
+    return "".join(parts)
+
+
+def _apply_rules(root: _Node, rules: Dict[str, List[Matcher]]) -> Dict[str, str]:
+    found: Dict[str, List[str]] = {}
+    all_nodes = []
+    stack = [root]
+    while stack:
+        n = stack.pop()
+        all_nodes.append(n)
+        stack.extend(reversed(n.elements()))
+    for field, matchers in rules.items():
+        for kind, pattern in matchers:
+            for n in all_nodes:
+                if kind == "id":
+                    hit = bool(n.id) and bool(pattern.search(n.id))
+                    text = node_text(n, include_skipped=True) if hit else ""
+                elif kind == "class":
+                    hit = bool(n.cls) and bool(pattern.search(n.cls))
+                    text = node_text(n, include_skipped=True) if hit else ""
+                else:
+                    own = _short_text(n, 20) if n.tag in _LABEL_TAGS else ""
+                    hit = bool(own) and bool(pattern.search(own))
+                    text = _following_text(n) if hit else ""
+                if text and text not in found.get(field, []):
+                    found.setdefault(field, []).append(text)
+            if found.get(field):
+                break
+    return {k: "\n".join(v) for k, v in found.items()}
+
+
+def _site_rules(url: str) -> Dict[str, List[Matcher]]:
+    host = (urlparse(url).hostname or "").lower()
+    for domain, rules in _SITE_RULES.items():
+        if host == domain or host.endswith("." + domain):
+            merged = dict(_GENERIC_RULES)
+            merged.update(rules)
+            return merged
+    return _GENERIC_RULES
+
+
+# -------------------------------
+# 公開 API
+# -------------------------------
+def extract_from_parser(parser: PageParser, url: str = "") -> Dict[str, Any]:
+    """
+    returns {"title", "description", "toc", "reviews", "main_text"}（無いものは空文字）
+    """
+    parser.close()
+    fields = _apply_rules(parser.root, _site_rules(url))
+    main_text = _main_content(parser.root)
+    title = fields.get("title") or parser.meta.get("og:title") or parser.title or parser.h1
+    description = fields.get("description") or parser.meta.get("og:description") or parser.meta.get("description", "")
+    return {
+        "title": " ".join(title.split()),
+        "description": description.strip(),
+        "toc": fields.get("toc", "").strip(),
+        "reviews": fields.get("reviews", "").strip(),
+        "main_text": main_text.strip(),
+    }
+
+
+def extract_content(html: str, url: str = "") -> Dict[str, Any]:
+    parser = PageParser()
+    parser.feed(html)
+    return extract_from_parser(parser, url)
+
+
+def to_source_text(page: Dict[str, Any], max_chars: int) -> str:
+    """
+    構造化フィールドを enriched_content 用のテキストにまとめる。
+    タイトル → 概要 → 目次 → レビュー → 本文 の順に、残りの文字数で切り詰める。
+    """
+    sections = [
+        ("タイトル", page.get("title", ""), 200),
+        ("概要", page.get("description", ""), max_chars // 2),
+        ("目次", page.get("toc", "").replace("\n", " / "), max_chars // 4),
+        ("レビュー", page.get("reviews", ""), max_chars // 3),
+    ]
+    # 本文からタイトル・概要・目次・レビューと重複する行を除く
+    seen = set()
+    for key in ("title", "description", "toc", "reviews"):
+        seen.update(line.strip() for line in (page.get(key) or "").split("\n") if line.strip())
+    main = "\n".join(line for line in (page.get("main_text") or "").split("\n") if line.strip() not in seen)
+    sections.append(("本文", main, max_chars))
+
+    out: List[str] = []
+    remaining = max_chars
+    for label, value, cap in sections:
+        value = (value or "").strip()
+        if not value or remaining <= len(label) + 10:
+            continue
+        value = value[: min(cap, remaining - len(label) - 3)]
+        line = f"{label}: {value}"
+        out.append(line)
+        remaining -= len(line) + 1
+    return "\n".join(out)
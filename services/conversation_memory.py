@@ -0,0 +1,204 @@
+# services/conversation_memory.py
+"""
+会話のローリングメモリ（古いターンの要約 + ウォーターマーク）
+
+- Conversation.memory_summary     : memory_watermark_id 以前のターンの要約
+- Conversation.memory_watermark_id: 要約に含めた最後の Message.id
+- ウォーターマークより後のメッセージが MEMORY_KEEP_RECENT + MEMORY_BATCH を超えたら、
+  はみ出した古いターンを「前回の要約 + 新たに押し出されたターン」から増分要約する
+- チャット時は「要約 + ウォーターマーク以降の直近ターン」を送る
+- しきい値の判定は Web プロセスで行い、超えたときだけ RQ に積む（同じ会話のジョブが待機中なら積まない）。
+  RQ が無ければバックグラウンドスレッドで進める（応答は待たせない）
+
+環境変数:
+    CONVERSATION_MEMORY        true/false（既定 true）
+    MEMORY_KEEP_RECENT         要約せずそのまま送る直近メッセージ数（既定 20）
+    MEMORY_BATCH               何件たまったら要約を進めるか（既定 10）
+    MEMORY_TURN_TOKENS         要約入力に使う1ターンあたりの上限（既定 800）
+"""
+import os
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from services.chat_context import truncate_to_tokens
+from services.rate_limiter import BACKGROUND, gemini_priority
+from services.metrics import gemini_caller
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def memory_enabled() -> bool:
+    return os.getenv("CONVERSATION_MEMORY", "true").lower() == "true"
+
+
+def memory_turns(conv: Optional[Any]) -> List[Dict[str, str]]:
+    """
+    履歴の先頭に差し込む要約ターン（user → model の1往復）。
+    要約が無ければ空リスト。
+    """
+    if not memory_enabled() or conv is None or not conv.memory_summary:
+        return []
+    return [
+        {"role": "user", "content": f"【これまでの会話の要約】\n{conv.memory_summary}"},
+        {"role": "model", "content": "承知しました。この要約を踏まえて会話を続けます。"},
+    ]
+
+
+def build_memory_prompt(previous_summary: str, turns: List[Dict[str, str]]) -> str:
+    turn_tokens = _env_int("MEMORY_TURN_TOKENS", 800)
+    lines = []
+    for t in turns:
+        speaker = "ユーザー" if t["role"] == "user" else "アシスタント"
+        lines.append(f"{speaker}: {truncate_to_tokens(t['content'], turn_tokens)}")
+    joined = "\n".join(lines)
+    previous = previous_summary.strip() if previous_summary else "（まだありません）"
+    return f"""あなたは会話の記憶を管理するアシスタントです。
+以下の「これまでの要約」に「新しいやり取り」の内容を統合し、更新された要約を日本語で出力してください。
+
+要件:
+- 後の会話で参照されそうな事実・決定事項・ユーザーの希望や前提・未解決の質問を残す
+- 挨拶や重複、言い回しの違いだけの内容は省く
+- 箇条書きで、全体で800文字以内
+- 要約本文のみを出力（前置きや見出しは不要）
+
+【これまでの要約】
+{previous}
+
+【新しいやり取り】
+{joined}
+"""
+
+
+def _pending_messages(conversation_id: int, watermark: int):
+    from app.models import db, Message
+
+    return db.session.query(Message.id, Message.sender, Message.content).filter(
+        Message.conversation_id == conversation_id, Message.id > watermark
+    )
+
+
+def memory_update_due(conversation_id: int) -> bool:
+    """ウォーターマーク以降のメッセージが MEMORY_KEEP_RECENT + MEMORY_BATCH に達しているか"""
+    from app.models import db, Conversation
+
+    if not memory_enabled():
+        return False
+    conv = db.session.get(Conversation, conversation_id)
+    if conv is None:
+        return False
+    threshold = _env_int("MEMORY_KEEP_RECENT", 20) + _env_int("MEMORY_BATCH", 10)
+    return _pending_messages(conversation_id, conv.memory_watermark_id or 0).count() >= threshold
+
+
+def update_memory(gc: Any, conversation_id: int) -> bool:
+    """
+    ウォーターマーク以降のメッセージがしきい値を超えていれば要約を進める。
+    更新したら True。他プロセスが先に進めていた場合は何もしない。
+    """
+    from app.models import db, Conversation, Message
+
+    if not memory_enabled():
+        return False
+    conv = db.session.get(Conversation, conversation_id)
+    if conv is None:
+        return False
+
+    keep_recent = _env_int("MEMORY_KEEP_RECENT", 20)
+    batch = _env_int("MEMORY_BATCH", 10)
+    watermark = conv.memory_watermark_id or 0
+
+    q = _pending_messages(conversation_id, watermark)
+    pending = q.count()
+    if pending < keep_recent + batch:
+        return False
+
+    aged = q.order_by(Message.id.asc()).limit(pending - keep_recent).all()
+    if not aged:
+        return False
+    turns = [{"role": "user" if sender == "user" else "model", "content": content or ""}
+             for _, sender, content in aged]
+    new_watermark = aged[-1][0]
+
+    prompt = build_memory_prompt(conv.memory_summary or "", turns)
+    with gemini_priority(BACKGROUND), gemini_caller("conversation_memory"):
+        text, used = gc.chat([], prompt, requested_model=os.getenv("MEMORY_GEMINI_MODEL", ""))
+    text = (text or "").strip()
+    if not text:
+        logger.warning(f"[Memory] empty summary for conversation {conversation_id}")
+        return False
+
+    # 同時更新の保護: ウォーターマークが読み取り時のままの場合だけ書き込む
+    cond = Conversation.memory_watermark_id.is_(None) if conv.memory_watermark_id is None \
+        else Conversation.memory_watermark_id == conv.memory_watermark_id
+    updated = db.session.query(Conversation).filter(Conversation.id == conversation_id, cond).update(
+        {"memory_summary": text, "memory_watermark_id": new_watermark},
+        synchronize_session=False,
+    )
+    db.session.commit()
+    if updated:
+        logger.info(
+            f"[Memory] conv={conversation_id} watermark {watermark} -> {new_watermark} "
+            f"({len(turns)} turns folded, model={used})"
+        )
+    return bool(updated)
+
+
+_PENDING_STATUSES = ("queued", "started", "deferred", "scheduled")
+
+
+def _memory_job_id(conversation_id: int) -> str:
+    return f"conversation_memory_{conversation_id}"
+
+
+def schedule_memory_update(conversation_id: int, gc: Any, rq_queue: Any = None) -> None:
+    """
+    しきい値を超えていれば要約を進める。RQ があればワーカーへ、無ければバックグラウンドスレッドで。
+    同じ会話のジョブが待機中・実行中なら何もしない。
+    """
+    from app.models import db
+
+    try:
+        if not memory_update_due(conversation_id):
+            return
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"[Memory] threshold check failed for conversation {conversation_id}: {e}")
+        return
+
+    if rq_queue is not None:
+        job_id = _memory_job_id(conversation_id)
+        try:
+            existing = rq_queue.fetch_job(job_id)
+            if existing is not None and existing.get_status() in _PENDING_STATUSES:
+                logger.info(f"[Memory] update already pending for conversation {conversation_id}")
+                return
+            rq_queue.enqueue(
+                "services.tasks.update_conversation_memory", conversation_id,
+                job_id=job_id, job_timeout=180,
+            )
+            return
+        except Exception as e:
+            logger.warning(f"[Memory] enqueue failed, updating in background thread: {e}")
+
+    from flask import current_app
+    app = current_app._get_current_object()
+
+    def _run() -> None:
+        with app.app_context():
+            try:
+                update_memory(gc, conversation_id)
+            except Exception as e:
+                db.session.rollback()
+                logger.warning(f"[Memory] update failed for conversation {conversation_id}: {e}")
+            finally:
+                db.session.remove()
+
+    threading.Thread(target=_run, name=f"memory-{conversation_id}", daemon=True).start()
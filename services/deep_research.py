@@ -1,9 +1,7 @@
 # services/deep_research.py
 import os
 import logging
-import json
 from typing import List, Dict, Any
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 logger = logging.getLogger(__name__)
 
@@ -14,14 +12,32 @@ if USE_MOCK:
 else:
     from services.gemini_client_http import GeminiClient
 
-from services.search import SearchClient
+from services.fetch_executor import fetch_executor
+from services.ranking import fit_to_budget
+from services.search import SearchClient, dedupe_results
+from services.metrics import gemini_caller
+from services.model_router import router_enabled
+
+# サブクエリの検索＋WebFetch 全体を待つ上限（秒）
+DEEP_RESEARCH_SEARCH_TIMEOUT_SEC = float(os.getenv("DEEP_RESEARCH_SEARCH_TIMEOUT_SEC", "90"))
+
+# レポート生成に渡す情報源のトークン予算
+DEEP_RESEARCH_SOURCE_BUDGET_TOKENS = int(os.getenv("DEEP_RESEARCH_SOURCE_BUDGET_TOKENS", "20000"))
+
+# クエリ分解の responseSchema（3〜5個の検索クエリ）
+DECOMPOSITION_SCHEMA: Dict[str, Any] = {
+    "type": "ARRAY",
+    "items": {"type": "STRING"},
+    "minItems": 3,
+    "maxItems": 5,
+}
 
 
 class DeepResearchEngine:
     """
     Deep Research機能のコアエンジン
     - クエリ分解（Gemini）
-    - 並列検索（ThreadPoolExecutor）
+    - 並列検索（プロセス共通の fetch_executor）
     - 統合レポート生成（Gemini）
     """
 
@@ -43,7 +59,8 @@ class DeepResearchEngine:
         )
 
         # クエリ分解用モデル（高速化のためFlash使用）
-        self.decomposition_model = os.getenv("DECOMPOSITION_GEMINI_MODEL", "gemini-2.5-flash")
+        # 空ならモデルルーター（deep_research_decompose ポリシー）に任せる
+        self.decomposition_model = os.getenv("DECOMPOSITION_GEMINI_MODEL", "")
 
         logger.info("[DeepResearch] Engine initialized successfully")
 
@@ -89,6 +106,8 @@ class DeepResearchEngine:
 
         try:
             enriched_content = self._execute_parallel_searches(sub_queries)
+            # 元のクエリとの関連度順に並べ、資料のトークン予算に収まる分だけ残す
+            enriched_content = fit_to_budget(query, enriched_content, DEEP_RESEARCH_SOURCE_BUDGET_TOKENS)
             logger.info(f"[DeepResearch] Collected {len(enriched_content)} enriched sources")
             if job:
                 job.meta['sources_count'] = len(enriched_content)
@@ -124,7 +143,7 @@ class DeepResearchEngine:
     def _decompose_query(self, query: str) -> List[str]:
         """
         クエリを3-5個のサブクエリに分解
-        - JSON形式での出力を強制
+        - JSON モード（responseSchema）で配列を強制
         - Few-shot例を含める
         """
         prompt = f"""あなたはリサーチプランニングアシスタントです。ユーザーのクエリを3〜5個の異なる、重複しないサブクエリに分解してください。各サブクエリはWeb検索に最適化されている必要があります。
@@ -132,7 +151,7 @@ class DeepResearchEngine:
 要件:
 - 各サブクエリは異なる観点をカバーすること
 - サブクエリは具体的で検索可能であること
-- 有効なJSON配列（文字列のリスト）のみを返すこと
+- 文字列の配列として返すこと
 
 例1:
 ユーザークエリ: 「間欠的断食の健康効果は？」
@@ -151,60 +170,17 @@ class DeepResearchEngine:
 
 出力（JSON配列のみ）:"""
 
-        try:
-            # Geminiでクエリ分解を実行
-            response_text, model = self.gemini_client.chat(
-                messages=[],
-                user_message=prompt,
-                requested_model=self.decomposition_model
+        # JSON モード（配列 3〜5 件の文字列）で生成。スキーマ違反は次の候補モデルへ
+        # フォールバックし、全候補が失敗したら例外をそのまま上げる（汎用クエリで調査を続けない）
+        with gemini_caller("deep_research_decompose"):
+            sub_queries, model = self.gemini_client.generate_json(
+                prompt,
+                DECOMPOSITION_SCHEMA,
+                requested_model=self.decomposition_model or ("" if router_enabled() else "gemini-2.5-flash"),
+                max_output_tokens=1024,
             )
-
-            logger.info(f"[DeepResearch] Decomposition response: {response_text[:200]}...")
-
-            # JSON抽出（マークダウンコードブロックを除去）
-            response_text = response_text.strip()
-            if response_text.startswith("```json"):
-                response_text = response_text[7:]
-            if response_text.startswith("```"):
-                response_text = response_text[3:]
-            if response_text.endswith("```"):
-                response_text = response_text[:-3]
-            response_text = response_text.strip()
-
-            # JSONパース
-            json_response = json.loads(response_text)
-
-            # バリデーション
-            if isinstance(json_response, list) and all(isinstance(q, str) for q in json_response):
-                # 3-5個の範囲に調整
-                if len(json_response) < 3:
-                    logger.warning(f"[DeepResearch] Too few sub-queries ({len(json_response)}), using fallback")
-                    return self._fallback_decomposition(query)
-                if len(json_response) > 5:
-                    logger.warning(f"[DeepResearch] Too many sub-queries ({len(json_response)}), trimming to 5")
-                    json_response = json_response[:5]
-                return json_response
-            else:
-                raise ValueError("JSON is not a list of strings")
-
-        except (json.JSONDecodeError, ValueError) as e:
-            logger.error(f"[DeepResearch] Failed to parse JSON from model response: {e}. Response: {response_text}")
-            return self._fallback_decomposition(query)
-        except Exception as e:
-            logger.error(f"[DeepResearch] Unexpected error in decomposition: {e}")
-            return self._fallback_decomposition(query)
-
-    def _fallback_decomposition(self, query: str) -> List[str]:
-        """
-        クエリ分解失敗時のフォールバック
-        """
-        logger.warning("[DeepResearch] Using fallback decomposition strategy")
-        return [
-            f"{query} 概要",
-            f"{query} メリット 利点",
-            f"{query} 課題 問題点",
-            f"{query} 実例 事例"
-        ]
+        logger.info(f"[DeepResearch] Decomposition ({model}): {sub_queries}")
+        return sub_queries
 
     def _search_and_enrich_one(self, sub_query: str) -> List[Dict[str, Any]]:
         """
@@ -226,9 +202,9 @@ class DeepResearchEngine:
                 logger.warning(f"[DeepResearch] No search results for sub-query: '{sub_query}'")
                 return []
 
-            # Top 3をWebFetchで詳細化（並列化はSearchClient内で実施される）
+            # サブクエリとの関連度が高い最大3件をWebFetchで詳細化（並列化はSearchClient内で実施される）
             enriched_results = self.search_client._enrich_search_results_with_webfetch(
-                search_results[:3]
+                search_results, max_fetch=3, query=sub_query
             )
 
             logger.info(f"[DeepResearch] Enriched {len(enriched_results)} results for '{sub_query}'")
@@ -241,39 +217,30 @@ class DeepResearchEngine:
     def _execute_parallel_searches(self, sub_queries: List[str]) -> List[Dict[str, Any]]:
         """
         すべてのサブクエリを並列実行
-        - ThreadPoolExecutorで並列化
+        - プロセス共通の fetch_executor で並列化（同時実行数はプロセス全体で制限）。
+          各サブクエリ内の WebFetch も同じエグゼキュータに載る
         - 各サブクエリの検索結果を統合
         """
         all_enriched_content = []
 
-        # 並列実行（最大ワーカー数=サブクエリ数、ただし最大5）
-        max_workers = min(len(sub_queries), 5)
-
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # サブクエリごとにタスクを投入
-            future_to_query = {
-                executor.submit(self._search_and_enrich_one, sq): sq
-                for sq in sub_queries
-            }
-
-            # 完了順に結果を収集
-            for future in as_completed(future_to_query):
-                query = future_to_query[future]
-                try:
-                    results = future.result()
-                    all_enriched_content.extend(results)
-                    logger.info(f"[DeepResearch] Completed search for '{query}', got {len(results)} results")
-                except Exception as e:
-                    logger.error(f"[DeepResearch] Search thread for query '{query}' failed: {e}")
-
-        # URL重複を除去
-        seen_urls = set()
-        unique_content = []
-        for item in all_enriched_content:
-            url = item.get('url') or item.get('link')
-            if url and url not in seen_urls:
-                unique_content.append(item)
-                seen_urls.add(url)
+        # サブクエリごとにタスクを投入し、完了順に結果を収集
+        for query, future in fetch_executor().fan_out(
+            self._search_and_enrich_one,
+            sub_queries,
+            timeout=DEEP_RESEARCH_SEARCH_TIMEOUT_SEC,
+            label="deep_research",
+        ):
+            try:
+                results = future.result()
+                all_enriched_content.extend(results)
+                logger.info(f"[DeepResearch] Completed search for '{query}', got {len(results)} results")
+            except Exception as e:
+                logger.error(f"[DeepResearch] Search thread for query '{query}' failed: {e}")
+
+        # 重複を除去（正規化 URL + 本文の近似重複。サブクエリ間で同じ記事の転載が集まりやすい）
+        unique_content = dedupe_results([
+            item for item in all_enriched_content if item.get('url') or item.get('link')
+        ])
 
         logger.info(f"[DeepResearch] Total unique sources: {len(unique_content)} (from {len(all_enriched_content)} raw results)")
         return unique_content
@@ -311,14 +278,13 @@ class DeepResearchEngine:
         context_str = "\n---\n\n".join(context_parts)
 
         # 統合プロンプト（構造化テンプレート強制）
-        prompt = f"""あなたはリサーチアナリストです。以下の複数の情報源に基づいて、包括的なリサーチレポートをMarkdown形式で生成してください。
+        # 指示 + 情報源を前半（コンテキストキャッシュ対象）、クエリ固有部分を後半に置く
+        prefix = f"""あなたはリサーチアナリストです。以下の複数の情報源に基づいて、末尾のユーザーのクエリに関する包括的なリサーチレポートをMarkdown形式で生成してください。
 
-ユーザーの元のクエリ: {original_query}
-
-以下の情報源を分析し、構造化されたレポートを作成してください。
+情報源を分析し、構造化されたレポートを作成してください。
 このレポートは**必ず以下の構造**に従ってください:
 
-# リサーチレポート: {original_query}
+# リサーチレポート: （ユーザーのクエリ）
 
 ## 要旨
 （最も重要な発見を2-3文で簡潔にまとめる）
@@ -342,18 +308,24 @@ class DeepResearchEngine:
 情報源データ:
 ---
 {context_str}
----
+---"""
 
-上記の構造に厳密に従ってレポートを生成してください。
+        prompt = f"""ユーザーの元のクエリ: {original_query}
+
+見出しは「# リサーチレポート: {original_query}」とし、上記の構造に厳密に従ってレポートを生成してください。
 """
 
         try:
             # Geminiでレポート生成
-            report_text, model = self.gemini_client.chat(
-                messages=[],
-                user_message=prompt,
-                requested_model=self.gemini_client.primary_model
-            )
+            with gemini_caller("deep_research_synthesis"):
+                report_text, model = self.gemini_client.chat(
+                    messages=[],
+                    user_message=prompt,
+                    # モデルと出力上限は deep_research_synthesis ポリシーで決める
+                    # （ルーター無効時は primary_model = DEEP_RESEARCH_GEMINI_MODEL）
+                    cache_prefix=prefix,
+                    call_type="deep_research_synthesis",
+                )
 
             return {
                 "report": report_text.strip(),
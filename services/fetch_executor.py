@@ -0,0 +1,380 @@
+# services/fetch_executor.py
+"""
+検索・WebFetch の並列実行をまとめるプロセス共通の I/O エグゼキュータ
+
+- プロセスにスレッドプールを1つだけ持つ（同時実行の上限 = FETCH_EXECUTOR_WORKERS）。
+  呼び出しごとに ThreadPoolExecutor を作らないので、同時リクエストが増えてもスレッド数は増えない
+- ホストごとの同時実行数を FETCH_PER_HOST_LIMIT で制限する。
+  枠が空いていないタスクは待ち行列に残り、同じホストのタスクが終わった時点で投入される
+  （ワーカースレッドを待機で塞がない）
+- 期限（deadline）付きで投入できる。待ち行列にいる間に期限を過ぎたタスクは実行せずに失敗させる
+- 待ち行列が FETCH_EXECUTOR_MAX_QUEUE を超えたら投入を拒否する（FetchRejected）
+- 入れ子の並列（Deep Research のサブクエリ → 各サブクエリの WebFetch）は、
+  ワーカー上で待っている親が、まだ始まっていない自分の子タスクを引き取って実行する。
+  親がワーカーを占有したまま子の空きを待つデッドロックにならない
+- contextvars（Gemini の優先度・呼び出し元タグ）はタスクへ引き継ぐ
+- 待ち時間・結果は metrics に出力する（/metrics の fetch_executor_*）
+
+使い方:
+    for item, fut in fetch_executor().fan_out(fn, items, host_of=lambda it: it["url"], timeout=20):
+        try:
+            fut.result()
+        except Exception: ...
+
+環境変数:
+    FETCH_EXECUTOR_WORKERS     同時実行の上限（既定 16）
+    FETCH_PER_HOST_LIMIT       1ホストあたりの同時実行数（既定 4）
+    FETCH_EXECUTOR_MAX_QUEUE   待ち行列の上限（既定 256）
+"""
+import os
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class FetchRejected(Exception):
+    """待ち行列があふれていて投入できなかった"""
+
+
+class FetchDeadlineExceeded(Exception):
+    """期限までに実行が始まらなかった（または終わらなかった）"""
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def host_key(url_or_host: Optional[str]) -> Optional[str]:
+    """URL からホスト名を取り出す（"www." は同じホストとして扱う）。URL でなければそのまま使う"""
+    if not url_or_host:
+        return None
+    if "://" in url_or_host:
+        host = urlsplit(url_or_host).hostname or ""
+    else:
+        host = url_or_host
+    host = host.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    return host or None
+
+
+_worker = threading.local()
+
+
+def in_fetch_worker() -> bool:
+    return bool(getattr(_worker, "active", False))
+
+
+class _Task:
+    __slots__ = ("run", "host", "deadline", "future", "label", "enqueued_at", "state")
+
+    def __init__(self, run: Callable[[], Any], host: Optional[str], deadline: Optional[float], label: str) -> None:
+        self.run = run
+        self.host = host
+        self.deadline = deadline
+        self.future: Future = Future()
+        self.label = label
+        self.enqueued_at = time.monotonic()
+        self.state = "queued"  # queued → running → done
+
+
+class FetchExecutor:
+    def __init__(self, max_workers: int, per_host: int, max_queue: int) -> None:
+        self.max_workers = max(1, max_workers)
+        self.per_host = max(1, per_host)
+        self.max_queue = max(1, max_queue)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="fetch-io")
+        self._cond = threading.Condition(threading.Lock())
+        self._ready: Deque[_Task] = deque()
+        self._running = 0
+        self._host_running: Dict[str, int] = {}
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "expired": 0, "rejected": 0, "cancelled": 0, "stolen": 0}
+
+    # ---------------- 投入 ----------------
+    def submit(
+        self,
+        fn: Callable[..., Any],
+        *args: Any,
+        host: Optional[str] = None,
+        deadline: Optional[float] = None,
+        label: str = "fetch",
+    ) -> Future:
+        """fn(*args) を投入する。host は URL でもホスト名でもよい。deadline は time.monotonic() 基準"""
+        return self._submit(fn, args, host, deadline, label).future
+
+    def _submit(
+        self,
+        fn: Callable[..., Any],
+        args: Tuple[Any, ...],
+        host: Optional[str],
+        deadline: Optional[float],
+        label: str,
+    ) -> _Task:
+        ctx = contextvars.copy_context()
+        task = _Task(lambda: ctx.run(fn, *args), host_key(host), deadline, label)
+        if deadline is not None and time.monotonic() >= deadline:
+            self._fail(task, FetchDeadlineExceeded(f"deadline passed before submit ({label})"), "expired")
+            return task
+        with self._cond:
+            if len(self._ready) >= self.max_queue:
+                rejected = True
+            else:
+                rejected = False
+                self._stats["submitted"] += 1
+                self._ready.append(task)
+                expired = self._pump_locked()
+        if rejected:
+            logger.warning(f"[Fetch Executor] queue full ({self.max_queue}), rejected {label} for {task.host}")
+            self._fail(task, FetchRejected(f"fetch queue full ({self.max_queue})"), "rejected")
+            return task
+        self._expire(expired)
+        return task
+
+    def _pump_locked(self) -> List[_Task]:
+        """空いている枠に待ち行列のタスクを投入する。期限切れのタスクを返す（ロック外で失敗させる）"""
+        expired: List[_Task] = []
+        if not self._ready:
+            return expired
+        now = time.monotonic()
+        remaining: Deque[_Task] = deque()
+        while self._ready:
+            task = self._ready.popleft()
+            if task.deadline is not None and now >= task.deadline:
+                task.state = "done"
+                expired.append(task)
+                continue
+            if self._running < self.max_workers and self._host_has_room(task.host):
+                self._acquire_host(task.host)
+                self._running += 1
+                task.state = "running"
+                self._pool.submit(self._run_dispatched, task)
+            else:
+                remaining.append(task)
+        self._ready = remaining
+        return expired
+
+    def _host_has_room(self, host: Optional[str]) -> bool:
+        return host is None or self._host_running.get(host, 0) < self.per_host
+
+    def _acquire_host(self, host: Optional[str]) -> None:
+        if host is not None:
+            self._host_running[host] = self._host_running.get(host, 0) + 1
+
+    def _release_host(self, host: Optional[str]) -> None:
+        if host is None:
+            return
+        n = self._host_running.get(host, 0) - 1
+        if n > 0:
+            self._host_running[host] = n
+        else:
+            self._host_running.pop(host, None)
+
+    # ---------------- 実行 ----------------
+    def _run_dispatched(self, task: _Task) -> None:
+        _worker.active = True
+        try:
+            self._execute(task)
+        finally:
+            _worker.active = False
+            with self._cond:
+                self._running -= 1
+                self._release_host(task.host)
+                expired = self._pump_locked()
+                self._cond.notify_all()
+            self._expire(expired)
+
+    def _run_stolen(self, task: _Task) -> None:
+        # 呼び出し元のワーカースレッドでそのまま実行する（スレッドは親の分として数え済み）
+        try:
+            self._execute(task)
+        finally:
+            with self._cond:
+                self._release_host(task.host)
+                expired = self._pump_locked()
+                self._cond.notify_all()
+            self._expire(expired)
+
+    def _execute(self, task: _Task) -> None:
+        waited = time.monotonic() - task.enqueued_at
+        registry.observe("fetch_executor_queue_wait_seconds", {"label": task.label}, waited,
+                         help_text="Time fetch tasks spent queued before running")
+        if not task.future.set_running_or_notify_cancel():
+            return
+        try:
+            result = task.run()
+        except BaseException as e:
+            self._count(task.label, "error", "failed")
+            task.future.set_exception(e)
+        else:
+            self._count(task.label, "ok", "completed")
+            task.future.set_result(result)
+        finally:
+            task.state = "done"
+
+    def _steal_locked(self, tasks: Iterable[_Task]) -> Optional[_Task]:
+        """まだ始まっていない子タスクのうち、ホストの枠が空いているものを1つ引き取る"""
+        for task in tasks:
+            if task.state == "queued" and self._host_has_room(task.host):
+                try:
+                    self._ready.remove(task)
+                except ValueError:
+                    continue
+                self._acquire_host(task.host)
+                task.state = "running"
+                self._stats["stolen"] += 1
+                return task
+        return None
+
+    def _withdraw(self, task: _Task) -> bool:
+        """期限切れで待つのをやめるとき、まだ待ち行列にいるタスクを取り下げる"""
+        with self._cond:
+            if task.state != "queued":
+                return False
+            try:
+                self._ready.remove(task)
+            except ValueError:
+                return False
+            task.state = "done"
+        return True
+
+    def _fail(self, task: _Task, exc: Exception, result: str) -> None:
+        task.state = "done"
+        self._count(task.label, result, result)
+        task.future.set_exception(exc)
+
+    def _expire(self, tasks: List[_Task]) -> None:
+        for task in tasks:
+            self._fail(task, FetchDeadlineExceeded(f"deadline passed while queued ({task.label})"), "expired")
+        if tasks:
+            with self._cond:
+                self._cond.notify_all()
+
+    def _count(self, label: str, result: str, stat: str) -> None:
+        with self._cond:
+            self._stats[stat] = self._stats.get(stat, 0) + 1
+        registry.inc("fetch_executor_tasks_total", {"label": label, "result": result},
+                     help_text="Fetch executor tasks by label and outcome")
+
+    # ---------------- 並列実行の待ち合わせ ----------------
+    def fan_out(
+        self,
+        fn: Callable[[Any], Any],
+        items: Iterable[Any],
+        host_of: Optional[Callable[[Any], Optional[str]]] = None,
+        timeout: Optional[float] = None,
+        label: str = "fetch",
+    ) -> Iterator[Tuple[Any, Future]]:
+        """
+        items の各要素について fn(item) を投入し、終わった順に (item, 完了済み Future) を返す
+
+        timeout 秒を過ぎても終わらないものは FetchDeadlineExceeded の Future として返す
+        （実行中のものはバックグラウンドで最後まで走り、結果は捨てられる）。
+        ワーカースレッドから呼ばれた場合は、待つ間に自分の子タスクを引き取って実行する。
+        途中で for を抜ける（ジェネレータを閉じる）と、まだ始まっていないタスクは取り下げる。
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        tasks: Dict[Future, Tuple[_Task, Any]] = {}
+        for item in items:
+            host = host_of(item) if host_of else None
+            task = self._submit(fn, (item,), host, deadline, label)
+            tasks[task.future] = (task, item)
+
+        pending = dict(tasks)
+        helping = in_fetch_worker()
+        try:
+            while pending:
+                stolen: Optional[_Task] = None
+                with self._cond:
+                    done = [f for f in pending if f.done()]
+                    if not done and helping:
+                        stolen = self._steal_locked(t for t, _ in pending.values())
+                    if not done and stolen is None:
+                        wait = None if deadline is None else deadline - time.monotonic()
+                        if wait is not None and wait <= 0:
+                            break
+                        self._cond.wait(wait if wait is not None else 1.0)
+                        done = [f for f in pending if f.done()]
+                if stolen is not None:
+                    self._run_stolen(stolen)
+                    continue
+                for f in done:
+                    _, item = pending.pop(f)
+                    yield item, f
+        except GeneratorExit:
+            # 呼び出し側が途中で打ち切った（十分な結果がそろった等）。まだ始まっていないものは取り下げる
+            for task, _ in pending.values():
+                if self._withdraw(task):
+                    task.future.cancel()
+                    self._count(label, "cancelled", "cancelled")
+            raise
+
+        # 期限切れ: 待ち行列のものは取り下げ、実行中のものは待たずに返す
+        for f, (task, item) in pending.items():
+            if self._withdraw(task):
+                self._fail(task, FetchDeadlineExceeded(f"deadline passed while queued ({label})"), "expired")
+                yield item, task.future
+            elif f.done():
+                yield item, f
+            else:
+                self._count(label, "abandoned", "expired")
+                late: Future = Future()
+                late.set_exception(FetchDeadlineExceeded(f"{label} still running at deadline"))
+                yield item, late
+
+    # ---------------- 統計 ----------------
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            s = dict(self._stats)
+            s.update(
+                workers=self.max_workers,
+                per_host_limit=self.per_host,
+                running=self._running,
+                queued=len(self._ready),
+                busy_hosts=len(self._host_running),
+            )
+        return s
+
+
+# -------------------------------
+# プロセスごとのシングルトン（fork 後は作り直す）
+# -------------------------------
+_executor: Optional[FetchExecutor] = None
+_executor_pid: Optional[int] = None
+_executor_lock = threading.Lock()
+
+
+def fetch_executor() -> FetchExecutor:
+    global _executor, _executor_pid
+    if _executor is not None and _executor_pid == os.getpid():
+        return _executor
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = FetchExecutor(
+                max_workers=_env_int("FETCH_EXECUTOR_WORKERS", 16),
+                per_host=_env_int("FETCH_PER_HOST_LIMIT", 4),
+                max_queue=_env_int("FETCH_EXECUTOR_MAX_QUEUE", 256),
+            )
+            _executor_pid = os.getpid()
+            logger.info(
+                f"[Fetch Executor] workers={_executor.max_workers} per_host={_executor.per_host} "
+                f"max_queue={_executor.max_queue}"
+            )
+    return _executor
+
+
+def fetch_executor_stats() -> Dict[str, int]:
+    if _executor is None or _executor_pid != os.getpid():
+        return {}
+    return _executor.stats()
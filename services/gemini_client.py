@@ -219,8 +219,8 @@ class GeminiClient:
         Returns:
             enriched_content フィールドを追加した検索結果
         """
-        from concurrent.futures import ThreadPoolExecutor, as_completed
         import requests
+        from services.fetch_executor import fetch_executor
 
         enriched_results = []
 
@@ -282,18 +282,17 @@ class GeminiClient:
                 logger.warning(f"WebFetch failed for {url}: {e}")
                 return result
 
-        # 並列でWebFetch実行
-        with ThreadPoolExecutor(max_workers=min(2, len(fetch_targets))) as executor:
-            futures = {executor.submit(fetch_content, r): r for r in fetch_targets}
-            for future in as_completed(futures):
-                try:
-                    enriched_result = future.result()
-                    enriched_results.append(enriched_result)
-                except Exception as e:
-                    logger.error(f"WebFetch thread error: {e}")
-                    # エラー時は元の結果をそのまま追加
-                    original = futures[future]
-                    enriched_results.append(original)
+        # 並列でWebFetch実行（プロセス共通のエグゼキュータ。ホストごとの同時接続数を制限）
+        for original, future in fetch_executor().fan_out(
+            fetch_content, fetch_targets, host_of=lambda r: r.get("url", ""), timeout=25, label="webfetch"
+        ):
+            try:
+                enriched_result = future.result()
+                enriched_results.append(enriched_result)
+            except Exception as e:
+                logger.error(f"WebFetch thread error: {e}")
+                # エラー時は元の結果をそのまま追加
+                enriched_results.append(original)
 
         # WebFetch対象外の結果も追加
         for r in search_results:
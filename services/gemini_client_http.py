@@ -1,8 +1,23 @@
 # services/gemini_client_http.py
 import os
+import json
+import time
+import hashlib
+import contextvars
 import logging
 import requests
-from typing import List, Dict, Any, Tuple, Optional
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import List, Dict, Any, Iterator, Tuple, Optional
+
+from services.http_pool import gemini_api_host, gemini_transport, preconnect_gemini
+from services.tiered_cache import TieredCache
+from services.circuit_breaker import circuit_breaker, error_class_for_status
+from services.rate_limiter import GeminiRateLimited, rate_limiter
+from services.token_estimator import estimate_contents_tokens, estimate_tokens
+from services.gemini_context_cache import ContextCacheManager, record_cached_tokens
+from services.gemini_hedge import hedge_delay, hedge_enabled, hedge_executor, latency_tracker, timed_call
+from services.metrics import current_caller, record_chat_path, record_gemini_call
+from services.model_router import model_router, router_enabled
 
 logger = logging.getLogger(__name__)
 
@@ -36,8 +51,520 @@ def _norm(model: str) -> str:
     return m
 
 class GeminiFallbackError(Exception):
-    """全候補モデルが失敗したときの例外"""
-    pass
+    """
+    全候補モデルが失敗したときの例外
+    error_class: circuit_breaker.ERROR_CLASSES のいずれか（not_found / rate_limit / server / client / timeout / network /
+    throttled / invalid_json / other）。cache_miss は呼び出し側で付け替える
+    """
+
+    def __init__(self, message: str = "", error_class: str = "other", status_code: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.error_class = error_class
+        self.status_code = status_code
+
+
+# -------------------------------
+# リクエスト組み立て・応答解析のヘルパ
+# -------------------------------
+# 通常の chat の temperature（返信を JSON で受け取る呼び出しも返信の文体を揃えるためにこれを使う）
+CHAT_TEMPERATURE = 0.7
+
+
+def build_generate_payload(
+    contents: List[Dict[str, str]],
+    cached_content: Optional[str] = None,
+    generation_config: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    contents は chat 風 [{"role":"user","content":"..."}, ...] を受け取り、
+    Gemini API が期待する [{"role":..., "parts":[{"text":...}]}] に正規化する。
+    cached_content があれば cachedContents の名前を参照させる（前半はサーバ側に保持済み）。
+    generation_config は既定の generationConfig に上書きマージする（JSON モード等）。
+    """
+    normalized_contents = []
+    for m in contents:
+        role = m.get("role") or ("user" if m.get("content") else "model")
+        text = m.get("content") or m.get("text") or ""
+        normalized_contents.append({"role": role, "parts": [{"text": text}]})
+
+    payload: Dict[str, Any] = {
+        "contents": normalized_contents,
+        "generationConfig": {
+            "temperature": CHAT_TEMPERATURE,
+            "maxOutputTokens": 4096,  # より長い要約に対応
+        }
+    }
+    if generation_config:
+        payload["generationConfig"].update(generation_config)
+    if cached_content:
+        payload["cachedContent"] = cached_content
+    return payload
+
+
+def build_chat_contents(messages: List[Dict[str, str]], user_message: str) -> List[Dict[str, str]]:
+    payload = []
+    for m in messages:
+        payload.append({"role": m["role"], "content": m["content"]})
+    payload.append({"role": "user", "content": user_message})
+    return payload
+
+
+def raise_for_gemini_status(status_code: int, body: str, model: str) -> None:
+    if status_code == 200:
+        return
+    error_msg = f"HTTP {status_code}: {body}"
+    logger.error(f"Gemini API error: {error_msg}")
+    error_class = error_class_for_status(status_code)
+    if status_code == 404:
+        raise GeminiFallbackError(f"Model not found: {model}", error_class, status_code)
+    elif status_code == 429:
+        raise GeminiFallbackError("Rate limit exceeded", error_class, status_code)
+    else:
+        raise GeminiFallbackError(error_msg, error_class, status_code)
+
+
+def extract_response_text(result: Dict[str, Any], model: str) -> str:
+    candidates = result.get("candidates", [])
+    if not candidates:
+        logger.warning(f"No candidates in response for model {model}")
+        return ""
+
+    # テキスト取得
+    content = candidates[0].get("content", {})
+    parts = content.get("parts", [])
+    if not parts:
+        logger.warning(f"No parts in response for model {model}")
+        return ""
+
+    return parts[0].get("text", "").strip()
+
+
+def acquire_rate_limit(model: str, contents: List[Dict[str, str]], output_tokens: Optional[int] = None) -> None:
+    """
+    レート制限のバケットを取得する（入力の推定トークン + 出力見込み）。
+    output_tokens: 出力上限が分かっている呼び出し（JSON モード等）はその値を使う。
+    取得できなければ throttled の GeminiFallbackError（ブレーカーは開かず、集計だけに数える）。
+    """
+    if output_tokens is None:
+        output_tokens = int(os.getenv("GEMINI_RL_OUTPUT_TOKENS", "1024"))
+    tokens = estimate_contents_tokens(contents) + output_tokens
+    try:
+        rate_limiter.acquire(model, tokens)
+    except GeminiRateLimited as e:
+        logger.warning(f"[Gemini RL] {e}")
+        record_gemini_call(model, "throttled", None)
+        circuit_breaker.record_failure(model, "throttled")
+        raise GeminiFallbackError(str(e), "throttled")
+
+
+def final_fallback_error(last_err: Optional[Exception]) -> GeminiFallbackError:
+    error_msg = str(last_err) if last_err else "all candidates failed"
+    if "timeout" in error_msg.lower() or "deadline" in error_msg.lower():
+        return GeminiFallbackError("Gemini APIがタイムアウトしました。しばらく待ってから再試行してください。")
+    return GeminiFallbackError(f"Gemini APIエラー: {error_msg}")
+
+
+def record_call_path(call_type: str, tried: List[str], outcome: str, used: str = "") -> None:
+    """フォールバック経路をメトリクスに、先頭モデルで成功したかをルーターの品質シグナルに記録"""
+    record_chat_path(tried, outcome)
+    if tried:
+        model_router.record_result(call_type, tried[0], bool(used) and used == tried[0])
+
+
+def route_request(
+    call_type: str, requested_model: str, text: str, prompt_tokens: Optional[int] = None
+) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """
+    明示モデルが無ければルーターでモデルと出力上限を決める。
+    returns (requested_model, generation_config)
+    """
+    if requested_model or not router_enabled():
+        return requested_model, None
+    decision = model_router.route(call_type, text, prompt_tokens)
+    return decision["model"], {"maxOutputTokens": decision["max_output_tokens"]}
+
+
+# -------------------------------
+# JSON モード（responseMimeType + responseSchema）
+# スキーマは Gemini の OpenAPI サブセット（type は "STRING" / "ARRAY" / "OBJECT" など）
+# -------------------------------
+def json_generation_config(
+    schema: Dict[str, Any], max_output_tokens: int = 1024, temperature: float = 0.2
+) -> Dict[str, Any]:
+    """
+    構造化出力用の generationConfig。
+    2.5 系は思考トークンも maxOutputTokens に含まれるため、小さな JSON でも 1024 程度は残す。
+    temperature: 抽出・分類は低め（既定）、返信本文を含む場合は CHAT_TEMPERATURE。
+    """
+    return {
+        "temperature": temperature,
+        "maxOutputTokens": max_output_tokens,
+        "responseMimeType": "application/json",
+        "responseSchema": schema,
+    }
+
+
+_JSON_TYPES: Dict[str, Tuple[type, ...]] = {
+    "STRING": (str,),
+    "INTEGER": (int,),
+    "NUMBER": (int, float),
+    "BOOLEAN": (bool,),
+    "ARRAY": (list,),
+    "OBJECT": (dict,),
+}
+
+
+def validate_json(value: Any, schema: Dict[str, Any], path: str = "$") -> None:
+    """responseSchema の型・必須項目・要素数を確認する。違反は ValueError"""
+    type_name = str(schema.get("type", "")).upper()
+    expected = _JSON_TYPES.get(type_name)
+    if expected:
+        # bool は int のサブクラスなので INTEGER / NUMBER では除外する
+        if not isinstance(value, expected) or (type_name in ("INTEGER", "NUMBER") and isinstance(value, bool)):
+            raise ValueError(f"{path}: expected {type_name}, got {type(value).__name__}")
+    if type_name == "ARRAY":
+        if "minItems" in schema and len(value) < int(schema["minItems"]):
+            raise ValueError(f"{path}: expected at least {schema['minItems']} items, got {len(value)}")
+        item_schema = schema.get("items")
+        if item_schema:
+            for i, item in enumerate(value):
+                validate_json(item, item_schema, f"{path}[{i}]")
+    elif type_name == "OBJECT":
+        for key in schema.get("required", []):
+            if key not in value:
+                raise ValueError(f"{path}: missing required property '{key}'")
+        for key, prop_schema in (schema.get("properties") or {}).items():
+            if key in value and value[key] is not None:
+                validate_json(value[key], prop_schema, f"{path}.{key}")
+
+
+def parse_json_response(text: str, schema: Dict[str, Any], model: str) -> Any:
+    """
+    JSON モードの応答をパースしてスキーマ検証する。
+    maxItems を超えた配列は切り詰める（API 側で守られない場合がある）。
+    不正なら invalid_json の GeminiFallbackError（次の候補モデルへ）。
+    """
+    try:
+        value = json.loads(text)
+        validate_json(value, schema)
+    except ValueError as e:  # json.JSONDecodeError も ValueError
+        logger.warning(f"[Gemini JSON] invalid response from {model}: {e}; body={text[:200]!r}")
+        raise GeminiFallbackError(f"Invalid JSON from {model}: {e}", "invalid_json")
+    if isinstance(value, list) and "maxItems" in schema:
+        value = value[: int(schema["maxItems"])]
+    return value
+
+
+# -------------------------------
+# 決定的プロンプトの応答キャッシュ（プロセス内 LRU → Redis）
+# キー = sha256(モデル + generationConfig + contents)
+# -------------------------------
+_RESPONSE_CACHE_TTLS: Dict[str, int] = {
+    "analyze_conversation": 3600,                 # 1時間
+    "summarize_with_citations": 1800,             # 30分（ニュース等は日付ガード込みのプロンプト）
+    "summarize_with_citations_enriched": 1800,
+    "summarize_book_with_toc": 86400,             # 24時間（書籍情報は変化が少ない）
+}
+
+response_cache = TieredCache(
+    "gemini_response",
+    max_entries=int(os.getenv("GEMINI_CACHE_MAX_ENTRIES", "256")),
+    max_bytes=int(os.getenv("GEMINI_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+)
+
+
+def response_cache_enabled() -> bool:
+    return os.getenv("GEMINI_RESPONSE_CACHE", "true").lower() == "true"
+
+
+def response_cache_ttl(method: str) -> int:
+    """メソッド別 TTL（GEMINI_CACHE_TTL_<METHOD> で上書き可能、0 で無効）"""
+    env_val = os.getenv(f"GEMINI_CACHE_TTL_{method.upper()}")
+    if env_val is not None:
+        try:
+            return int(env_val)
+        except ValueError:
+            pass
+    return _RESPONSE_CACHE_TTLS.get(method, 0)
+
+
+def response_cache_key(
+    model: str, contents: List[Dict[str, str]], generation_config: Optional[Dict[str, Any]] = None
+) -> str:
+    payload = build_generate_payload(contents, generation_config=generation_config)
+    material = json.dumps(
+        {"model": model, "generationConfig": payload["generationConfig"], "contents": payload["contents"]},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+# -------------------------------
+# プロンプト組み立て
+# -------------------------------
+def build_analyze_prompt(messages: List[Dict[str, str]]) -> str:
+    """会話要約（サイドバー表示用）のプロンプト"""
+    # プロンプトをより詳細化
+    prompt = (
+        "## 指示\n"
+        "以下の会話履歴に基づき、この会話の主題を要約してください。\n\n"
+        "## 制約条件\n"
+        "- 要約は、会話の主題がすぐに分かるように、20文字程度の簡潔な日本語のテキストにしてください。\n"
+        "- この要約は、チャットアプリのサイドバーに表示されるタイトルとして使用されます。\n"
+        "- 要約は JSON の summary フィールドに入れてください。接頭辞（例: 「要約:」）やMarkdownは不要です。\n"
+        "- 会話の冒頭部分を参考に、主要なトピックを抽出してください。\n\n"
+        "## 会話履歴\n"
+    )
+    
+    # 会話履歴をプロンプトに追加
+    history_text = []
+    for m in messages:
+        role = "User" if m["role"] == "user" else "Assistant"
+        history_text.append(f"{role}: {m['content']}")
+    
+    prompt += "\n".join(history_text)
+    return prompt
+
+
+ANALYZE_SCHEMA: Dict[str, Any] = {
+    "type": "OBJECT",
+    "properties": {"summary": {"type": "STRING"}},
+    "required": ["summary"],
+}
+
+CHAT_WITH_SUMMARY_SCHEMA: Dict[str, Any] = {
+    "type": "OBJECT",
+    "properties": {"reply": {"type": "STRING"}, "summary": {"type": "STRING"}},
+    "required": ["reply", "summary"],
+}
+
+
+def build_chat_with_summary_prompt(user_message: str, current_summary: str = "") -> str:
+    """返信とサイドバー要約を1回の呼び出しで得るためのプロンプト（会話履歴は contents 側で送る）"""
+    current = current_summary.strip() if current_summary else "（まだありません）"
+    return (
+        f"{user_message}\n\n"
+        "---\n"
+        "## 出力形式（システム指示）\n"
+        "上のメッセージに普段どおり回答し、次の2項目を JSON で返してください。\n"
+        "- reply: ユーザーへの回答本文（Markdown 可）\n"
+        "- summary: この会話全体の主題を表す20文字程度の簡潔な日本語（サイドバーのタイトル用。"
+        "接頭辞やMarkdownは不要）。主題が変わっていなければ現在の要約をそのまま返してよい\n"
+        f"現在の要約: {current}"
+    )
+
+
+def clean_summary_text(text: str) -> str:
+    # 不要な部分を削除
+    return text.strip().replace("要約:", "").replace("タイトル:", "").strip()
+
+
+def join_prompt_parts(prefix: str, suffix: str) -> str:
+    return f"{prefix}\n\n{suffix}"
+
+
+# 以下の *_prompt_parts は (prefix, suffix) を返す。
+# prefix = 変化しにくい指示 + 資料（コンテキストキャッシュの対象）、suffix = 毎回変わる要望部分。
+def build_citations_prompt_parts(query: str, search_results: List[Dict[str, str]]) -> Tuple[str, str]:
+    """検索結果を踏まえた要約のプロンプト"""
+    lines = [
+        "**指示:**\n"
+        "以下の参考資料を徹底的に分析し、末尾のユーザーの要望に答えてください。\n\n"
+        "**分析手順:**\n"
+        "1. すべての参考資料を注意深く読み、関連する情報を抽出する\n"
+        "2. 複数の情報源で一致する内容を重視し、信頼性を確保する\n"
+        "3. 情報源の信頼性を評価（公式サイト、書評サイト、専門家の意見などを優先）\n"
+        "4. 矛盾する情報がある場合は、より詳細で信頼できる情報源を採用する\n"
+        "5. 検索結果に含まれる情報から、ユーザーの要望に最も関連する内容を抽出する\n"
+        "6. 情報を統合し、包括的で分かりやすい回答を作成する\n\n"
+        "**回答の形式:**\n"
+        "- できる限り具体的に説明してください\n"
+        "- 箇条書きや段落を適切に使い、読みやすく構成してください\n"
+        "- 検索結果から得られた情報を最大限活用してください\n"
+        "- 最後に、参考にした主要な情報源のURLを列挙してください",
+        "\n参考資料:",
+    ]
+    for i, r in enumerate(search_results, 1):
+        title = r.get("title", "")
+        url = r.get("url", "")
+        snip = r.get("snippet", "")
+        lines.append(f"[{i}] {title}\nURL: {url}\n内容: {snip}\n")
+
+    return "\n".join(lines), f"ユーザーの要望: {query}"
+
+
+def build_citations_prompt(query: str, search_results: List[Dict[str, str]]) -> str:
+    return join_prompt_parts(*build_citations_prompt_parts(query, search_results))
+
+
+def build_enriched_prompt_parts(query: str, search_results: List[Dict[str, str]]) -> Tuple[str, str]:
+    """enriched_content 対応版の要約プロンプト"""
+    lines: List[str] = [
+        "指示:",
+        "- 以下の資料を総合して、末尾のユーザーの要望について日本語で簡潔かつ具体的に要約してください。",
+        "- 直接的な記述が不足している箇所は、資料全体の傾向や整合から合理的に推測し、空白を埋めてください。",
+        "- 断片的な情報しかない場合でも、有用性を重視して最も妥当な全体像を提示してください。",
+        "- 最後に参考URLを列挙してください。",
+        "",
+        "---",
+        "",
+    ]
+
+    # ユーザー提供資料を優先表示
+    user_entries: List[str] = []
+    other_entries: List[str] = []
+    for i, r in enumerate(search_results, 1):
+        title = r.get("title", "")
+        url = r.get("url") or r.get("link") or r.get("info_link") or ""
+        snip = r.get("snippet", "")
+        enriched = r.get("enriched_content", "")
+        is_user = (r.get("source") == "user") or (url.startswith("user:"))
+
+        if enriched:
+            entry = f"[{i}] {title}\nURL: {url}\n詳細情報: {enriched}\n"
+        elif snip:
+            entry = f"[{i}] {title}\nURL: {url}\n要旨: {snip}\n"
+        else:
+            entry = f"[{i}] {title}\nURL: {url}\n（要約情報なし）\n"
+
+        if is_user:
+            user_entries.append(entry)
+        else:
+            other_entries.append(entry)
+
+    if user_entries:
+        lines.append("ユーザー提供資料（優先）:")
+        lines.extend(user_entries)
+        lines.append("")
+
+    lines.append("参照資料:")
+    lines.extend(other_entries)
+
+    return "\n".join(lines), f"ユーザーの要望: {query}"
+
+
+def build_enriched_prompt(query: str, search_results: List[Dict[str, str]]) -> str:
+    return join_prompt_parts(*build_enriched_prompt_parts(query, search_results))
+
+
+def build_book_toc_prompt_parts(
+    book_title: str,
+    table_of_contents: str,
+    search_results: List[Dict[str, str]],
+) -> Tuple[str, str]:
+    """書籍専用要約のプロンプト（目次構造・信頼ドメイン優先）"""
+    try:
+        from app.constants import TRUSTED_BOOK_SOURCES_DOMAINS, USE_TRUSTED_DOMAINS
+        trusted_domains = TRUSTED_BOOK_SOURCES_DOMAINS if USE_TRUSTED_DOMAINS else []
+    except Exception:
+        trusted_domains = [
+            "amazon.co.jp",
+            "books.rakuten.co.jp",
+            "hanmoto.com",
+            "bookmeter.com",
+            "booklog.jp",
+            "honz.jp",
+        ]
+
+    lines: List[str] = []
+    lines.append("重要な指示:")
+    lines.append("1. 以下の参照資料から書籍の主題・対象読者・著者の意図を把握してください。")
+    lines.append("2. 末尾の目次の章立てに沿って、各章の要点を日本語でまとめてください。")
+    lines.append("3. 直接的な記述がない章は、章タイトル・書籍の全体テーマ・著者の傾向から合理的に推測して要約してください。")
+    lines.append("4. 有用性を重視し、可能な範囲で具体例やキーワードも含めてください。")
+    lines.append("5. 参照先の信頼性を意識し、公式・大手書店・書評サイトの情報を優先してください。")
+    lines.append("6. 最後に参考URLを列挙してください。")
+
+    lines.append("")
+    lines.append("出力フォーマット例:")
+    lines.append("```")
+    lines.append("## 書籍名")
+    lines.append("")
+    lines.append("### 序章/第1章: [章タイトル]")
+    lines.append("[この章の要約]")
+    lines.append("")
+    lines.append("### 第2章: [章タイトル]")
+    lines.append("[この章の要約]")
+    lines.append("")
+    lines.append("...")
+    lines.append("")
+    lines.append("## 参考URL")
+    lines.append("- [URL1]")
+    lines.append("- [URL2]")
+    lines.append("```")
+    lines.append("")
+    lines.append("---")
+    lines.append("")
+
+    # ユーザー提供の章ヒント、資料を優先提示
+    user_hint_entries: List[str] = []
+    user_entries: List[str] = []
+    other_entries: List[str] = []
+
+    for i, r in enumerate(search_results, 1):
+        title = r.get("title", "")
+        url = r.get("url") or r.get("link") or r.get("info_link") or ""
+        snip = r.get("snippet", "")
+        enriched = r.get("enriched_content", "")
+        is_user = (r.get("source") == "user") or (url.startswith("user:"))
+        chapter_hint = (r.get("chapter") or "").strip()
+
+        if enriched:
+            entry = f"[{i}] {title}\nURL: {url}\n詳細情報: {enriched}\n"
+        elif snip:
+            entry = f"[{i}] {title}\nURL: {url}\n要旨: {snip}\n"
+        else:
+            entry = f"[{i}] {title}\nURL: {url}\n（詳細情報なし）\n"
+
+        if is_user and chapter_hint:
+            user_hint_entries.append(f"- 章: {chapter_hint}\n  ヒント: {enriched or snip}")
+            user_entries.append(entry)
+        elif is_user:
+            user_entries.append(entry)
+        else:
+            # 信頼ドメイン優先の並べ替え用に分類
+            if any(d in (url or "") for d in trusted_domains):
+                other_entries.append("__TRUSTED__\n" + entry)
+            else:
+                other_entries.append(entry)
+
+    if user_hint_entries:
+        lines.append("ユーザー提供：章ヒント（優先）")
+        lines.extend(user_hint_entries)
+        lines.append("")
+
+    if user_entries:
+        lines.append("ユーザー提供資料（優先）:")
+        lines.extend(user_entries)
+        lines.append("")
+
+    lines.append("参照資料:")
+
+    # 信頼ドメイン（__TRUSTED__マーク）を優先表示
+    for e in other_entries:
+        if e.startswith("__TRUSTED__\n"):
+            lines.append(e.replace("__TRUSTED__\n", ""))
+    for e in other_entries:
+        if not e.startswith("__TRUSTED__\n"):
+            lines.append(e)
+
+    suffix = "\n".join([
+        f"対象書籍: {book_title}",
+        "",
+        "提供された目次:",
+        table_of_contents.strip() or "（目次情報なし）",
+    ])
+    return "\n".join(lines), suffix
+
+
+def build_book_toc_prompt(
+    book_title: str,
+    table_of_contents: str,
+    search_results: List[Dict[str, str]],
+) -> str:
+    return join_prompt_parts(*build_book_toc_prompt_parts(book_title, table_of_contents, search_results))
+
 
 class GeminiClient:
     def __init__(
@@ -57,7 +584,14 @@ class GeminiClient:
         self.primary_model = _norm(primary_model or "gemini-2.5-pro")
         self.fallback_model = _norm(fallback_model or "gemini-2.5-flash")
 
-        self.base_url = f"https://generativelanguage.googleapis.com/{self.api_version}"
+        self.base_url = f"{gemini_api_host()}/{self.api_version}"
+
+        # プロセス共有の keep-alive プール（fork 後は自動で作り直される）
+        self.transport = gemini_transport()
+        preconnect_gemini()
+
+        # cachedContents（GEMINI_CONTEXT_CACHE=true のときのみ使用）
+        self.context_cache = ContextCacheManager(self)
 
         logger.info(
             f"[Gemini HTTP] api_version={self.api_version} primary={self.primary_model} "
@@ -67,76 +601,215 @@ class GeminiClient:
     # --------------------------------
     # 内部：生成 API 呼び出し（HTTP版）
     # --------------------------------
-    def _run_generate(self, model: str, contents: List[Dict[str, str]]) -> str:
-        """
-        contents は chat 風 [{"role":"user","content":"..."}, ...] を受け取り、
-        Gemini API が期待する [{"role":..., "parts":[{"text":...}]}] に正規化する。
-        """
+    def _run_generate(
+        self,
+        model: str,
+        contents: List[Dict[str, str]],
+        cached_content: Optional[str] = None,
+        generation_config: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        acquire_rate_limit(model, contents, (generation_config or {}).get("maxOutputTokens"))
+        started = time.monotonic()
+        try:
+            out, usage = self._run_generate_raw(model, contents, cached_content, generation_config)
+        except GeminiFallbackError as e:
+            if cached_content and e.status_code in (400, 403, 404):
+                # 参照した cachedContents が期限切れ等。モデルの障害ではないのでブレーカーに数えない
+                e.error_class = "cache_miss"
+                record_gemini_call(model, e.error_class, time.monotonic() - started)
+                raise
+            circuit_breaker.record_failure(model, e.error_class)
+            record_gemini_call(model, e.error_class, time.monotonic() - started)
+            raise
+        elapsed = time.monotonic() - started
+        circuit_breaker.record_success(model, elapsed)
+        record_cached_tokens(usage)
+        record_gemini_call(model, "ok", elapsed, usage)
+        return out
+
+    def _run_generate_raw(
+        self,
+        model: str,
+        contents: List[Dict[str, str]],
+        cached_content: Optional[str] = None,
+        generation_config: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[str, Dict[str, Any]]:
+        """returns (text, usageMetadata)"""
         try:
-            # メッセージを正規化
-            normalized_contents = []
-            for m in contents:
-                role = m.get("role") or ("user" if m.get("content") else "model")
-                text = m.get("content") or m.get("text") or ""
-                normalized_contents.append({"role": role, "parts": [{"text": text}]})
-
-            # リクエストボディ
-            payload = {
-                "contents": normalized_contents,
-                "generationConfig": {
-                    "temperature": 0.7,
-                    "maxOutputTokens": 4096,  # より長い要約に対応
-                }
-            }
+            payload = build_generate_payload(contents, cached_content, generation_config)
 
             # エンドポイント
             url = f"{self.base_url}/models/{model}:generateContent?key={self.api_key}"
 
-            # HTTPリクエスト送信
+            # HTTPリクエスト送信（共有プール経由で接続を再利用）
             headers = {"Content-Type": "application/json"}
-            response = requests.post(url, json=payload, headers=headers, timeout=120)  # 2分 - 長いコンテンツ要約に対応
+            response = self.transport.post(url, json=payload, headers=headers, timeout=120)  # 2分 - 長いコンテンツ要約に対応
 
             # エラーハンドリング
-            if response.status_code != 200:
-                error_msg = f"HTTP {response.status_code}: {response.text}"
-                logger.error(f"Gemini API error: {error_msg}")
-                if response.status_code == 404:
-                    raise GeminiFallbackError(f"Model not found: {model}")
-                elif response.status_code == 429:
-                    raise GeminiFallbackError("Rate limit exceeded")
-                else:
-                    raise GeminiFallbackError(error_msg)
+            raise_for_gemini_status(response.status_code, response.text, model)
 
             # レスポンスパース
             result = response.json()
-            candidates = result.get("candidates", [])
-            if not candidates:
-                logger.warning(f"No candidates in response for model {model}")
-                return ""
-
-            # テキスト取得
-            content = candidates[0].get("content", {})
-            parts = content.get("parts", [])
-            if not parts:
-                logger.warning(f"No parts in response for model {model}")
-                return ""
-
-            text = parts[0].get("text", "").strip()
-            return text
+            return extract_response_text(result, model), result.get("usageMetadata") or {}
 
         except requests.exceptions.Timeout:
             logger.error(f"Request timeout for model {model}")
-            raise GeminiFallbackError(f"Request timeout for model {model}")
+            raise GeminiFallbackError(f"Request timeout for model {model}", "timeout")
         except requests.exceptions.RequestException as e:
             logger.error(f"Request error for model {model}: {e}")
-            raise GeminiFallbackError(f"Request error: {str(e)}")
+            raise GeminiFallbackError(f"Request error: {str(e)}", "network")
 
-    def _chat_once(self, model: str, messages: List[Dict[str, str]], user_message: str) -> str:
-        payload = []
-        for m in messages:
-            payload.append({"role": m["role"], "content": m["content"]})
-        payload.append({"role": "user", "content": user_message})
-        return self._run_generate(model, payload)
+    def _run_generate_stream(
+        self,
+        model: str,
+        contents: List[Dict[str, str]],
+        generation_config: Optional[Dict[str, Any]] = None,
+    ) -> Iterator[str]:
+        """
+        streamGenerateContent（SSE）を呼び出し、テキスト断片を順に返すジェネレータ。
+        """
+        payload = build_generate_payload(contents, generation_config=generation_config)
+        url = f"{self.base_url}/models/{model}:streamGenerateContent?alt=sse&key={self.api_key}"
+        headers = {"Content-Type": "application/json", "Accept": "text/event-stream"}
+        acquire_rate_limit(model, contents, (generation_config or {}).get("maxOutputTokens"))
+        started = time.monotonic()
+        usage: Dict[str, Any] = {}
+        try:
+            # connect 10秒 / 断片間の待ち 120秒
+            with self.transport.stream("POST", url, json=payload, headers=headers, timeout=(10, 120)) as response:
+                if response.status_code != 200:
+                    raise_for_gemini_status(response.status_code, response.read_text(), model)
+
+                for line in response.iter_lines():
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if not data:
+                        continue
+                    try:
+                        chunk = json.loads(data)
+                    except json.JSONDecodeError:
+                        logger.warning(f"Malformed SSE chunk from {model}: {data[:200]}")
+                        continue
+                    # usageMetadata は最後の断片に載る
+                    usage = chunk.get("usageMetadata") or usage
+                    for cand in chunk.get("candidates", [])[:1]:
+                        for part in (cand.get("content") or {}).get("parts", []):
+                            text = part.get("text") or ""
+                            if text:
+                                yield text
+
+        except requests.exceptions.Timeout:
+            logger.error(f"Stream timeout for model {model}")
+            circuit_breaker.record_failure(model, "timeout")
+            record_gemini_call(model, "timeout", time.monotonic() - started, stream=True)
+            raise GeminiFallbackError(f"Request timeout for model {model}", "timeout")
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Stream error for model {model}: {e}")
+            circuit_breaker.record_failure(model, "network")
+            record_gemini_call(model, "network", time.monotonic() - started, stream=True)
+            raise GeminiFallbackError(f"Request error: {str(e)}", "network")
+        except GeminiFallbackError as e:
+            circuit_breaker.record_failure(model, e.error_class)
+            record_gemini_call(model, e.error_class, time.monotonic() - started, stream=True)
+            raise
+        elapsed = time.monotonic() - started
+        circuit_breaker.record_success(model, elapsed)
+        record_cached_tokens(usage)
+        record_gemini_call(model, "ok", elapsed, usage, stream=True)
+
+    def _chat_once(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        user_message: str,
+        cache_prefix: str = "",
+        generation_config: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        if cache_prefix:
+            # 前半を cachedContents に載せられれば、後半だけを送る
+            name = self.context_cache.get_or_create(model, cache_prefix)
+            if name:
+                try:
+                    return self._run_generate(
+                        model, build_chat_contents(messages, user_message), name, generation_config
+                    )
+                except GeminiFallbackError as e:
+                    if e.error_class != "cache_miss":
+                        raise
+                    logger.warning(f"[Gemini CtxCache] {name} unusable ({e}); sending full prompt")
+                    self.context_cache.invalidate(model, cache_prefix)
+            user_message = join_prompt_parts(cache_prefix, user_message)
+        return self._run_generate(model, build_chat_contents(messages, user_message), None, generation_config)
+
+    def _cached_chat(
+        self, method: str, prompt: str, requested_model: str, use_cache: bool = True, cache_prefix: str = ""
+    ) -> Tuple[str, str]:
+        """
+        単発プロンプトの chat を応答キャッシュ経由で実行する。
+        use_cache=False または GEMINI_RESPONSE_CACHE=false でバイパス。
+        cache_prefix があれば prompt の前に付く共通部分として扱う（コンテキストキャッシュ対象）。
+        """
+        ttl = response_cache_ttl(method)
+        if not (use_cache and ttl > 0 and response_cache_enabled()):
+            return self.chat([], prompt, requested_model=requested_model, cache_prefix=cache_prefix, call_type=method)
+
+        # キーはルーターが選んだモデルと generationConfig（出力上限）から作る
+        prompt_tokens = estimate_tokens(cache_prefix + prompt)
+        requested_model, config = route_request(method, requested_model, prompt, prompt_tokens)
+        full_prompt = join_prompt_parts(cache_prefix, prompt) if cache_prefix else prompt
+        key = response_cache_key(
+            _norm(requested_model) or self.primary_model, build_chat_contents([], full_prompt), config
+        )
+        hit = response_cache.get(key)
+        if hit:
+            logger.info(f"[Gemini Cache] hit method={method} model={hit.get('model')}")
+            return hit["text"], hit["model"]
+
+        text, used = self._chat_routed([], prompt, requested_model, cache_prefix, method, config)
+        if text:
+            response_cache.set(key, {"text": text, "model": used}, ttl)
+        return text, used
+
+    def _candidate_models(self, requested_model: str) -> List[str]:
+        candidates = []
+        req = _norm(requested_model)
+        if req:
+            candidates.append(req)
+        candidates.extend([self.primary_model, self.fallback_model])
+        # ブレーカーが open のモデルは試さない（half_open の probe 枠は試す直前に _admit で取る）
+        return circuit_breaker.filter_models(list(dict.fromkeys(candidates)))
+
+    @staticmethod
+    def _admit(model: str, force: bool = False) -> bool:
+        """
+        試す直前のブレーカー確認（half_open なら probe 枠を取る）。
+        force: 他に試せる候補が残っていない（ブレーカーで全リクエストを落とさない）
+        """
+        try:
+            if circuit_breaker.allow(model):
+                return True
+        except Exception as e:
+            logger.warning(f"[Gemini CB] allow check failed for {model}: {e}")
+            return True
+        if force:
+            return True
+        logger.warning(f"[Gemini CB] skip model={model} (half-open probe in progress)")
+        return False
+
+    def _hedged_attempt(
+        self,
+        model: str,
+        force: bool,
+        messages: List[Dict[str, str]],
+        user_message: str,
+        cache_prefix: str,
+        generation_config: Optional[Dict[str, Any]],
+    ) -> str:
+        # probe 枠はワーカーで実際に始まるときに取る（開始前にキャンセルされたら取らない）
+        if not self._admit(model, force):
+            raise GeminiFallbackError(f"Circuit half-open for {model}", "circuit_open")
+        return timed_call(model, self._chat_once, model, messages, user_message, cache_prefix, generation_config)
 
     # --------------------------------
     # 公開 API
@@ -146,23 +819,47 @@ class GeminiClient:
         messages: List[Dict[str, str]],
         user_message: str,
         requested_model: str = "",
+        cache_prefix: str = "",
+        call_type: str = "",
     ) -> Tuple[str, str]:
         """
         returns (reply_text, used_model)
+        cache_prefix: user_message の前に付く大きな共通部分（指示 + 資料）。
+                      GEMINI_CONTEXT_CACHE=true なら cachedContents 経由で送る。
+        call_type: ルーターに渡す呼び出し種別（空なら呼び出し元タグ）。
+                   requested_model が空のときだけルーターがモデルと出力上限を選ぶ。
         """
-        candidates = []
-        req = _norm(requested_model)
-        if req:
-            candidates.append(req)
-        candidates.extend([self.primary_model, self.fallback_model])
+        call_type = call_type or current_caller()
+        prompt_tokens = estimate_contents_tokens(messages) + estimate_tokens(cache_prefix + user_message)
+        requested_model, config = route_request(call_type, requested_model, user_message, prompt_tokens)
+        return self._chat_routed(messages, user_message, requested_model, cache_prefix, call_type, config)
+
+    def _chat_routed(
+        self,
+        messages: List[Dict[str, str]],
+        user_message: str,
+        requested_model: str,
+        cache_prefix: str,
+        call_type: str,
+        config: Optional[Dict[str, Any]],
+    ) -> Tuple[str, str]:
+        """ルーティング済みのモデルと generationConfig で chat を実行する"""
+        if hedge_enabled():
+            return self._chat_hedged(messages, user_message, requested_model, cache_prefix, call_type, config)
 
         last_err: Optional[Exception] = None
-        for m in candidates:
+        tried: List[str] = []
+        candidates = self._candidate_models(requested_model)
+        for i, m in enumerate(candidates):
+            if not self._admit(m, force=not tried and i == len(candidates) - 1):
+                continue
+            tried.append(m)
             try:
                 logger.info(f"Trying Gemini model: {m}")
-                out = self._chat_once(m, messages, user_message)
+                out = timed_call(m, self._chat_once, m, messages, user_message, cache_prefix, config)
                 if out:
                     logger.info(f"Success with model: {m}")
+                    record_call_path(call_type, tried, "ok", m)
                     return out, m
             except GeminiFallbackError as e:
                 logger.error(f"Gemini error on {m}: {e}")
@@ -173,79 +870,257 @@ class GeminiClient:
                 last_err = e
                 continue
 
-        error_msg = str(last_err) if last_err else "all candidates failed"
-        if "timeout" in error_msg.lower() or "deadline" in error_msg.lower():
-            raise GeminiFallbackError("Gemini APIがタイムアウトしました。しばらく待ってから再試行してください。")
-        raise GeminiFallbackError(f"Gemini APIエラー: {error_msg}")
+        record_call_path(call_type, tried, "failed")
+        raise final_fallback_error(last_err)
 
-    def analyze_conversation(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+    def _chat_hedged(
+        self,
+        messages: List[Dict[str, str]],
+        user_message: str,
+        requested_model: str = "",
+        cache_prefix: str = "",
+        call_type: str = "",
+        generation_config: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[str, str]:
+        """
+        ヘッジ付き chat。
+        先頭モデルが hedge_delay() 以内に応答しなければ次のモデルを並行発射し、
+        最初に得られた正常応答を採用する。負けた側は未開始ならキャンセル、実行中なら結果を捨てる。
+        エラーで終わったモデルがあれば待たずに次のモデルを発射する。
+        """
+        candidates: List[str] = []
+        for m in self._candidate_models(requested_model):
+            if m not in candidates:
+                candidates.append(m)
+
+        max_parallel = max(1, int(os.getenv("GEMINI_HEDGE_MAX_PARALLEL", "2")))
+        executor = hedge_executor()
+        pending: Dict[Future, str] = {}
+        next_idx = 0
+        hedged = False
+        last_err: Optional[Exception] = None
+
+        def _launch() -> None:
+            nonlocal next_idx
+            m = candidates[next_idx]
+            next_idx += 1
+            logger.info(f"Trying Gemini model (hedged): {m}")
+            # 優先度などの contextvars をワーカースレッドへ引き継ぐ
+            ctx = contextvars.copy_context()
+            pending[executor.submit(
+                ctx.run, self._hedged_attempt, m, next_idx == len(candidates),
+                messages, user_message, cache_prefix, generation_config,
+            )] = m
+
+        _launch()
+        while pending:
+            can_hedge = next_idx < len(candidates) and len(pending) < max_parallel
+            timeout = hedge_delay(candidates[0]) if can_hedge else None
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                # 待ち時間切れ → 次のモデルを並行発射
+                logger.warning(
+                    f"[Gemini Hedge] no reply within {timeout:.1f}s; firing {candidates[next_idx]}"
+                )
+                hedged = True
+                _launch()
+                continue
+
+            for fut in done:
+                m = pending.pop(fut)
+                try:
+                    out = fut.result()
+                except Exception as e:
+                    logger.error(f"Gemini error on {m}: {e}")
+                    last_err = e
+                    continue
+                if out:
+                    for loser in pending:
+                        loser.cancel()
+                    latency_tracker.record_win(m, hedged)
+                    logger.info(f"Success with model: {m} (hedged={hedged})")
+                    record_call_path(call_type, candidates[:next_idx], "ok_hedged" if hedged else "ok", m)
+                    return out, m
+
+            # 失敗したぶん、未発射のモデルを補充
+            while next_idx < len(candidates) and len(pending) < max_parallel:
+                _launch()
+
+        record_call_path(call_type, candidates[:next_idx], "failed")
+        raise final_fallback_error(last_err)
+
+    def generate_json(
+        self,
+        prompt: str,
+        schema: Dict[str, Any],
+        requested_model: str = "",
+        max_output_tokens: int = 1024,
+        method: str = "",
+        use_cache: bool = True,
+        messages: Optional[List[Dict[str, str]]] = None,
+        call_type: str = "",
+        temperature: float = 0.2,
+    ) -> Tuple[Any, str]:
+        """
+        JSON モードで生成し、スキーマ検証済みの値を返す。returns (value, used_model)
+        スキーマ違反・パース失敗は次の候補モデルへフォールバックする。
+        method を渡すと応答キャッシュ（response_cache_ttl(method)）を使う。
+        messages: prompt の前に送る会話履歴
+        requested_model が空ならルーターがモデルを選ぶ（出力上限は小さい方を採用）。
+        """
+        call_type = call_type or method or current_caller()
+        contents = build_chat_contents(messages or [], prompt)
+        requested_model, routed = route_request(call_type, requested_model, prompt, estimate_contents_tokens(contents))
+        if routed:
+            max_output_tokens = min(max_output_tokens, routed["maxOutputTokens"])
+        config = json_generation_config(schema, max_output_tokens, temperature)
+
+        ttl = response_cache_ttl(method) if method else 0
+        key = None
+        if use_cache and ttl > 0 and response_cache_enabled():
+            key = response_cache_key(_norm(requested_model) or self.primary_model, contents, config)
+            hit = response_cache.get(key)
+            if hit:
+                logger.info(f"[Gemini Cache] hit method={method} model={hit.get('model')}")
+                return hit["value"], hit["model"]
+
+        last_err: Optional[Exception] = None
+        tried: List[str] = []
+        candidates = self._candidate_models(requested_model)
+        for i, m in enumerate(candidates):
+            if not self._admit(m, force=not tried and i == len(candidates) - 1):
+                continue
+            tried.append(m)
+            try:
+                logger.info(f"Trying Gemini model (json): {m}")
+                text = timed_call(m, self._run_generate, m, contents, None, config)
+                value = parse_json_response(text, schema, m)
+            except GeminiFallbackError as e:
+                logger.error(f"Gemini error on {m}: {e}")
+                last_err = e
+                continue
+            except Exception as e:
+                logger.error(f"Gemini unexpected error on {m}: {e}")
+                last_err = e
+                continue
+            record_call_path(call_type, tried, "ok", m)
+            if key:
+                response_cache.set(key, {"value": value, "model": m}, ttl)
+            return value, m
+
+        record_call_path(call_type, tried, "failed")
+        raise final_fallback_error(last_err)
+
+    def chat_with_summary(
+        self,
+        messages: List[Dict[str, str]],
+        user_message: str,
+        current_summary: str = "",
+        requested_model: str = "",
+    ) -> Tuple[str, str, str]:
+        """
+        返信と会話要約を1回の構造化呼び出しで生成する（要約のための再送を省く）。
+        returns (reply_text, summary, used_model)
+        通常の chat と同じ経路（ルーティング1回・ヘッジ・temperature）で送り、応答だけ JSON で受ける。
+        スキーマ違反は invalid_json の GeminiFallbackError（呼び出し元は通常の chat に切り替える）。
+        """
+        # 複雑度は出力形式の指示ではなくユーザーの発話で判定する
+        prompt_tokens = estimate_contents_tokens(messages) + estimate_tokens(user_message)
+        requested_model, routed = route_request("chat", requested_model, user_message, prompt_tokens)
+        config = json_generation_config(
+            CHAT_WITH_SUMMARY_SCHEMA, (routed or {}).get("maxOutputTokens", 4096), CHAT_TEMPERATURE
+        )
+        text, used = self._chat_routed(
+            messages,
+            build_chat_with_summary_prompt(user_message, current_summary),
+            requested_model,
+            "",
+            "chat",
+            config,
+        )
+        data = parse_json_response(text, CHAT_WITH_SUMMARY_SCHEMA, used)
+        return data["reply"].strip(), clean_summary_text(data["summary"]), used
+
+    def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        user_message: str,
+        requested_model: str = "",
+    ) -> Iterator[Tuple[str, str]]:
+        """
+        chat のストリーミング版。(text_chunk, used_model) を順に返す。
+        最初の断片が届く前の失敗は次の候補モデルへフォールバックし、
+        出力途中の失敗はそのまま GeminiFallbackError を送出する。
+        """
+        contents = build_chat_contents(messages, user_message)
+        requested_model, config = route_request(
+            "chat", requested_model, user_message, estimate_contents_tokens(contents)
+        )
+        last_err: Optional[Exception] = None
+        tried: List[str] = []
+        candidates = self._candidate_models(requested_model)
+        for i, m in enumerate(candidates):
+            if not self._admit(m, force=not tried and i == len(candidates) - 1):
+                continue
+            tried.append(m)
+            started = False
+            try:
+                logger.info(f"Trying Gemini model (stream): {m}")
+                for text in self._run_generate_stream(m, contents, config):
+                    started = True
+                    yield text, m
+                if started:
+                    logger.info(f"Stream completed with model: {m}")
+                    record_call_path("chat", tried, "ok", m)
+                    return
+                logger.warning(f"Empty stream from model: {m}")
+            except GeminiFallbackError as e:
+                if started:
+                    record_call_path("chat", tried, "interrupted")
+                    raise
+                logger.error(f"Gemini stream error on {m}: {e}")
+                last_err = e
+                continue
+            except Exception as e:
+                if started:
+                    record_call_path("chat", tried, "interrupted")
+                    raise GeminiFallbackError(f"Stream interrupted: {e}") from e
+                logger.error(f"Gemini unexpected stream error on {m}: {e}")
+                last_err = e
+                continue
+
+        record_call_path("chat", tried, "failed")
+        raise final_fallback_error(last_err)
+
+    def analyze_conversation(self, messages: List[Dict[str, str]], use_cache: bool = True) -> Dict[str, Any]:
         """
         会話の要約（同期版）
         """
-        # プロンプトをより詳細化
-        prompt = (
-            "## 指示\n"
-            "以下の会話履歴に基づき、この会話の主題を要約してください。\n\n"
-            "## 制約条件\n"
-            "- 要約は、会話の主題がすぐに分かるように、20文字程度の簡潔な日本語のテキストにしてください。\n"
-            "- この要約は、チャットアプリのサイドバーに表示されるタイトルとして使用されます。\n"
-            "- 出力には、要約のテキストのみを含めてください。接頭辞（例: 「要約:」）やMarkdownは不要です。\n"
-            "- 会話の冒頭部分を参考に、主要なトピックを抽出してください。\n\n"
-            "## 会話履歴\n"
+        prompt = build_analyze_prompt(messages)
+
+        # JSON モードで要約を生成（同一履歴ならキャッシュを返す）
+        data, used = self.generate_json(
+            prompt, ANALYZE_SCHEMA, method="analyze_conversation", use_cache=use_cache
         )
-        
-        # 会話履歴をプロンプトに追加
-        history_text = []
-        for m in messages:
-            role = "User" if m["role"] == "user" else "Assistant"
-            history_text.append(f"{role}: {m['content']}")
-        
-        prompt += "\n".join(history_text)
-        prompt += "\n\n## 要約"
-
-        # self.chatを使用して要約を生成
-        text, used = self.chat([], prompt, requested_model=self.primary_model)
-        
-        # 不要な部分を削除
-        summary_text = text.strip().replace("要約:", "").replace("タイトル:", "").strip()
-
-        return {"summary": summary_text, "model": used}
+
+        return {"summary": clean_summary_text(data["summary"]), "model": used}
 
     def summarize_with_citations(
         self,
         query: str,
         search_results: List[Dict[str, str]],
         requested_model: str = "",
+        use_cache: bool = True,
     ) -> Dict[str, Any]:
         """
         検索結果を踏まえた要約
         """
-        lines = [f"ユーザーの要望: {query}", "\n参考資料:"]
-        for i, r in enumerate(search_results, 1):
-            title = r.get("title", "")
-            url = r.get("url", "")
-            snip = r.get("snippet", "")
-            lines.append(f"[{i}] {title}\nURL: {url}\n内容: {snip}\n")
-
-        lines.append(
-            "\n**指示:**\n"
-            "上記の参考資料を徹底的に分析し、ユーザーの要望に答えてください。\n\n"
-            "**分析手順:**\n"
-            "1. すべての参考資料を注意深く読み、関連する情報を抽出する\n"
-            "2. 複数の情報源で一致する内容を重視し、信頼性を確保する\n"
-            "3. 情報源の信頼性を評価（公式サイト、書評サイト、専門家の意見などを優先）\n"
-            "4. 矛盾する情報がある場合は、より詳細で信頼できる情報源を採用する\n"
-            "5. 検索結果に含まれる情報から、ユーザーの要望に最も関連する内容を抽出する\n"
-            "6. 情報を統合し、包括的で分かりやすい回答を作成する\n\n"
-            "**回答の形式:**\n"
-            "- できる限り具体的に説明してください\n"
-            "- 箇条書きや段落を適切に使い、読みやすく構成してください\n"
-            "- 検索結果から得られた情報を最大限活用してください\n"
-            "- 最後に、参考にした主要な情報源のURLを列挙してください"
-        )
-        prompt = "\n".join(lines)
+        prefix, prompt = build_citations_prompt_parts(query, search_results)
 
-        text, used = self.chat([], prompt, requested_model=requested_model or self.primary_model)
+        text, used = self._cached_chat(
+            "summarize_with_citations", prompt, requested_model, use_cache, prefix
+        )
         return {"answer": text, "model": used}
 
     def summarize_with_citations_enriched(
@@ -253,56 +1128,18 @@ class GeminiClient:
         query: str,
         search_results: List[Dict[str, str]],
         requested_model: str = "",
+        use_cache: bool = True,
     ) -> Dict[str, Any]:
         """
         検索結果を踏まえた要約（enriched_content 対応版）
         - enriched_content があればスニペットより優先
         - 「情報不足」の早期宣言を避け、合理的な推測も含めてまとめる
         """
-        lines: List[str] = [f"ユーザーの要望: {query}", ""]
-
-        # ユーザー提供資料を優先表示
-        user_entries: List[str] = []
-        other_entries: List[str] = []
-        for i, r in enumerate(search_results, 1):
-            title = r.get("title", "")
-            url = r.get("url") or r.get("link") or r.get("info_link") or ""
-            snip = r.get("snippet", "")
-            enriched = r.get("enriched_content", "")
-            is_user = (r.get("source") == "user") or (url.startswith("user:"))
-
-            if enriched:
-                entry = f"[{i}] {title}\nURL: {url}\n詳細情報: {enriched}\n"
-            elif snip:
-                entry = f"[{i}] {title}\nURL: {url}\n要旨: {snip}\n"
-            else:
-                entry = f"[{i}] {title}\nURL: {url}\n（要約情報なし）\n"
-
-            if is_user:
-                user_entries.append(entry)
-            else:
-                other_entries.append(entry)
-
-        if user_entries:
-            lines.append("ユーザー提供資料（優先）:")
-            lines.extend(user_entries)
-            lines.append("")
+        prefix, prompt = build_enriched_prompt_parts(query, search_results)
 
-        lines.append("参照資料:")
-        lines.extend(other_entries)
-
-        lines.append("")
-        lines.append("---")
-        lines.append("")
-        lines.append("指示:")
-        lines.append("- 上記の資料を総合して、日本語で簡潔かつ具体的に要約してください。")
-        lines.append("- 直接的な記述が不足している箇所は、資料全体の傾向や整合から合理的に推測し、空白を埋めてください。")
-        lines.append("- 断片的な情報しかない場合でも、有用性を重視して最も妥当な全体像を提示してください。")
-        lines.append("- 最後に参考URLを列挙してください。")
-
-        prompt = "\n".join(lines)
-
-        text, used = self.chat([], prompt, requested_model=requested_model or self.primary_model)
+        text, used = self._cached_chat(
+            "summarize_with_citations_enriched", prompt, requested_model, use_cache, prefix
+        )
         return {"answer": text, "model": used}
 
     def summarize_book_with_toc(
@@ -312,110 +1149,13 @@ class GeminiClient:
         search_results: List[Dict[str, str]],
         requested_model: str = "",
         use_webfetch: bool = True,
+        use_cache: bool = True,
     ) -> Dict[str, Any]:
         """
         書籍専用要約。目次構造を尊重し、信頼できる出版社・書評サイトを優先。
         """
-        try:
-            from app.constants import TRUSTED_BOOK_SOURCES_DOMAINS, USE_TRUSTED_DOMAINS
-            trusted_domains = TRUSTED_BOOK_SOURCES_DOMAINS if USE_TRUSTED_DOMAINS else []
-        except Exception:
-            trusted_domains = [
-                "amazon.co.jp",
-                "books.rakuten.co.jp",
-                "hanmoto.com",
-                "bookmeter.com",
-                "booklog.jp",
-                "honz.jp",
-            ]
-
-        lines: List[str] = []
-        lines.append(f"対象書籍: {book_title}")
-        lines.append("")
-        lines.append("提供された目次:")
-        lines.append(table_of_contents.strip() or "（目次情報なし）")
-        lines.append("")
-        # ユーザー提供の章ヒント、資料を優先提示
-        user_hint_entries: List[str] = []
-        user_entries: List[str] = []
-        other_entries: List[str] = []
-
-        for i, r in enumerate(search_results, 1):
-            title = r.get("title", "")
-            url = r.get("url") or r.get("link") or r.get("info_link") or ""
-            snip = r.get("snippet", "")
-            enriched = r.get("enriched_content", "")
-            is_user = (r.get("source") == "user") or (url.startswith("user:"))
-            chapter_hint = (r.get("chapter") or "").strip()
-
-            if enriched:
-                entry = f"[{i}] {title}\nURL: {url}\n詳細情報: {enriched}\n"
-            elif snip:
-                entry = f"[{i}] {title}\nURL: {url}\n要旨: {snip}\n"
-            else:
-                entry = f"[{i}] {title}\nURL: {url}\n（詳細情報なし）\n"
-
-            if is_user and chapter_hint:
-                user_hint_entries.append(f"- 章: {chapter_hint}\n  ヒント: {enriched or snip}")
-                user_entries.append(entry)
-            elif is_user:
-                user_entries.append(entry)
-            else:
-                # 信頼ドメイン優先の並べ替え用に分類
-                if any(d in (url or "") for d in trusted_domains):
-                    other_entries.append("__TRUSTED__\n" + entry)
-                else:
-                    other_entries.append(entry)
-
-        if user_hint_entries:
-            lines.append("ユーザー提供：章ヒント（優先）")
-            lines.extend(user_hint_entries)
-            lines.append("")
-
-        if user_entries:
-            lines.append("ユーザー提供資料（優先）:")
-            lines.extend(user_entries)
-            lines.append("")
-
-        lines.append("参照資料:")
-
-        # 信頼ドメイン（__TRUSTED__マーク）を優先表示
-        for e in other_entries:
-            if e.startswith("__TRUSTED__\n"):
-                lines.append(e.replace("__TRUSTED__\n", ""))
-        for e in other_entries:
-            if not e.startswith("__TRUSTED__\n"):
-                lines.append(e)
-
-        lines.append("")
-        lines.append("---")
-        lines.append("")
-        lines.append("重要な指示:")
-        lines.append("1. 参照資料から書籍の主題・対象読者・著者の意図を把握してください。")
-        lines.append("2. 目次の章立てに沿って、各章の要点を日本語でまとめてください。")
-        lines.append("3. 直接的な記述がない章は、章タイトル・書籍の全体テーマ・著者の傾向から合理的に推測して要約してください。")
-        lines.append("4. 有用性を重視し、可能な範囲で具体例やキーワードも含めてください。")
-        lines.append("5. 参照先の信頼性を意識し、公式・大手書店・書評サイトの情報を優先してください。")
-        lines.append("6. 最後に参考URLを列挙してください。")
-
-        lines.append("")
-        lines.append("出力フォーマット例:")
-        lines.append("```")
-        lines.append("## 書籍名")
-        lines.append("")
-        lines.append("### 序章/第1章: [章タイトル]")
-        lines.append("[この章の要約]")
-        lines.append("")
-        lines.append("### 第2章: [章タイトル]")
-        lines.append("[この章の要約]")
-        lines.append("")
-        lines.append("...")
-        lines.append("")
-        lines.append("## 参考URL")
-        lines.append("- [URL1]")
-        lines.append("- [URL2]")
-        lines.append("```")
-
-        prompt = "\n".join(lines)
-        text, used = self.chat([], prompt, requested_model=requested_model or self.primary_model)
+        prefix, prompt = build_book_toc_prompt_parts(book_title, table_of_contents, search_results)
+        text, used = self._cached_chat(
+            "summarize_book_with_toc", prompt, requested_model, use_cache, prefix
+        )
         return {"answer": text, "model": used}
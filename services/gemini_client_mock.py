@@ -1,11 +1,26 @@
 # services/gemini_client_mock.py
 # 一時的なモッククライアント（開発・テスト用）
 import time
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Iterator, Tuple
 
 class GeminiFallbackError(Exception):
     pass
 
+
+def mock_json_value(schema: Dict[str, Any], label: str = "モック") -> Any:
+    """responseSchema を満たすダミー値（JSON モードのモック用）"""
+    type_name = str(schema.get("type", "")).upper()
+    if type_name == "ARRAY":
+        n = max(int(schema.get("minItems", 1)), 1)
+        return [mock_json_value(schema.get("items") or {"type": "STRING"}, f"{label} {i + 1}") for i in range(n)]
+    if type_name == "OBJECT":
+        return {k: mock_json_value(v, f"{label} {k}") for k, v in (schema.get("properties") or {}).items()}
+    if type_name in ("INTEGER", "NUMBER"):
+        return 0
+    if type_name == "BOOLEAN":
+        return False
+    return label
+
 class GeminiClient:
     def __init__(self, primary_model: str, fallback_model: str, api_key: str = None, api_version: str = None):
         self.primary_model = primary_model
@@ -14,7 +29,7 @@ class GeminiClient:
         self.api_version = api_version or "v1"
         print(f"[MOCK] GeminiClient initialized with {primary_model}")
 
-    def chat(self, messages: List[Dict[str, str]], user_message: str, requested_model: str = "") -> Tuple[str, str]:
+    def chat(self, messages: List[Dict[str, str]], user_message: str, requested_model: str = "", cache_prefix: str = "", call_type: str = "") -> Tuple[str, str]:
         """モックレスポンスを返す"""
         time.sleep(0.5)  # 遅延をシミュレート
 
@@ -28,7 +43,7 @@ class GeminiClient:
 
         return reply, self.primary_model
 
-    def analyze_conversation(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+    def analyze_conversation(self, messages: List[Dict[str, str]], use_cache: bool = True) -> Dict[str, Any]:
         """会話分析のモック"""
         time.sleep(0.3)
         return {
@@ -36,6 +51,16 @@ class GeminiClient:
             "model": self.primary_model
         }
 
+    def generate_json(self, prompt: str, schema: Dict[str, Any], requested_model: str = "", max_output_tokens: int = 1024, method: str = "", use_cache: bool = True, messages: List[Dict[str, str]] = None, call_type: str = "", temperature: float = 0.2) -> Tuple[Any, str]:
+        """JSON モードのモック（スキーマどおりのダミー値）"""
+        time.sleep(0.3)
+        return mock_json_value(schema), self.primary_model
+
+    def chat_with_summary(self, messages: List[Dict[str, str]], user_message: str, current_summary: str = "", requested_model: str = "") -> Tuple[str, str, str]:
+        """返信 + 会話要約のモック"""
+        reply, model = self.chat(messages, user_message, requested_model)
+        return reply, current_summary or "モック要約", model
+
     def summarize_with_citations(self, query: str, search_results: List[Dict[str, str]], requested_model: str = "") -> Dict[str, Any]:
         """検索結果要約のモック"""
         time.sleep(0.5)
@@ -43,3 +68,10 @@ class GeminiClient:
             "answer": "モックレスポンス: 検索機能は現在利用できません。Gemini APIへの接続を確認してください。",
             "model": self.primary_model
         }
+
+    def chat_stream(self, messages: List[Dict[str, str]], user_message: str, requested_model: str = "") -> Iterator[Tuple[str, str]]:
+        """ストリーミングのモック（応答を数文字ずつ返す）"""
+        reply, model = self.chat(messages, user_message, requested_model)
+        for i in range(0, len(reply), 8):
+            time.sleep(0.05)
+            yield reply[i:i + 8], model
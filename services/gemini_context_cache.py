@@ -0,0 +1,181 @@
+# services/gemini_context_cache.py
+"""
+Gemini の明示的コンテキストキャッシュ（cachedContents）の管理
+
+- 大きく変化の少ないプロンプト前半（指示 + 資料）を cachedContents として登録し、
+  以降の generateContent では cachedContent 名を参照して後半だけを送る
+- 登録済みキャッシュ名は (モデル, 前半テキストの sha256) をキーに TieredCache へ保存
+  （REDIS_URL があれば全ワーカーで共有）
+- 残り TTL が短くなったら PATCH で延長、不要になったら DELETE
+- 前半が最小トークン数に満たない場合はキャッシュしない（API 側の下限）
+
+環境変数:
+    GEMINI_CONTEXT_CACHE             true/false（既定 false）
+    GEMINI_CONTEXT_CACHE_TTL_SEC     既定 600
+    GEMINI_CONTEXT_CACHE_MIN_TOKENS  既定 4096（推定トークン）
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+import requests
+
+from services.tiered_cache import TieredCache
+from services.token_estimator import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def context_cache_enabled() -> bool:
+    return os.getenv("GEMINI_CONTEXT_CACHE", "false").lower() == "true"
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+_registry = TieredCache("gemini_context_cache", max_entries=256, max_bytes=1024 * 1024)
+_stats_lock = threading.Lock()
+_stats: Dict[str, int] = {
+    "created": 0,
+    "reused": 0,
+    "refreshed": 0,
+    "deleted": 0,
+    "invalidated": 0,
+    "failures": 0,
+    "cached_tokens": 0,
+}
+
+
+def _count(name: str, amount: int = 1) -> None:
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def record_cached_tokens(usage: Dict[str, Any]) -> None:
+    """generateContent の usageMetadata から cachedContentTokenCount を集計"""
+    n = int((usage or {}).get("cachedContentTokenCount") or 0)
+    if n:
+        _count("cached_tokens", n)
+
+
+def context_cache_stats() -> Dict[str, int]:
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _registry_key(model: str, prefix: str) -> str:
+    return hashlib.sha256(f"{model}\n{prefix}".encode("utf-8")).hexdigest()
+
+
+class ContextCacheManager:
+    """
+    GeminiClient の transport / base_url / api_key を使って cachedContents を操作する。
+    失敗時は None を返し、呼び出し側は通常の（キャッシュなし）送信に戻る。
+    """
+
+    def __init__(self, client: Any) -> None:
+        self.client = client
+
+    # ---------------- REST 操作 ----------------
+    def _url(self, path: str, query: str = "") -> str:
+        sep = "&" if query else ""
+        return f"{self.client.base_url}/{path}?{query}{sep}key={self.client.api_key}"
+
+    def create(self, model: str, prefix: str, ttl_sec: int) -> Optional[Dict[str, Any]]:
+        body = {
+            "model": f"models/{model}",
+            "contents": [{"role": "user", "parts": [{"text": prefix}]}],
+            "ttl": f"{int(ttl_sec)}s",
+        }
+        try:
+            r = self.client.transport.post(self._url("cachedContents"), json=body, timeout=60)
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"[Gemini CtxCache] create failed for {model}: {e}")
+            _count("failures")
+            return None
+        if r.status_code != 200:
+            logger.warning(f"[Gemini CtxCache] create HTTP {r.status_code} for {model}: {r.text[:200]}")
+            _count("failures")
+            return None
+        data = r.json()
+        _count("created")
+        logger.info(
+            f"[Gemini CtxCache] created {data.get('name')} model={model} "
+            f"tokens={(data.get('usageMetadata') or {}).get('totalTokenCount')}"
+        )
+        return data
+
+    def refresh(self, name: str, ttl_sec: int) -> bool:
+        try:
+            r = self.client.transport.request(
+                "PATCH", self._url(name, "updateMask=ttl"), json={"ttl": f"{int(ttl_sec)}s"}, timeout=30
+            )
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"[Gemini CtxCache] refresh failed for {name}: {e}")
+            return False
+        if r.status_code != 200:
+            logger.warning(f"[Gemini CtxCache] refresh HTTP {r.status_code} for {name}")
+            return False
+        _count("refreshed")
+        return True
+
+    def delete(self, name: str) -> bool:
+        try:
+            r = self.client.transport.request("DELETE", self._url(name), timeout=30)
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"[Gemini CtxCache] delete failed for {name}: {e}")
+            return False
+        if r.status_code not in (200, 404):
+            return False
+        _count("deleted")
+        return True
+
+    # ---------------- 高水準 API ----------------
+    def get_or_create(self, model: str, prefix: str) -> Optional[str]:
+        """
+        prefix に対応する cachedContents 名を返す（必要なら作成・TTL 延長）。
+        キャッシュ対象外・失敗時は None。
+        """
+        if not context_cache_enabled():
+            return None
+        if estimate_tokens(prefix) < _env_int("GEMINI_CONTEXT_CACHE_MIN_TOKENS", 4096):
+            return None
+
+        ttl = max(60, _env_int("GEMINI_CONTEXT_CACHE_TTL_SEC", 600))
+        key = _registry_key(model, prefix)
+        entry = _registry.get(key)
+        now = time.time()
+        if entry and entry.get("expires_at", 0) > now + 5:
+            # 残りが TTL の 1/3 を切ったら延長
+            if entry["expires_at"] - now < ttl / 3 and self.refresh(entry["name"], ttl):
+                entry = {"name": entry["name"], "expires_at": now + ttl}
+                _registry.set(key, entry, ttl)
+            _count("reused")
+            return entry["name"]
+
+        data = self.create(model, prefix, ttl)
+        if not data or not data.get("name"):
+            return None
+        # 期限ぎりぎりで参照しないよう、登録簿側は少し短めに持つ
+        _registry.set(key, {"name": data["name"], "expires_at": now + ttl}, max(1, ttl - 10))
+        return data["name"]
+
+    def invalidate(self, model: str, prefix: str) -> None:
+        """サーバ側で期限切れ・削除済みだった場合に登録簿から外す"""
+        _registry.delete(_registry_key(model, prefix))
+        _count("invalidated")
+
+    def release(self, model: str, prefix: str) -> None:
+        """使い終わったキャッシュを明示的に削除する（TTL 前に課金を止めたい場合）"""
+        key = _registry_key(model, prefix)
+        entry = _registry.get(key)
+        if entry:
+            self.delete(entry["name"])
+        _registry.delete(key)
@@ -0,0 +1,139 @@
+# services/gemini_hedge.py
+"""
+Gemini 呼び出しのヘッジ（hedged request）用の補助
+
+- モデルごとの直近レイテンシを保持し、パーセンタイルからヘッジ待ち時間を決める
+- どのモデルが勝ったか（先に正常応答を返したか）を記録する
+- ヘッジ用スレッドプールはプロセスごとに遅延生成（fork 後は作り直す）
+
+GEMINI_HEDGE=true で有効化。未有効時は従来どおり逐次フォールバック。
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def hedge_enabled() -> bool:
+    return os.getenv("GEMINI_HEDGE", "false").lower() == "true"
+
+
+class LatencyTracker:
+    """
+    モデル別の成功レイテンシ（秒）をリングバッファで保持する。
+    負けた側のリクエストも完了すれば記録する（勝者だけを記録すると分布が偏るため）。
+    """
+
+    def __init__(self, window: int = 200) -> None:
+        self.window = max(10, int(window))
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[float]] = {}
+        self._wins: Dict[str, int] = {}
+        self._hedges_fired = 0
+        self._hedged_calls = 0
+
+    def record(self, model: str, seconds: float) -> None:
+        with self._lock:
+            buf = self._samples.get(model)
+            if buf is None:
+                buf = deque(maxlen=self.window)
+                self._samples[model] = buf
+            buf.append(seconds)
+
+    def record_win(self, model: str, hedged: bool) -> None:
+        with self._lock:
+            self._wins[model] = self._wins.get(model, 0) + 1
+            self._hedged_calls += 1
+            if hedged:
+                self._hedges_fired += 1
+
+    def percentile(self, model: str, pct: float) -> Optional[float]:
+        with self._lock:
+            buf = self._samples.get(model)
+            if not buf:
+                return None
+            data = sorted(buf)
+        idx = min(len(data) - 1, max(0, int(round(pct / 100.0 * (len(data) - 1)))))
+        return data[idx]
+
+    def sample_count(self, model: str) -> int:
+        with self._lock:
+            buf = self._samples.get(model)
+            return len(buf) if buf else 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            models = list(self._samples.keys())
+            out: Dict[str, Any] = {
+                "hedged_calls": self._hedged_calls,
+                "hedges_fired": self._hedges_fired,
+                "wins": dict(self._wins),
+            }
+        out["p50"] = {m: self.percentile(m, 50) for m in models}
+        out["p95"] = {m: self.percentile(m, 95) for m in models}
+        return out
+
+
+latency_tracker = LatencyTracker(window=int(_env_float("GEMINI_HEDGE_WINDOW", 200)))
+
+
+def hedge_delay(model: str) -> float:
+    """
+    ヘッジ発射までの待ち時間（秒）
+    - サンプルが少ないうちは GEMINI_HEDGE_DELAY_SEC（既定 8 秒）
+    - 以降は GEMINI_HEDGE_PERCENTILE（既定 p95）を MIN/MAX でクランプ
+    """
+    default = _env_float("GEMINI_HEDGE_DELAY_SEC", 8.0)
+    min_delay = _env_float("GEMINI_HEDGE_MIN_DELAY_SEC", 1.0)
+    max_delay = _env_float("GEMINI_HEDGE_MAX_DELAY_SEC", 30.0)
+    min_samples = int(_env_float("GEMINI_HEDGE_MIN_SAMPLES", 20))
+
+    if latency_tracker.sample_count(model) < min_samples:
+        return default
+    p = latency_tracker.percentile(model, _env_float("GEMINI_HEDGE_PERCENTILE", 95.0))
+    if p is None:
+        return default
+    return max(min_delay, min(max_delay, p))
+
+
+# -------------------------------
+# ヘッジ用スレッドプール（プロセスごと）
+# -------------------------------
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_pid: Optional[int] = None
+_executor_lock = threading.Lock()
+
+
+def hedge_executor() -> ThreadPoolExecutor:
+    global _executor, _executor_pid
+    if _executor is not None and _executor_pid == os.getpid():
+        return _executor
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=int(_env_float("GEMINI_HEDGE_WORKERS", 8)),
+                thread_name_prefix="gemini-hedge",
+            )
+            _executor_pid = os.getpid()
+    return _executor
+
+
+def timed_call(model: str, fn: Any, *args: Any) -> Any:
+    """fn(*args) を実行し、正常終了したらレイテンシを記録する"""
+    started = time.monotonic()
+    out = fn(*args)
+    if out:
+        latency_tracker.record(model, time.monotonic() - started)
+    return out
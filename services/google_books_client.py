@@ -4,15 +4,18 @@ import requests
 import logging
 from typing import List, Dict, Any, Optional
 
+from services.http_pool import http_timeout, search_transport
+
 logger = logging.getLogger(__name__)
 
 class GoogleBooksClient:
-    def __init__(self, api_key: Optional[str] = None, timeout: int = 10):
+    def __init__(self, api_key: Optional[str] = None, timeout: int = 10, retries: int = 2):
         self.api_key = api_key or os.environ.get("GOOGLE_API_KEY")
         if not self.api_key:
             raise ValueError("Google Books API key is required.")
         self.base_url = "https://www.googleapis.com/books/v1/volumes"
         self.timeout = timeout
+        self.retries = retries
 
     def search_books(self, query: str, max_results: int = 10) -> List[Dict[str, Any]]:
         params = {
@@ -22,7 +25,9 @@ class GoogleBooksClient:
             "langRestrict": "ja",
         }
         try:
-            response = requests.get(self.base_url, params=params, timeout=self.timeout)
+            response = search_transport("google_books").get_with_retry(
+                self.base_url, retries=self.retries, params=params, timeout=http_timeout(self.timeout)
+            )
             response.raise_for_status()
             data = response.json()
             return self._normalize_results(data.get("items", []))
@@ -45,5 +50,12 @@ class GoogleBooksClient:
                 "thumbnail": volume_info.get("imageLinks", {}).get("thumbnail"),
                 "info_link": volume_info.get("infoLink"),
                 "url": volume_info.get("infoLink"),  # URLフィールドとしても利用できるようにする
+                "isbn": self._isbn(volume_info.get("industryIdentifiers", [])),
             })
         return normalized
+
+    @staticmethod
+    def _isbn(identifiers: List[Dict[str, Any]]) -> Optional[str]:
+        """ISBN_13 を優先し、なければ ISBN_10"""
+        by_type = {i.get("type"): i.get("identifier") for i in identifiers or []}
+        return by_type.get("ISBN_13") or by_type.get("ISBN_10")
@@ -0,0 +1,441 @@
+# services/http_pool.py
+"""
+プロセス単位で共有する HTTP コネクションプール
+
+- keep-alive セッションを使い回し、呼び出しごとの DNS/TCP/TLS ハンドシェイクを避ける
+- プールサイズは gunicorn / RQ のプロセスごとに環境変数で調整
+- fork 後の子プロセスでは親のソケットを共有せず、セッションを作り直す
+- httpx[http2] がインストールされていれば HTTP/2 多重化を任意で利用
+- 起動時の事前接続（preconnect）とプール再利用/新規接続のカウンタ
+- 検索プロバイダ（CSE / SerpAPI / Google Books / NDL）と WebFetch 用のプールも同じ仕組みで持つ
+"""
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+try:  # HTTP/2 は任意依存（httpx[http2]）
+    import httpx
+except ImportError:  # pragma: no cover - 未インストール環境
+    httpx = None
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    v = os.getenv(name)
+    if v is None:
+        return default
+    return v.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Gemini 用プールの既定値
+GEMINI_POOL_NAME = "gemini"
+GEMINI_API_HOST = "https://generativelanguage.googleapis.com"
+
+
+def gemini_api_host() -> str:
+    """GEMINI_API_BASE_URL で差し替え可能（ローカルのスタブサーバ等）"""
+    return (os.getenv("GEMINI_API_BASE_URL") or GEMINI_API_HOST).rstrip("/")
+
+
+class _CountingAdapter(HTTPAdapter):
+    """
+    urllib3 のホスト別プールが持つ num_requests / num_connections を集計する Adapter。
+    - hit  = 既存の keep-alive 接続で処理したリクエスト
+    - miss = 新規接続を張ったリクエスト
+    プールが LRU から追い出された場合も、その時点の値を退避して累計を保つ。
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        self._retired_requests = 0
+        self._retired_connections = 0
+        self._lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        pools = self.poolmanager.pools
+        original_dispose = pools.dispose_func
+
+        def _dispose(pool: Any) -> None:
+            with self._lock:
+                self._retired_requests += getattr(pool, "num_requests", 0)
+                self._retired_connections += getattr(pool, "num_connections", 0)
+            if original_dispose:
+                original_dispose(pool)
+
+        pools.dispose_func = _dispose
+
+    def counters(self) -> Dict[str, int]:
+        requests_total = self._retired_requests
+        connections_total = self._retired_connections
+        try:
+            live_pools = list(self.poolmanager.pools._container.values())
+        except Exception:
+            live_pools = []
+        for pool in live_pools:
+            requests_total += getattr(pool, "num_requests", 0)
+            connections_total += getattr(pool, "num_connections", 0)
+        return {
+            "requests": requests_total,
+            "connections_opened": connections_total,
+            "pool_hits": max(0, requests_total - connections_total),
+            "pool_misses": connections_total,
+        }
+
+
+class StreamResponse:
+    """
+    ストリーミング応答の薄いラッパー（requests / httpx の差異を吸収）
+    - status_code / headers
+    - iter_lines(): UTF-8 でデコードした行を返す
+    - iter_bytes(): 本文をバイト列のまま少しずつ返す（転送エンコーディングは解除済み）
+    - read_text(): 残りの本文を文字列で返す（エラー応答の読み取り用）
+    """
+
+    def __init__(self, raw: Any, is_httpx: bool) -> None:
+        self._raw = raw
+        self._is_httpx = is_httpx
+        self.status_code = raw.status_code
+        self.headers = raw.headers
+
+    def iter_bytes(self, chunk_size: int = 16384) -> Iterator[bytes]:
+        if self._is_httpx:
+            try:
+                for chunk in self._raw.iter_bytes(chunk_size):
+                    yield chunk
+            except httpx.TimeoutException as e:
+                raise requests.exceptions.Timeout(str(e)) from e
+            except httpx.HTTPError as e:
+                raise requests.exceptions.ConnectionError(str(e)) from e
+            return
+        for chunk in self._raw.iter_content(chunk_size=chunk_size):
+            yield chunk
+
+    def iter_lines(self) -> Iterator[str]:
+        if self._is_httpx:
+            try:
+                for line in self._raw.iter_lines():
+                    yield line
+            except httpx.TimeoutException as e:
+                raise requests.exceptions.Timeout(str(e)) from e
+            except httpx.HTTPError as e:
+                raise requests.exceptions.ConnectionError(str(e)) from e
+            return
+        for line in self._raw.iter_lines():
+            yield line.decode("utf-8", errors="replace") if isinstance(line, bytes) else line
+
+    def read_text(self) -> str:
+        if self._is_httpx:
+            self._raw.read()
+            return self._raw.text
+        return self._raw.text
+
+
+class PooledTransport:
+    """
+    名前付きの共有トランスポート。requests.Session（HTTP/1.1 keep-alive）か
+    httpx.Client（HTTP/2）を内部に持ち、PID が変わったら作り直す。
+    例外は requests.exceptions に揃えるため、呼び出し側は従来のハンドリングのままでよい。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        pool_maxsize: int = 10,
+        pool_connections: int = 4,
+        http2: bool = False,
+    ) -> None:
+        self.name = name
+        self.pool_maxsize = max(1, int(pool_maxsize))
+        self.pool_connections = max(1, int(pool_connections))
+        self.http2 = bool(http2 and httpx is not None)
+        if http2 and httpx is None:
+            logger.warning(f"[HTTP Pool:{name}] HTTP/2 requested but httpx is not installed; using HTTP/1.1")
+
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._session: Optional[requests.Session] = None
+        self._adapter: Optional[_CountingAdapter] = None
+        self._h2_client: Any = None
+        self._h2_requests = 0
+        self._rebuilds = 0
+        self._retries = 0
+
+    # ---------------- 内部 ----------------
+    def _build(self) -> None:
+        if self.http2:
+            try:
+                self._h2_client = httpx.Client(
+                    http2=True,
+                    limits=httpx.Limits(
+                        max_connections=self.pool_maxsize,
+                        max_keepalive_connections=self.pool_maxsize,
+                    ),
+                )
+                self._h2_requests = 0
+            except ImportError:
+                # http2=True だが h2 が未インストール（httpx[http2] ではなく httpx だけ入っている）
+                logger.warning(f"[HTTP Pool:{self.name}] HTTP/2 requested but h2 is not installed; using HTTP/1.1")
+                self.http2 = False
+        if not self.http2:
+            session = requests.Session()
+            adapter = _CountingAdapter(
+                pool_connections=self.pool_connections,
+                pool_maxsize=self.pool_maxsize,
+                pool_block=False,
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._session = session
+            self._adapter = adapter
+        self._pid = os.getpid()
+        self._rebuilds += 1
+        logger.info(
+            f"[HTTP Pool:{self.name}] created pid={self._pid} maxsize={self.pool_maxsize} "
+            f"http2={self.http2}"
+        )
+
+    def _ensure(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # fork 後: 親のソケットは閉じずに捨てる（親側の接続を壊さないため）
+            self._session = None
+            self._adapter = None
+            self._h2_client = None
+            self._build()
+
+    def reset(self) -> None:
+        """fork 直後の子プロセスで呼ばれる。次回利用時に作り直す。"""
+        self._pid = None
+
+    # ---------------- 公開 API ----------------
+    def request(self, method: str, url: str, **kwargs: Any) -> Any:
+        self._ensure()
+        if not self.http2:
+            return self._session.request(method, url, **kwargs)
+
+        self._h2_requests += 1
+        timeout = kwargs.pop("timeout", None)
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        try:
+            return self._h2_client.request(method, url, timeout=timeout, **kwargs)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e)) from e
+        except httpx.HTTPError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+
+    def post(self, url: str, **kwargs: Any) -> Any:
+        return self.request("POST", url, **kwargs)
+
+    @contextmanager
+    def stream(self, method: str, url: str, **kwargs: Any) -> Iterator[StreamResponse]:
+        """本文を逐次読み出すリクエスト。終了時に接続をプールへ返す。"""
+        self._ensure()
+        if not self.http2:
+            raw = self._session.request(method, url, stream=True, **kwargs)
+            try:
+                yield StreamResponse(raw, is_httpx=False)
+            finally:
+                raw.close()
+            return
+
+        self._h2_requests += 1
+        timeout = kwargs.pop("timeout", None)
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        try:
+            with self._h2_client.stream(method, url, timeout=timeout, **kwargs) as raw:
+                yield StreamResponse(raw, is_httpx=True)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e)) from e
+        except httpx.HTTPError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+
+    def get(self, url: str, **kwargs: Any) -> Any:
+        return self.request("GET", url, **kwargs)
+
+    def get_with_retry(self, url: str, retries: int = 2, **kwargs: Any) -> Any:
+        """
+        GET を指数バックオフ（0.6s, 1.2s, ...）で再試行する。
+        対象はタイムアウト・接続エラー・5xx。最後の 5xx 応答はそのまま返し、判定は呼び出し側に任せる。
+        """
+        for attempt in range(max(0, retries) + 1):
+            try:
+                r = self.request("GET", url, **kwargs)
+            except (requests.Timeout, requests.ConnectionError):
+                if attempt >= retries:
+                    raise
+            else:
+                if not (500 <= r.status_code < 600) or attempt >= retries:
+                    return r
+                r.close()
+            with self._lock:
+                self._retries += 1
+            time.sleep(backoff_delay(attempt))
+        raise requests.ConnectionError(f"[HTTP Pool:{self.name}] retries exhausted for {url}")  # pragma: no cover
+
+    def preconnect(self, url: str, count: int = 1, timeout: float = 5.0) -> None:
+        """
+        TLS 接続を事前に確立してプールに残す（応答ステータスは問わない）。
+        起動を遅らせないようバックグラウンドスレッドで実行する。
+        """
+        count = max(1, min(int(count), self.pool_maxsize))
+
+        def _warm() -> None:
+            try:
+                self.request("HEAD", url, timeout=timeout)
+                logger.info(f"[HTTP Pool:{self.name}] preconnected to {url}")
+            except Exception as e:
+                logger.warning(f"[HTTP Pool:{self.name}] preconnect failed for {url}: {e}")
+
+        for _ in range(count):
+            threading.Thread(target=_warm, name=f"preconnect-{self.name}", daemon=True).start()
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {
+            "name": self.name,
+            "pid": self._pid,
+            "http2": self.http2,
+            "pool_maxsize": self.pool_maxsize,
+            "rebuilds": self._rebuilds,
+            "retries": self._retries,
+        }
+        if self._pid != os.getpid():
+            out.update({"requests": 0, "connections_opened": 0, "pool_hits": 0, "pool_misses": 0})
+        elif self.http2:
+            out.update({"requests": self._h2_requests})
+        elif self._adapter is not None:
+            out.update(self._adapter.counters())
+        return out
+
+
+# -------------------------------
+# プロセス内レジストリ
+# -------------------------------
+_transports: Dict[str, PooledTransport] = {}
+_registry_lock = threading.Lock()
+
+
+def get_transport(
+    name: str,
+    pool_maxsize: int = 10,
+    pool_connections: int = 4,
+    http2: bool = False,
+) -> PooledTransport:
+    """名前付きトランスポートを取得（初回のみ引数の設定で生成）"""
+    t = _transports.get(name)
+    if t is not None:
+        return t
+    with _registry_lock:
+        t = _transports.get(name)
+        if t is None:
+            t = PooledTransport(name, pool_maxsize=pool_maxsize, pool_connections=pool_connections, http2=http2)
+            _transports[name] = t
+        return t
+
+
+def gemini_transport() -> PooledTransport:
+    """Gemini API 用の共有トランスポート"""
+    return get_transport(
+        GEMINI_POOL_NAME,
+        pool_maxsize=_env_int("GEMINI_HTTP_POOL_MAXSIZE", 10),
+        pool_connections=1,
+        http2=_env_bool("GEMINI_HTTP2", False),
+    )
+
+
+# -------------------------------
+# 検索プロバイダ / WebFetch
+# -------------------------------
+SEARCH_POOL_PREFIX = "search:"
+WEBFETCH_POOL_NAME = "webfetch"
+
+
+def backoff_delay(attempt: int) -> float:
+    """検索系の再試行間隔（0.6s, 1.2s, 2.4s, ...）"""
+    return 0.6 * (2 ** attempt)
+
+
+def http_timeout(read_timeout: float) -> Tuple[float, float]:
+    """
+    (connect, read) のタプル。接続確立は短く打ち切り、読み取りは呼び出し側の値を使う。
+    SEARCH_HTTP_CONNECT_TIMEOUT で接続側を調整（既定 3.05 秒）
+    """
+    try:
+        connect = float(os.getenv("SEARCH_HTTP_CONNECT_TIMEOUT", "3.05"))
+    except ValueError:
+        connect = 3.05
+    return (min(connect, float(read_timeout)), float(read_timeout))
+
+
+def search_transport(provider: str) -> PooledTransport:
+    """
+    検索プロバイダ（google_cse / serpapi / google_books / ndl）ごとの共有トランスポート。
+    接続先ホストは1つなので host プールは1つ、同時接続数は SEARCH_HTTP_POOL_MAXSIZE。
+    """
+    return get_transport(
+        SEARCH_POOL_PREFIX + provider,
+        pool_maxsize=_env_int("SEARCH_HTTP_POOL_MAXSIZE", 10),
+        pool_connections=1,
+    )
+
+
+def webfetch_transport() -> PooledTransport:
+    """
+    検索結果ページ取得（WebFetch）用。接続先ホストが多いので host プールを多めに保持し、
+    1ホストあたりの接続数は少なめにする。
+    """
+    return get_transport(
+        WEBFETCH_POOL_NAME,
+        pool_maxsize=_env_int("WEBFETCH_HTTP_POOL_MAXSIZE", 4),
+        pool_connections=_env_int("WEBFETCH_HTTP_POOL_HOSTS", 32),
+    )
+
+
+_preconnected_pid: Optional[int] = None
+
+
+def preconnect_gemini() -> None:
+    """起動時の事前接続（プロセスごとに1回。GEMINI_HTTP_PRECONNECT=false で無効化）"""
+    global _preconnected_pid
+    if not _env_bool("GEMINI_HTTP_PRECONNECT", True):
+        return
+    if _preconnected_pid == os.getpid():
+        return
+    _preconnected_pid = os.getpid()
+    gemini_transport().preconnect(
+        gemini_api_host(),
+        count=_env_int("GEMINI_HTTP_PRECONNECT_COUNT", 1),
+    )
+
+
+def pool_stats() -> Dict[str, Dict[str, Any]]:
+    """全トランスポートのカウンタ（メトリクス出力用）"""
+    return {name: t.stats() for name, t in list(_transports.items())}
+
+
+def _reset_after_fork() -> None:
+    for t in list(_transports.values()):
+        t.reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
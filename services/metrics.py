@@ -0,0 +1,266 @@
+# services/metrics.py
+"""
+Gemini 呼び出しの計測と Prometheus 形式での出力（プロセス単位で集計）
+
+- 1回の generateContent ごとに: モデル / 呼び出し元タグ / 結果 / レイテンシ / トークン数
+- chat() 単位で: 試したモデルの経路（例 "gemini-2.5-pro>gemini-2.5-flash"）と最終結果
+- 呼び出し元タグは contextvar（with gemini_caller("book"): ...）。
+  未設定ならリクエスト中の Flask endpoint 名、それも無ければ "unknown"
+- 計測はロック付きの dict 加算だけなので本番で常時有効にしてよい
+- render_prometheus() で HTTP プール・キャッシュ・レート制限などの統計もまとめて出力する
+
+gunicorn / RQ の各プロセスはそれぞれ自分の値を出力する（スクレイプ先のプロセスの値）。
+"""
+import os
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_caller: contextvars.ContextVar[str] = contextvars.ContextVar("gemini_caller", default="")
+
+LATENCY_BUCKETS: Tuple[float, ...] = (0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+@contextmanager
+def gemini_caller(tag: str) -> Iterator[None]:
+    """with gemini_caller("search_summarize"): のブロック内の Gemini 呼び出しにタグを付ける"""
+    token = _caller.set(tag)
+    try:
+        yield
+    finally:
+        _caller.reset(token)
+
+
+def current_caller() -> str:
+    tag = _caller.get()
+    if tag:
+        return tag
+    try:
+        from flask import has_request_context, request
+        if has_request_context() and request.endpoint:
+            return request.endpoint.split(".")[-1]
+    except Exception:
+        pass
+    return "unknown"
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, List[float]]] = {}  # [bucket counts..., sum, count]
+        self._help: Dict[str, Tuple[str, str]] = {}
+
+    def _declare(self, name: str, kind: str, help_text: str) -> None:
+        if name not in self._help:
+            self._help[name] = (kind, help_text)
+
+    def inc(self, name: str, labels: Dict[str, str], value: float = 1.0, help_text: str = "") -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._declare(name, "counter", help_text)
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, labels: Dict[str, str], value: float, help_text: str = "") -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._declare(name, "histogram", help_text)
+            series = self._histograms.setdefault(name, {})
+            h = series.get(key)
+            if h is None:
+                h = [0.0] * (len(LATENCY_BUCKETS) + 2)
+                series[key] = h
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    h[i] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    def snapshot(self) -> Tuple[Dict[str, Tuple[str, str]], Dict[str, Dict[LabelKey, float]], Dict[str, Dict[LabelKey, List[float]]]]:
+        with self._lock:
+            return (
+                dict(self._help),
+                {n: dict(s) for n, s in self._counters.items()},
+                {n: {k: list(v) for k, v in s.items()} for n, s in self._histograms.items()},
+            )
+
+
+registry = MetricsRegistry()
+
+
+# -------------------------------
+# Gemini 呼び出しの記録
+# -------------------------------
+def record_gemini_call(
+    model: str,
+    outcome: str,
+    latency_sec: Optional[float],
+    usage: Optional[Dict[str, Any]] = None,
+    stream: bool = False,
+) -> None:
+    """
+    generateContent / streamGenerateContent 1回分。
+    outcome: "ok" またはエラー種別（rate_limit / server / timeout / throttled / cache_miss ...）
+    latency_sec: None なら API に到達していない（throttled 等）のでヒストグラムには入れない
+    """
+    try:
+        caller = current_caller()
+        labels = {"model": model, "caller": caller}
+        registry.inc("gemini_requests_total", {**labels, "outcome": outcome, "stream": "true" if stream else "false"},
+                     help_text="Gemini API calls by model, caller and outcome")
+        if latency_sec is not None:
+            registry.observe("gemini_request_duration_seconds", labels, latency_sec,
+                             help_text="Gemini API call latency")
+        if usage:
+            for field, metric in (
+                ("promptTokenCount", "gemini_prompt_tokens_total"),
+                ("candidatesTokenCount", "gemini_output_tokens_total"),
+                ("cachedContentTokenCount", "gemini_cached_tokens_total"),
+            ):
+                n = usage.get(field)
+                if n:
+                    registry.inc(metric, labels, float(n), help_text=f"Gemini usageMetadata.{field}")
+    except Exception as e:  # 計測の失敗で本処理を止めない
+        logger.debug(f"[Metrics] record_gemini_call failed: {e}")
+
+
+def record_chat_path(models_tried: List[str], outcome: str) -> None:
+    """chat() 1回分。フォールバック・ヘッジで試したモデルの順序を path として残す"""
+    try:
+        registry.inc(
+            "gemini_chat_total",
+            {"caller": current_caller(), "path": ">".join(models_tried) or "none", "outcome": outcome},
+            help_text="GeminiClient.chat calls by fallback path and final outcome",
+        )
+    except Exception as e:
+        logger.debug(f"[Metrics] record_chat_path failed: {e}")
+
+
+# -------------------------------
+# Prometheus テキスト出力
+# -------------------------------
+def _escape(v: Any) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(labels: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _gauge_lines(name: str, help_text: str, rows: List[Tuple[Dict[str, str], Any]]) -> List[str]:
+    out = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for labels, value in rows:
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        out.append(f"{name}{_fmt_labels(tuple(sorted(labels.items())))} {float(value)}")
+    return out
+
+
+def _component_lines() -> List[str]:
+    """他モジュールが持つ統計（プール・キャッシュ・レート制限・ヘッジ・ルーター・WebFetch・I/O エグゼキュータ・コンテキストキャッシュ）"""
+    lines: List[str] = []
+    try:
+        from services.http_pool import pool_stats
+        rows = []
+        for name, s in pool_stats().items():
+            for field in ("requests", "connections_opened", "pool_hits", "pool_misses", "rebuilds", "retries"):
+                if field in s:
+                    rows.append(({"pool": name, "field": field}, s[field]))
+        lines += _gauge_lines("http_pool_stat", "Shared HTTP transport counters", rows)
+    except Exception as e:
+        logger.debug(f"[Metrics] pool stats unavailable: {e}")
+    try:
+        from services.tiered_cache import cache_stats
+        rows = [({"cache": name, "field": f}, v) for name, s in cache_stats().items() for f, v in s.items()]
+        lines += _gauge_lines("tiered_cache_stat", "Two-tier cache counters", rows)
+    except Exception as e:
+        logger.debug(f"[Metrics] cache stats unavailable: {e}")
+    try:
+        from services.rate_limiter import rate_limiter
+        rows = [({"priority": p, "field": f}, v) for p, s in rate_limiter.stats().items() for f, v in s.items()]
+        lines += _gauge_lines("gemini_rate_limiter_stat", "Gemini rate limiter queue stats", rows)
+    except Exception as e:
+        logger.debug(f"[Metrics] rate limiter stats unavailable: {e}")
+    try:
+        from services.gemini_hedge import latency_tracker
+        s = latency_tracker.stats()
+        rows = [({"field": "hedged_calls"}, s["hedged_calls"]), ({"field": "hedges_fired"}, s["hedges_fired"])]
+        rows += [({"field": "wins", "model": m}, n) for m, n in s["wins"].items()]
+        lines += _gauge_lines("gemini_hedge_stat", "Hedged request counters", rows)
+    except Exception as e:
+        logger.debug(f"[Metrics] hedge stats unavailable: {e}")
+    try:
+        from services.model_router import model_router
+        s = model_router.stats()
+        rows = [({"route": k}, v) for k, v in s["decisions"].items()]
+        lines += _gauge_lines("gemini_router_decisions", "Model router decisions by call type and tier", rows)
+        rows = [({"route": k}, q["ewma"]) for k, q in s["quality"].items()]
+        lines += _gauge_lines("gemini_router_quality", "First-choice success EWMA by call type and model", rows)
+    except Exception as e:
+        logger.debug(f"[Metrics] router stats unavailable: {e}")
+    try:
+        from services.page_fetcher import page_fetch_stats
+        rows = [({"field": f}, v) for f, v in page_fetch_stats().items()]
+        lines += _gauge_lines("webfetch_cache_stat", "WebFetch page cache counters", rows)
+    except Exception as e:
+        logger.debug(f"[Metrics] webfetch stats unavailable: {e}")
+    try:
+        from services.fetch_executor import fetch_executor_stats
+        rows = [({"field": f}, v) for f, v in fetch_executor_stats().items()]
+        lines += _gauge_lines("fetch_executor_stat", "Shared search/WebFetch executor state and counters", rows)
+    except Exception as e:
+        logger.debug(f"[Metrics] fetch executor stats unavailable: {e}")
+    try:
+        from services.gemini_context_cache import context_cache_stats
+        rows = [({"field": f}, v) for f, v in context_cache_stats().items()]
+        lines += _gauge_lines("gemini_context_cache_stat", "cachedContents manager counters", rows)
+    except Exception as e:
+        logger.debug(f"[Metrics] context cache stats unavailable: {e}")
+    return lines
+
+
+def render_prometheus() -> str:
+    help_map, counters, histograms = registry.snapshot()
+    lines: List[str] = [
+        "# HELP process_info Process emitting these metrics",
+        "# TYPE process_info gauge",
+        f'process_info{{pid="{os.getpid()}"}} 1',
+    ]
+    for name in sorted(counters):
+        kind, help_text = help_map.get(name, ("counter", ""))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for labels, value in sorted(counters[name].items()):
+            lines.append(f"{name}{_fmt_labels(labels)} {value}")
+    for name in sorted(histograms):
+        kind, help_text = help_map.get(name, ("histogram", ""))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, h in sorted(histograms[name].items()):
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', str(bound)),))} {h[i]}")
+            lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', '+Inf'),))} {h[-1]}")
+            lines.append(f"{name}_sum{_fmt_labels(labels)} {h[-2]}")
+            lines.append(f"{name}_count{_fmt_labels(labels)} {h[-1]}")
+    lines += _component_lines()
+    return "\n".join(lines) + "\n"
+
+
+def metrics_authorized(auth_header: str, query_token: str) -> bool:
+    """METRICS_TOKEN が設定されていれば Bearer ヘッダ or ?token= で照合する"""
+    expected = os.getenv("METRICS_TOKEN", "")
+    if not expected:
+        return True
+    if auth_header.startswith("Bearer ") and auth_header[7:].strip() == expected:
+        return True
+    return query_token == expected
@@ -0,0 +1,176 @@
+# services/model_router.py
+"""
+呼び出し種別・プロンプトの大きさ・簡易な複雑度から、モデル（flash / pro）と出力上限を選ぶ
+
+- 呼び出し種別は GeminiClient のメソッド名（analyze_conversation など）か、
+  metrics の呼び出し元タグ（conversation_memory など）
+- 要約・タイトル・クエリ分解などの軽い呼び出しは常に fast モデル（pro の待ち行列に並ばない）
+- 書籍要約・Deep Research のレポートは strong モデル
+- それ以外（通常チャット・検索要約）は複雑度スコアで決める
+- strong の直近 p95 レイテンシが上限を超えていれば、境界付近のリクエストは fast に回す
+- 種別ごとに「最初に選んだモデルで正常応答が得られたか」を指数移動平均で記録し、
+  fast の品質が下がった種別は strong に格上げする
+- ユーザーが明示したモデル（requested_model）がある場合はルーターを通さない
+
+環境変数:
+    GEMINI_ROUTER                    true/false（既定 true）
+    GEMINI_ROUTER_FAST_MODEL         既定 gemini-2.5-flash
+    GEMINI_ROUTER_STRONG_MODEL       既定 gemini-2.5-pro
+    GEMINI_ROUTER_STRONG_SCORE       strong にする複雑度スコア（既定 3）
+    GEMINI_ROUTER_MAX_LATENCY_SEC    strong の p95 がこれを超えたら境界付近は fast（既定 30）
+    GEMINI_ROUTER_MIN_QUALITY        fast の成功率がこれを下回った種別は strong（既定 0.8）
+    GEMINI_ROUTER_MIN_SAMPLES        品質判定に必要な件数（既定 20）
+"""
+import os
+import re
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.gemini_hedge import latency_tracker
+from services.metrics import current_caller
+from services.token_estimator import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+FAST = "fast"
+STRONG = "strong"
+AUTO = "auto"
+
+# 呼び出し種別 → (tier, maxOutputTokens)
+_CALL_POLICIES: Dict[str, Tuple[str, int]] = {
+    "analyze_conversation": (FAST, 1024),
+    "conversation_summary": (FAST, 1024),
+    "conversation_memory": (FAST, 1024),
+    "deep_research_decompose": (FAST, 1024),
+    "summarize_book_with_toc": (STRONG, 4096),
+    "book_summary": (STRONG, 4096),
+    "deep_research_synthesis": (STRONG, 8192),
+}
+_DEFAULT_MAX_OUTPUT = 4096
+_CHITCHAT_MAX_OUTPUT = 1024
+_CHITCHAT_TOKENS = 30
+
+# 推論・比較・設計などを求める表現（複雑度スコアの加点）
+_COMPLEX_RE = re.compile(
+    r"なぜ|理由|比較|違い|分析|設計|証明|最適|戦略|手順|詳しく|考察|検討|メリット|デメリット|"
+    r"\bwhy\b|\bcompare\b|\banaly[sz]e\b|\bdesign\b|\bprove\b|\bexplain\b|step[- ]by[- ]step",
+    re.IGNORECASE,
+)
+_CODE_RE = re.compile(r"```|\bdef \w+\(|\bclass \w+|\bSELECT\b.+\bFROM\b|Traceback|\{\s*\"", re.IGNORECASE | re.DOTALL)
+_MATH_RE = re.compile(r"[∑∫√≤≥≠]|\\frac|\^\d|\d+\s*[×÷*/]\s*\d+")
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def router_enabled() -> bool:
+    return os.getenv("GEMINI_ROUTER", "true").lower() == "true"
+
+
+def complexity_score(text: str, prompt_tokens: Optional[int] = None) -> int:
+    """0 以上の整数。大きいほど strong モデル向き"""
+    text = text or ""
+    tokens = estimate_tokens(text) if prompt_tokens is None else prompt_tokens
+    score = min(2, len(_COMPLEX_RE.findall(text)))
+    if _CODE_RE.search(text):
+        score += 2
+    if _MATH_RE.search(text):
+        score += 1
+    if text.count("？") + text.count("?") >= 2:
+        score += 1  # 複数の問い
+    if tokens > 400:
+        score += 1
+    if tokens > 4000:
+        score += 1
+    return score
+
+
+class ModelRouter:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # (call_type, model) -> [ewma, samples]
+        self._quality: Dict[Tuple[str, str], List[float]] = {}
+        self._decisions: Dict[str, int] = {}
+
+    def fast_model(self) -> str:
+        return os.getenv("GEMINI_ROUTER_FAST_MODEL", "gemini-2.5-flash")
+
+    def strong_model(self) -> str:
+        return os.getenv("GEMINI_ROUTER_STRONG_MODEL", "gemini-2.5-pro")
+
+    # ---------------- 品質シグナル ----------------
+    def record_result(self, call_type: str, first_model: str, ok: bool) -> None:
+        """最初に選んだモデルで正常応答が得られたか（空応答・JSON 不正・フォールバックは False）"""
+        if not call_type or not first_model:
+            return
+        with self._lock:
+            q = self._quality.get((call_type, first_model))
+            if q is None:
+                q = [1.0, 0]
+                self._quality[(call_type, first_model)] = q
+            q[0] = 0.9 * q[0] + 0.1 * (1.0 if ok else 0.0)
+            q[1] += 1
+
+    def _fast_quality_low(self, call_type: str) -> bool:
+        with self._lock:
+            q = self._quality.get((call_type, self.fast_model()))
+        if not q or q[1] < _env_float("GEMINI_ROUTER_MIN_SAMPLES", 20):
+            return False
+        return q[0] < _env_float("GEMINI_ROUTER_MIN_QUALITY", 0.8)
+
+    # ---------------- 選択 ----------------
+    def route(self, call_type: str, text: str, prompt_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """
+        returns {"model", "max_output_tokens", "tier", "reason"}
+        call_type が空なら metrics の呼び出し元タグを使う。
+        """
+        caller = current_caller()
+        policy = _CALL_POLICIES.get(call_type) or _CALL_POLICIES.get(caller)
+        tier, max_output = policy if policy else (AUTO, _DEFAULT_MAX_OUTPUT)
+        kind = call_type or caller
+        reason = f"policy:{kind}"
+
+        if tier == AUTO:
+            tokens = estimate_tokens(text or "") if prompt_tokens is None else prompt_tokens
+            score = complexity_score(text, tokens)
+            threshold = int(_env_float("GEMINI_ROUTER_STRONG_SCORE", 3))
+            if score >= threshold:
+                tier = STRONG
+                p95 = latency_tracker.percentile(self.strong_model(), 95)
+                if p95 is not None and p95 > _env_float("GEMINI_ROUTER_MAX_LATENCY_SEC", 30) and score < threshold + 2:
+                    tier = FAST
+                    reason = f"score={score} strong_p95={p95:.1f}s"
+                else:
+                    reason = f"score={score}"
+            else:
+                tier = FAST
+                reason = f"score={score}"
+                if score == 0 and tokens <= _CHITCHAT_TOKENS:
+                    max_output = _CHITCHAT_MAX_OUTPUT
+                    reason = "chitchat"
+
+        if tier == FAST and self._fast_quality_low(kind):
+            tier = STRONG
+            reason += " fast_quality_low"
+
+        model = self.fast_model() if tier == FAST else self.strong_model()
+        with self._lock:
+            self._decisions[f"{kind}:{tier}"] = self._decisions.get(f"{kind}:{tier}", 0) + 1
+        logger.info(f"[Gemini Router] {kind} -> {model} (max_output={max_output}, {reason})")
+        return {"model": model, "max_output_tokens": max_output, "tier": tier, "reason": reason}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "decisions": dict(self._decisions),
+                "quality": {f"{ct}:{m}": {"ewma": round(q[0], 3), "samples": int(q[1])}
+                            for (ct, m), q in self._quality.items()},
+            }
+
+
+model_router = ModelRouter()
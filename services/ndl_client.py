@@ -1,15 +1,21 @@
 
 import requests
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import xml.etree.ElementTree as ET
 
+from services.http_pool import http_timeout, search_transport
+
 logger = logging.getLogger(__name__)
 
+_DC = "{http://purl.org/dc/elements/1.1/}"
+_XSI_TYPE = "{http://www.w3.org/2001/XMLSchema-instance}type"
+
 class NDLClient:
-    def __init__(self, timeout: int = 10):
+    def __init__(self, timeout: int = 10, retries: int = 2):
         self.base_url = "https://iss.ndl.go.jp/api/sru"
         self.timeout = timeout
+        self.retries = retries
 
     def search_books(self, title: str, max_records: int = 10) -> List[Dict[str, Any]]:
         params = {
@@ -19,7 +25,9 @@ class NDLClient:
             "recordPacking": "xml",
         }
         try:
-            response = requests.get(self.base_url, params=params, timeout=self.timeout)
+            response = search_transport("ndl").get_with_retry(
+                self.base_url, retries=self.retries, params=params, timeout=http_timeout(self.timeout)
+            )
             response.raise_for_status()
             return self._parse_xml_response(response.text)
         except requests.exceptions.RequestException as e:
@@ -38,8 +46,18 @@ class NDLClient:
                     "url": link,  # URLフィールドとしても利用できるようにする
                     "author": record.find("author").text if record.find("author") is not None else None,
                     "category": record.find("category").text if record.find("category") is not None else None,
+                    "publisher": record.findtext(f"{_DC}publisher"),
+                    "isbn": self._isbn(record),
                 })
             return records
         except ET.ParseError as e:
             logger.error(f"Error parsing NDL API response: {e}")
             return []
+
+    @staticmethod
+    def _isbn(record: ET.Element) -> Optional[str]:
+        """<dc:identifier xsi:type="dcndl:ISBN"> の値"""
+        for ident in record.findall(f"{_DC}identifier"):
+            if (ident.get(_XSI_TYPE) or "").endswith("ISBN") and ident.text:
+                return ident.text.strip()
+        return None
@@ -0,0 +1,397 @@
+# services/page_fetcher.py
+"""
+WebFetch のページ本文キャッシュ（検索結果の enriched_content 用）
+
+- 3層: プロセス内 LRU → Redis（services/tiered_cache.py）→ ディスク（zlib 圧縮 JSON）
+- 取得から WEBFETCH_FRESH_TTL_SEC 以内はネットワークに出ない。
+  それを過ぎたら ETag / Last-Modified で条件付き GET し、304 なら保存済みの本文を使う
+- 4xx は長め、タイムアウト・接続エラー・5xx・429 は短めにネガティブキャッシュ
+  （同じ壊れた URL を毎回待たない）
+- 同じ URL の同時取得は1回のダウンロードにまとめる（single-flight。プロセス内スレッド間）
+- 保存するのは本文抽出（タイトル・概要・目次・レビュー・本文。services/content_extractor.py）
+  済みのテキスト（最大 WEBFETCH_MAX_TEXT_CHARS 文字）。呼び出し側が必要な文字数に切り詰める
+- 本文はストリーミングで読み、本文候補が十分たまった時点（または WEBFETCH_MAX_BYTES）で打ち切る。
+  文字コードは Content-Type → <meta charset> → 最初の非 ASCII 部分を試しにデコード の順で決める
+
+環境変数:
+    WEBFETCH_CACHE                 true/false（既定 true）
+    WEBFETCH_FRESH_TTL_SEC         再検証なしで使う期間（既定 6時間）
+    WEBFETCH_RETAIN_TTL_SEC        再検証用に保持する期間（既定 7日）
+    WEBFETCH_NEGATIVE_TTL_SEC      4xx のネガティブキャッシュ（既定 1時間）
+    WEBFETCH_ERROR_TTL_SEC         タイムアウト等のネガティブキャッシュ（既定 5分）
+    WEBFETCH_DISK_CACHE_DIR        ディスク層の置き場所（既定 <tmp>/webfetch_cache。空文字で無効）
+    WEBFETCH_DISK_CACHE_MAX_FILES  ディスク層のファイル数上限（既定 5000）
+    WEBFETCH_CACHE_MAX_ENTRIES / WEBFETCH_CACHE_MAX_BYTES  プロセス内 LRU の上限
+    WEBFETCH_MAX_TEXT_CHARS        保存する本文の最大文字数（既定 4000）
+    WEBFETCH_MAX_BYTES             1ページで読む最大バイト数（既定 2MB）
+"""
+import os
+import re
+import json
+import time
+import zlib
+import codecs
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+
+from services.content_extractor import PageParser, extract_from_parser, to_source_text
+from services.http_pool import http_timeout, webfetch_transport
+from services.tiered_cache import TieredCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_USER_AGENT = "Mozilla/5.0 (compatible; BookSummaryBot/1.0)"
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def page_cache_enabled() -> bool:
+    return os.getenv("WEBFETCH_CACHE", "true").lower() == "true"
+
+
+def _fresh_ttl() -> int:
+    return _env_int("WEBFETCH_FRESH_TTL_SEC", 6 * 3600)
+
+
+def _retain_ttl() -> int:
+    return max(_fresh_ttl(), _env_int("WEBFETCH_RETAIN_TTL_SEC", 7 * 86400))
+
+
+page_cache = TieredCache(
+    "webfetch",
+    max_entries=_env_int("WEBFETCH_CACHE_MAX_ENTRIES", 512),
+    max_bytes=_env_int("WEBFETCH_CACHE_MAX_BYTES", 16 * 1024 * 1024),
+)
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, int] = {
+    "fresh_hits": 0,
+    "revalidated": 0,
+    "downloads": 0,
+    "negative_hits": 0,
+    "negative_stores": 0,
+    "disk_hits": 0,
+    "singleflight_waits": 0,
+    "bytes_read": 0,
+}
+
+
+def _count(name: str) -> None:
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _add_bytes(n: int) -> None:
+    with _stats_lock:
+        _stats["bytes_read"] += n
+
+
+def page_fetch_stats() -> Dict[str, int]:
+    with _stats_lock:
+        return dict(_stats)
+
+
+# -------------------------------
+# 文字コード判定と逐次読み込み
+# -------------------------------
+_HEADER_CHARSET_RE = re.compile(r'charset\s*=\s*["\']?([A-Za-z0-9_.:\-]+)', re.IGNORECASE)
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([A-Za-z0-9_.:\-]+)', re.IGNORECASE)
+_CHARSET_ALIASES = {"shift_jis": "cp932", "shift-jis": "cp932", "sjis": "cp932", "x-sjis": "cp932", "windows-31j": "cp932"}
+_SNIFF_BYTES = 4096
+
+
+def sniff_charset(content_type: str, head: bytes, sample: bytes = b"") -> str:
+    """
+    Content-Type → <meta charset>（head の先頭）→ BOM / 試しにデコード（UTF-8 → CP932 → EUC-JP）の順で判定。
+    試しにデコードするのは sample（省略時は head）
+    """
+    candidates = []
+    m = _HEADER_CHARSET_RE.search(content_type or "")
+    if m:
+        candidates.append(m.group(1))
+    m = _META_CHARSET_RE.search(head[:_SNIFF_BYTES])
+    if m:
+        candidates.append(m.group(1).decode("ascii", errors="ignore"))
+    for name in candidates:
+        name = _CHARSET_ALIASES.get(name.lower(), name.lower())
+        try:
+            return codecs.lookup(name).name
+        except LookupError:
+            continue
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8"
+    for name in ("utf-8", "cp932", "euc_jp"):
+        try:
+            # 末尾がマルチバイト文字の途中で切れていても失敗にしない
+            codecs.getincrementaldecoder(name)().decode(sample or head, final=False)
+            return name
+        except UnicodeDecodeError:
+            continue
+    return "utf-8"
+
+
+def _is_text_type(content_type: str) -> bool:
+    ct = (content_type or "").lower()
+    return not ct or "html" in ct or "xml" in ct or ct.startswith("text/")
+
+
+def read_page_text(response: Any, url: str, max_chars: int, max_bytes: int, deadline: float) -> Tuple[str, int]:
+    """
+    ストリーミング応答を簡易 DOM に流し込み、本文抽出（services/content_extractor.py）した
+    enriched_content 用テキストを返す。
+    本文候補のテキストが max_chars の 20 倍・バイト数・時間のいずれかの上限に達したら残りは読まない。
+    returns (text, bytes_read)
+    """
+    parser = PageParser(text_budget=max_chars * 20)
+    content_type = response.headers.get("Content-Type", "")
+    declared = bool(_HEADER_CHARSET_RE.search(content_type))
+    decoder = None
+    head = b""  # <meta charset> を探す先頭部分
+    read = 0
+    for chunk in response.iter_bytes(16384):
+        if not chunk:
+            continue
+        read += len(chunk)
+        if decoder is None:
+            if len(head) < _SNIFF_BYTES:
+                head += chunk[: _SNIFF_BYTES - len(head)]
+            if not declared and chunk.isascii() and not _META_CHARSET_RE.search(head):
+                # ASCII だけならどの文字コードでも同じ。非 ASCII が来るまで判定を待つ
+                # （先頭に大きな inline script がある日本語ページで UTF-8 と誤判定しないため）
+                parser.feed(chunk.decode("ascii"))
+            else:
+                decoder = codecs.getincrementaldecoder(sniff_charset(content_type, head, chunk))(errors="replace")
+                parser.feed(decoder.decode(chunk))
+        else:
+            parser.feed(decoder.decode(chunk))
+        if parser.full or read >= max_bytes or time.monotonic() > deadline:
+            break
+    else:
+        if decoder is not None:
+            parser.feed(decoder.decode(b"", final=True))
+    return to_source_text(extract_from_parser(parser, url), max_chars), read
+
+
+# -------------------------------
+# ディスク層
+# -------------------------------
+class _DiskCache:
+    """1 URL = 1 ファイル（zlib 圧縮した JSON）。期限は中身の expires_at で判定"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _dir(self) -> str:
+        return os.getenv("WEBFETCH_DISK_CACHE_DIR", os.path.join(tempfile.gettempdir(), "webfetch_cache"))
+
+    def _path(self, key: str) -> Optional[str]:
+        d = self._dir()
+        if not d:
+            return None
+        return os.path.join(d, key[:2], key + ".json.z")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                entry = json.loads(zlib.decompress(f.read()).decode("utf-8"))
+        except Exception as e:
+            logger.debug(f"[WebFetch Cache] unreadable disk entry {path}: {e}")
+            return None
+        if entry.get("expires_at", 0) <= time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def set(self, key: str, entry: Dict[str, Any]) -> None:
+        path = self._path(key)
+        if not path:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(zlib.compress(json.dumps(entry, ensure_ascii=False).encode("utf-8"), 6))
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"[WebFetch Cache] disk write failed: {e}")
+            return
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % 200 == 0
+        if prune:
+            self._prune()
+
+    def _prune(self) -> None:
+        """ファイル数が上限を超えたら古いものから消す"""
+        limit = _env_int("WEBFETCH_DISK_CACHE_MAX_FILES", 5000)
+        files = []
+        for root, _, names in os.walk(self._dir()):
+            for n in names:
+                p = os.path.join(root, n)
+                try:
+                    files.append((os.path.getmtime(p), p))
+                except OSError:
+                    pass
+        if len(files) <= limit:
+            return
+        files.sort()
+        for _, p in files[: len(files) - limit]:
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+
+_disk = _DiskCache()
+
+
+def _cache_key(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def _load(key: str) -> Optional[Dict[str, Any]]:
+    entry = page_cache.get(key)
+    if entry is not None:
+        return entry
+    entry = _disk.get(key)
+    if entry is not None:
+        _count("disk_hits")
+        ttl = entry["expires_at"] - time.time()
+        if ttl > 0:
+            page_cache.set(key, entry, ttl)
+    return entry
+
+
+def _store(key: str, entry: Dict[str, Any], ttl: int) -> None:
+    entry["expires_at"] = time.time() + ttl
+    page_cache.set(key, entry, ttl)
+    if not entry.get("negative"):
+        _disk.set(key, entry)
+
+
+# -------------------------------
+# single-flight
+# -------------------------------
+class _Flight:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Optional[str] = None
+
+
+_inflight: Dict[str, _Flight] = {}
+_inflight_lock = threading.Lock()
+
+
+# -------------------------------
+# 取得
+# -------------------------------
+def _download(url: str, key: str, cached: Optional[Dict[str, Any]], user_agent: str, timeout: float) -> Optional[str]:
+    # 本文の読み取りは接続開始からの timeout で打ち切る（ヘッダ待ちと合わせて 2 倍にしない）
+    deadline = time.monotonic() + timeout
+    headers = {"User-Agent": user_agent}
+    if cached and not cached.get("negative"):
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    max_chars = _env_int("WEBFETCH_MAX_TEXT_CHARS", 4000)
+    max_bytes = _env_int("WEBFETCH_MAX_BYTES", 2 * 1024 * 1024)
+    try:
+        with webfetch_transport().stream("GET", url, timeout=http_timeout(timeout), headers=headers) as response:
+            status = response.status_code
+            if status == 200 and not _is_text_type(response.headers.get("Content-Type", "")):
+                status = 415  # PDF・画像などは読まない
+            if status == 200:
+                etag = response.headers.get("ETag", "")
+                last_modified = response.headers.get("Last-Modified", "")
+                text, bytes_read = read_page_text(response, url, max_chars, max_bytes, deadline)
+    except requests.RequestException as e:
+        logger.warning(f"WebFetch failed for {url}: {e}")
+        if page_cache_enabled():
+            _store(key, {"negative": True, "reason": type(e).__name__}, _env_int("WEBFETCH_ERROR_TTL_SEC", 300))
+            _count("negative_stores")
+        return None
+
+    if status == 304 and cached and not cached.get("negative"):
+        _count("revalidated")
+        cached["fetched_at"] = time.time()
+        _store(key, cached, _retain_ttl())
+        logger.info(f"[WebFetch Cache] revalidated (304) {url[:60]}")
+        return cached["text"]
+
+    if status != 200:
+        logger.warning(f"WebFetch failed for {url}: HTTP {status}")
+        if page_cache_enabled():
+            transient = status == 429 or status >= 500
+            ttl = _env_int("WEBFETCH_ERROR_TTL_SEC", 300) if transient else _env_int("WEBFETCH_NEGATIVE_TTL_SEC", 3600)
+            _store(key, {"negative": True, "reason": f"http_{status}"}, ttl)
+            _count("negative_stores")
+        return None
+
+    _count("downloads")
+    _add_bytes(bytes_read)
+    if page_cache_enabled():
+        _store(key, {
+            "text": text,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": time.time(),
+        }, _retain_ttl())
+    return text
+
+
+def fetch_page_text(url: str, user_agent: str = DEFAULT_USER_AGENT, timeout: float = 10) -> Optional[str]:
+    """
+    ページ本文（タグ除去済みテキスト）を返す。取得できなければ None。
+    キャッシュ・条件付き再検証・ネガティブキャッシュ・single-flight をまとめて扱う。
+    """
+    key = _cache_key(url)
+    cached = _load(key) if page_cache_enabled() else None
+    if cached is not None:
+        if cached.get("negative"):
+            _count("negative_hits")
+            logger.info(f"[WebFetch Cache] negative hit ({cached.get('reason')}) {url[:60]}")
+            return None
+        if time.time() - cached.get("fetched_at", 0) < _fresh_ttl():
+            _count("fresh_hits")
+            return cached["text"]
+
+    with _inflight_lock:
+        flight = _inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _Flight()
+            _inflight[key] = flight
+
+    if not leader:
+        # 先行者は必ず finally で done を立てる（通信はすべてタイムアウト付き）ので上限は設けない。
+        # 固定の上限だと先行者の方が長くかかったとき、取得済みの結果を受け取れずに None を返してしまう
+        _count("singleflight_waits")
+        flight.done.wait()
+        return flight.result
+
+    try:
+        flight.result = _download(url, key, cached, user_agent, timeout)
+        return flight.result
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        flight.done.set()
@@ -0,0 +1,196 @@
+# services/ranking.py
+"""
+検索結果の関連度ランキング（BM25。日本語は文字 bigram、英数字は単語単位）
+
+- 取得前: タイトル＋スニペットでスコアを付け、WebFetch する価値のある URL だけを選ぶ
+  （select_fetch_targets。上位でも問い合わせと無関係な結果は取得しない）
+- 取得後: enriched_content も含めて並べ直し、トークン予算に収まるところまで残す
+  （fit_to_budget。Gemini に渡すプロンプトを小さくする）
+- 候補集合の中で idf を計算する（外部コーパスは持たない）。
+  スコア計算は (文書数 × クエリ語数) の行列に対して NumPy でまとめて行う
+
+環境変数:
+    RANKING_SOURCE_BUDGET_TOKENS   要約に渡す資料のトークン予算（既定 8000）
+    RANKING_MIN_RELATIVE_SCORE     WebFetch 対象にする最低スコア（最高スコア比。既定 0.2）
+"""
+import os
+import re
+import logging
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from services.token_estimator import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"[0-9a-z]+|[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]+")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+TITLE_WEIGHT = 2       # タイトルはスニペット・本文より効かせる（文書中で繰り返す）
+TRUSTED_BONUS = 0.3    # 信頼ドメインへの加点（正規化スコアに加算）
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def tokenize(text: str) -> List[str]:
+    """NFKC・小文字化し、かな・漢字の連続は文字 bigram、英数字の連続は単語にする"""
+    norm = unicodedata.normalize("NFKC", text or "").lower()
+    tokens: List[str] = []
+    for run in _TOKEN_RE.findall(norm):
+        if run[0].isascii():
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def bm25_scores(query: str, docs: Sequence[str], k1: float = BM25_K1, b: float = BM25_B) -> np.ndarray:
+    """docs それぞれの query に対する BM25 スコア（候補集合の中で idf を計算）"""
+    n = len(docs)
+    terms = list(dict.fromkeys(tokenize(query)))
+    if n == 0 or not terms:
+        return np.zeros(n)
+    index = {t: j for j, t in enumerate(terms)}
+
+    tf = np.zeros((n, len(terms)))
+    lengths = np.empty(n)
+    for d, text in enumerate(docs):
+        toks = tokenize(text)
+        lengths[d] = len(toks)
+        ids = np.fromiter((index.get(t, -1) for t in toks), dtype=np.int64, count=len(toks))
+        ids = ids[ids >= 0]
+        if ids.size:
+            tf[d] = np.bincount(ids, minlength=len(terms))
+
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log1p((n - df + 0.5) / (df + 0.5))
+    avgdl = lengths.mean() or 1.0
+    norm = k1 * (1.0 - b + b * lengths / avgdl)
+    return (tf * (k1 + 1.0) / (tf + norm[:, None])) @ idf
+
+
+def term_coverage(query: str, text: str) -> float:
+    """query の語（bigram）のうち text に現れる割合。1件ずつ届く結果の足切りに使う"""
+    terms = set(tokenize(query))
+    if not terms:
+        return 0.0
+    return len(terms & set(tokenize(text))) / len(terms)
+
+
+def _url(r: Dict[str, Any]) -> str:
+    return r.get("url") or r.get("link") or r.get("info_link") or ""
+
+
+def _doc_text(r: Dict[str, Any], with_content: bool) -> str:
+    parts = [r.get("title") or ""] * TITLE_WEIGHT
+    parts.append(r.get("snippet") or r.get("description") or "")
+    if with_content:
+        parts.append(r.get("enriched_content") or "")
+    return "\n".join(parts)
+
+
+def score_results(query: str, results: Sequence[Dict[str, Any]], with_content: bool = False) -> np.ndarray:
+    return bm25_scores(query, [_doc_text(r, with_content) for r in results])
+
+
+def rank_results(query: str, results: Sequence[Dict[str, Any]], with_content: bool = True) -> List[Dict[str, Any]]:
+    """スコアの高い順（同点は元の順）。クエリが空なら元の順のまま"""
+    if not query or len(results) < 2:
+        return list(results)
+    scores = score_results(query, results, with_content)
+    order = np.argsort(-scores, kind="stable")
+    return [results[i] for i in order]
+
+
+def select_fetch_targets(
+    query: str,
+    results: Sequence[Dict[str, Any]],
+    max_fetch: int,
+    trusted_domains: Iterable[str] = (),
+    exclude_urls: Iterable[str] = (),
+    min_relative: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    """
+    WebFetch する結果を選ぶ（最大 max_fetch 件。少ないこともある）
+
+    タイトル＋スニペットの BM25 を最高スコアで割って 0〜1 にし、信頼ドメインなら TRUSTED_BONUS を足す。
+    最高スコア比が min_relative 未満（問い合わせとほぼ無関係）のものは取得しない。
+    クエリが空、または全件スコア 0 のときは従来どおり信頼ドメイン優先の先頭から選ぶ。
+    """
+    trusted = [d for d in trusted_domains if d]
+    skip = set(exclude_urls)
+    candidates = [r for r in results if _url(r) and _url(r) not in skip]
+    if max_fetch <= 0 or not candidates:
+        return []
+
+    def _is_trusted(r: Dict[str, Any]) -> bool:
+        return any(d in _url(r) for d in trusted)
+
+    scores = score_results(query, candidates) if query else np.zeros(len(candidates))
+    best = float(scores.max()) if len(candidates) else 0.0
+    if best <= 0.0:
+        ordered = [r for r in candidates if _is_trusted(r)] + [r for r in candidates if not _is_trusted(r)]
+        return ordered[:max_fetch]
+
+    if min_relative is None:
+        min_relative = _env_float("RANKING_MIN_RELATIVE_SCORE", 0.2)
+    rel = scores / best
+    bonus = np.array([TRUSTED_BONUS if _is_trusted(r) else 0.0 for r in candidates])
+    final = rel + bonus
+    order = np.argsort(-final, kind="stable")
+    picked = [candidates[i] for i in order if rel[i] >= min_relative][:max_fetch]
+    if len(picked) < min(max_fetch, len(candidates)):
+        logger.info(
+            f"[Ranking] fetch {len(picked)}/{len(candidates)} candidates "
+            f"(others below {min_relative:.2f} of best score)"
+        )
+    return picked
+
+
+def _source_tokens(r: Dict[str, Any]) -> int:
+    body = r.get("enriched_content") or r.get("snippet") or ""
+    return estimate_tokens(body) + estimate_tokens(r.get("title") or "") + estimate_tokens(_url(r)) + 8
+
+
+def fit_to_budget(
+    query: str,
+    results: Sequence[Dict[str, Any]],
+    budget_tokens: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    関連度順に並べ、資料のトークン合計が予算に収まるところまで残す
+
+    - ユーザー提供資料（source == "user"）は常に先頭に残す（予算にも数える）
+    - 予算を超える資料は飛ばし、後ろの小さい資料で空きを埋める
+    - 最も関連度の高い資料は予算を超えても1件は残す
+    """
+    if budget_tokens is None:
+        budget_tokens = int(_env_float("RANKING_SOURCE_BUDGET_TOKENS", 8000))
+    if not results:
+        return []
+    user = [r for r in results if r.get("source") == "user"]
+    others = rank_results(query, [r for r in results if r.get("source") != "user"])
+
+    kept = list(user)
+    used = sum(_source_tokens(r) for r in user)
+    dropped = 0
+    for i, r in enumerate(others):
+        cost = _source_tokens(r)
+        if used + cost <= budget_tokens or i == 0:
+            kept.append(r)
+            used += cost
+        else:
+            dropped += 1
+    if dropped:
+        logger.info(f"[Ranking] kept {len(kept)} sources (~{used} tokens), dropped {dropped} over budget {budget_tokens}")
+    return kept
@@ -0,0 +1,273 @@
+# services/rate_limiter.py
+"""
+Gemini API のクラスタ全体レート制限（RPM / TPM トークンバケット）
+
+- モデルごとに「リクエスト/分」と「推定トークン/分」の2つのバケットを持つ
+- バケットは Redis 上で Lua スクリプトにより原子的に更新（全 gunicorn / RQ ワーカーで共有）
+  Redis が使えない場合はプロセス内バケットで近似する
+- 優先度: interactive（チャット）/ background（要約・Deep Research 等）
+  background はバケットの一部（GEMINI_RL_RESERVE）を interactive 用に残して待つ
+- 待ち行列はプロセスごとに上限あり。あふれた場合や最大待ち時間を超えた場合は
+  GeminiRateLimited を送出し、呼び出し側は次の候補モデルへ進む
+- 待ち時間の統計を保持（メトリクス出力用）
+
+制限値（0 または未設定で無効）:
+    GEMINI_RPM_LIMIT / GEMINI_TPM_LIMIT                     全モデル共通の既定値
+    GEMINI_RPM_LIMIT_GEMINI_2_5_PRO など                      モデル別の上書き
+"""
+import os
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, Tuple
+
+from services.redis_client import get_redis, mark_redis_failed
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+_priority: contextvars.ContextVar[str] = contextvars.ContextVar("gemini_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def gemini_priority(priority: str) -> Iterator[None]:
+    """with gemini_priority("background"): のブロック内の Gemini 呼び出しを低優先度にする"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _model_limit(kind: str, model: str) -> int:
+    suffix = model.upper().replace("-", "_").replace(".", "_")
+    specific = os.getenv(f"GEMINI_{kind}_LIMIT_{suffix}")
+    if specific is not None:
+        try:
+            return int(specific)
+        except ValueError:
+            pass
+    return _env_int(f"GEMINI_{kind}_LIMIT", 0)
+
+
+class GeminiRateLimited(Exception):
+    """待ち行列があふれた / 最大待ち時間を超えた"""
+    pass
+
+
+# 2つのバケット（RPM, TPM）を同時に判定して、両方空きがあるときだけ消費する。
+# 戻り値: 待つべきミリ秒（0 なら取得済み）
+_TAKE_LUA = """
+local now = tonumber(ARGV[1])
+local rpm = tonumber(ARGV[2])
+local tpm = tonumber(ARGV[3])
+local need = tonumber(ARGV[4])
+local reserve = tonumber(ARGV[5])
+
+local function load(key, cap)
+  local v = redis.call('HMGET', key, 'level', 'ts')
+  local level = tonumber(v[1])
+  local ts = tonumber(v[2])
+  if level == nil or ts == nil then
+    return cap
+  end
+  return math.min(cap, level + (now - ts) * cap / 60000.0)
+end
+
+local r = load(KEYS[1], rpm)
+local t = load(KEYS[2], tpm)
+need = math.min(need, tpm * (1 - reserve))
+
+local wait = 0
+local floor_r = rpm * reserve
+local floor_t = tpm * reserve
+if r - 1 < floor_r then
+  wait = math.max(wait, (floor_r + 1 - r) * 60000.0 / rpm)
+end
+if t - need < floor_t then
+  wait = math.max(wait, (floor_t + need - t) * 60000.0 / tpm)
+end
+if wait <= 0 then
+  r = r - 1
+  t = t - need
+end
+
+redis.call('HSET', KEYS[1], 'level', r, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], 120000)
+redis.call('HSET', KEYS[2], 'level', t, 'ts', now)
+redis.call('PEXPIRE', KEYS[2], 120000)
+return math.ceil(wait)
+"""
+
+
+class _LocalBuckets:
+    """Redis が無いときのプロセス内バケット（Lua と同じ計算）"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._state: Dict[str, Tuple[float, float, float]] = {}  # model -> (rpm_level, tpm_level, ts_ms)
+
+    def take(self, model: str, now_ms: float, rpm: float, tpm: float, need: float, reserve: float) -> int:
+        with self._lock:
+            state = self._state.get(model)
+            if state is None:
+                r, t = rpm, tpm
+            else:
+                r0, t0, ts = state
+                r = min(rpm, r0 + (now_ms - ts) * rpm / 60000.0)
+                t = min(tpm, t0 + (now_ms - ts) * tpm / 60000.0)
+            need = min(need, tpm * (1 - reserve))
+            wait = 0.0
+            if r - 1 < rpm * reserve:
+                wait = max(wait, (rpm * reserve + 1 - r) * 60000.0 / rpm)
+            if t - need < tpm * reserve:
+                wait = max(wait, (tpm * reserve + need - t) * 60000.0 / tpm)
+            if wait <= 0:
+                r -= 1
+                t -= need
+            self._state[model] = (r, t, now_ms)
+            return int(wait + 0.999)
+
+
+class RateLimiter:
+    def __init__(self, prefix: str = "gemini_rl") -> None:
+        self.prefix = prefix
+        self._local = _LocalBuckets()
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._waiting: Dict[str, int] = {INTERACTIVE: 0, BACKGROUND: 0}
+        self._script: Any = None
+        self._script_client: Any = None
+        self._stats: Dict[str, Dict[str, float]] = {
+            p: {"acquired": 0, "waited": 0, "rejected": 0, "wait_sec_total": 0.0, "wait_sec_max": 0.0}
+            for p in (INTERACTIVE, BACKGROUND)
+        }
+        self._recent_waits: Dict[str, Deque[float]] = {p: deque(maxlen=500) for p in (INTERACTIVE, BACKGROUND)}
+
+    # ---------------- 内部 ----------------
+    def _take(self, model: str, rpm: int, tpm: int, need: int, reserve: float) -> int:
+        # 片方だけ制限する場合はもう片方を事実上無制限にする
+        rpm_cap = float(rpm) if rpm > 0 else 1e9
+        tpm_cap = float(tpm) if tpm > 0 else 1e12
+        now_ms = time.time() * 1000.0
+        r = get_redis()
+        if r is not None:
+            try:
+                if self._script is None or self._script_client is not r:
+                    self._script = r.register_script(_TAKE_LUA)
+                    self._script_client = r
+                return int(self._script(
+                    keys=[f"{self.prefix}:{model}:rpm", f"{self.prefix}:{model}:tpm"],
+                    args=[now_ms, rpm_cap, tpm_cap, need, reserve],
+                ))
+            except Exception as e:
+                mark_redis_failed(e)
+        return self._local.take(model, now_ms, rpm_cap, tpm_cap, need, reserve)
+
+    def _record(self, priority: str, waited: float, rejected: bool = False) -> None:
+        with self._lock:
+            s = self._stats[priority]
+            if rejected:
+                s["rejected"] += 1
+                return
+            s["acquired"] += 1
+            if waited > 0:
+                s["waited"] += 1
+                s["wait_sec_total"] += waited
+                s["wait_sec_max"] = max(s["wait_sec_max"], waited)
+            self._recent_waits[priority].append(waited)
+
+    # ---------------- 公開 API ----------------
+    def acquire(self, model: str, tokens: int) -> float:
+        """
+        model のバケットから 1 リクエスト + tokens を取得するまで待つ。
+        戻り値は待った秒数。取得できなければ GeminiRateLimited。
+        """
+        rpm = _model_limit("RPM", model)
+        tpm = _model_limit("TPM", model)
+        if rpm <= 0 and tpm <= 0:
+            return 0.0
+
+        priority = current_priority()
+        if priority not in self._waiting:
+            priority = BACKGROUND
+        is_bg = priority == BACKGROUND
+        reserve = _env_float("GEMINI_RL_RESERVE", 0.2) if is_bg else 0.0
+        max_wait = _env_float(
+            "GEMINI_RL_MAX_WAIT_BACKGROUND" if is_bg else "GEMINI_RL_MAX_WAIT_INTERACTIVE",
+            120.0 if is_bg else 10.0,
+        )
+        max_queue = _env_int("GEMINI_RL_MAX_QUEUE", 32)
+
+        with self._lock:
+            if self._waiting[priority] >= max_queue:
+                self._stats[priority]["rejected"] += 1
+                raise GeminiRateLimited(f"rate limit queue full for {model} ({priority})")
+            self._waiting[priority] += 1
+
+        started = time.monotonic()
+        slept = False
+        try:
+            while True:
+                # 同一プロセス内では interactive の待ちがある間 background は取りに行かない
+                if is_bg:
+                    with self._cond:
+                        while self._waiting[INTERACTIVE] > 0 and time.monotonic() - started < max_wait:
+                            self._cond.wait(timeout=0.5)
+                            slept = True
+
+                wait_ms = self._take(model, rpm, tpm, tokens, reserve)
+                waited = time.monotonic() - started if slept else 0.0
+                if wait_ms <= 0:
+                    self._record(priority, waited)
+                    if waited >= 1.0:
+                        logger.info(f"[Gemini RL] {model} {priority} waited {waited:.1f}s")
+                    return waited
+
+                if waited + wait_ms / 1000.0 > max_wait:
+                    self._record(priority, waited, rejected=True)
+                    raise GeminiRateLimited(
+                        f"rate limit wait for {model} would exceed {max_wait:.0f}s ({priority})"
+                    )
+                time.sleep(min(wait_ms / 1000.0, 1.0))
+                slept = True
+        finally:
+            with self._cond:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = {}
+            for p, s in self._stats.items():
+                waits = sorted(self._recent_waits[p])
+                out[p] = dict(s)
+                out[p]["queue_depth"] = self._waiting[p]
+                out[p]["wait_sec_p95"] = waits[int(0.95 * (len(waits) - 1))] if waits else 0.0
+        return out
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,64 @@
+# services/redis_client.py
+"""
+キャッシュ・共有状態用の Redis 接続（任意）
+
+- REDIS_URL / VALKEY_URL が未設定、または接続できない場合は None を返す
+- 接続失敗後は一定時間再試行しない（リクエストごとにタイムアウトを待たないため）
+- redis-py の ConnectionPool は PID を見て fork 後に作り直されるため、そのまま共有してよい
+"""
+import os
+import time
+import logging
+import threading
+from typing import Optional
+
+import redis as redis_lib
+
+logger = logging.getLogger(__name__)
+
+_RETRY_AFTER_SEC = 30.0
+
+_client: Optional[redis_lib.Redis] = None
+_failed_at: float = 0.0
+_lock = threading.Lock()
+
+
+def get_redis() -> Optional[redis_lib.Redis]:
+    """共有 Redis クライアント（decode_responses=True）。使えなければ None。"""
+    global _client, _failed_at
+    if _client is not None:
+        return _client
+
+    redis_url = os.getenv("REDIS_URL") or os.getenv("VALKEY_URL")
+    if not redis_url:
+        return None
+    if _failed_at and time.monotonic() - _failed_at < _RETRY_AFTER_SEC:
+        return None
+
+    with _lock:
+        if _client is not None:
+            return _client
+        try:
+            conn = redis_lib.from_url(
+                redis_url,
+                socket_connect_timeout=1,
+                socket_timeout=1,
+                decode_responses=True,
+            )
+            conn.ping()
+            _client = conn
+            _failed_at = 0.0
+            logger.info("[Redis] shared client connected")
+        except Exception as e:
+            _failed_at = time.monotonic()
+            logger.warning(f"[Redis] unavailable, using in-process fallback for {_RETRY_AFTER_SEC:.0f}s: {e}")
+            return None
+    return _client
+
+
+def mark_redis_failed(e: Exception) -> None:
+    """操作中の接続エラーを記録し、しばらく Redis を使わないようにする"""
+    global _client, _failed_at
+    logger.warning(f"[Redis] operation failed, disabling for {_RETRY_AFTER_SEC:.0f}s: {e}")
+    _client = None
+    _failed_at = time.monotonic()
@@ -1,15 +1,28 @@
 import os
-import time
+import re
+import heapq
 import logging
+import unicodedata
 import requests
-from typing import List, Dict, Any, Optional
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, FrozenSet, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
+from services.book_catalog import upsert_results
+from services.book_search_planner import BookSearchPlanner
+from services.fetch_executor import fetch_executor
 from services.google_books_client import GoogleBooksClient
+from services.http_pool import http_timeout, search_transport
+from services.metrics import registry
 from services.ndl_client import NDLClient
+from services.page_fetcher import fetch_page_text
+from services.ranking import select_fetch_targets
+from services.search_cache import cached_search
 
 logger = logging.getLogger(__name__)
 
+# WebFetch の並列取得を待つ上限（秒）。1ページのタイムアウト 10 秒＋ホスト枠の待ち時間
+WEBFETCH_FANOUT_TIMEOUT_SEC = float(os.getenv("WEBFETCH_FANOUT_TIMEOUT_SEC", "25"))
+
 
 class SearchError(Exception):
     pass
@@ -26,10 +39,177 @@ def _normalize(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     return norm
 
 
+# -------------------------------
+# 重複排除（URL の正規化 + 本文の近似重複）
+# -------------------------------
+# 計測・広告用のクエリパラメータ（utm_* は接頭辞で判定）
+_TRACKING_PARAMS = frozenset({
+    "gclid", "dclid", "fbclid", "yclid", "msclkid", "igshid", "mc_cid", "mc_eid", "_ga", "_gl",
+    "spm", "scid", "rafcid", "icm_acid", "icm_agid", "icm_cid", "l-id", "s-id", "iasid",
+})
+# Amazon の検索経路・アフィリエイト用パラメータ（他サイトでは意味を持つことがあるので Amazon だけ）
+_AMAZON_PARAMS = frozenset({
+    "ref", "ref_", "tag", "linkcode", "linkid", "camp", "creative", "creativeasin", "ascsubtag",
+    "pd_rd_i", "pd_rd_r", "pd_rd_w", "pd_rd_wg", "pf_rd_p", "pf_rd_r", "pf_rd_s", "pf_rd_t", "pf_rd_i",
+    "psc", "qid", "sr", "keywords", "crid", "sprefix", "th", "_encoding", "content-id", "smid",
+})
+# モバイル版・AMP 版のホスト接頭辞（デスクトップ版と同じページとして扱う）
+_HOST_PREFIXES = ("www.", "m.", "mobile.", "sp.", "amp.")
+_AMAZON_ASIN_RE = re.compile(r"/(?:dp|gp/product|gp/aw/d|exec/obidos/asin|o/asin|product)/([A-Z0-9]{10})(?:[/?]|$)", re.I)
+_AMP_PATH_RE = re.compile(r"(/amp/?|\.amp|/amp\.html)$", re.I)
+
+_SHINGLE = 3          # 文字 n-gram（日本語は単語区切りがないので文字単位）
+_SKETCH_SIZE = 64     # bottom-k MinHash のサイズ
+_MIN_CONTENT_CHARS = 60
+_MAX_CONTENT_CHARS = 3000
+
+
+def dedupe_enabled() -> bool:
+    return os.getenv("SEARCH_DEDUPE", "true").lower() == "true"
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    同じページを指す URL を1つの表記にそろえる（重複判定のキー。リンク先としては元の URL を使う）
+
+    - スキーム・ホストを小文字に、www. / m. / sp. / amp. などの接頭辞とデフォルトポート・#fragment を除去
+    - 計測用パラメータ（utm_*, gclid など。Amazon は ref/tag/pd_rd_* も）を除去し、残りをソート
+    - Amazon の商品ページは /dp/<ASIN> に（/gp/product/, /exec/obidos/ASIN/, 商品名付きパスも同じ）
+    - 末尾の /amp・index.html・スラッシュを除去
+    """
+    if not url:
+        return ""
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return url.strip()
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return url.strip()
+
+    host = parts.hostname.lower()
+    for prefix in _HOST_PREFIXES:
+        if host.startswith(prefix) and host.count(".") >= 2:
+            host = host[len(prefix):]
+            break
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+
+    path = parts.path or "/"
+    if "amazon." in host:
+        m = _AMAZON_ASIN_RE.search(path)
+        if m:
+            return f"https://{host}/dp/{m.group(1).upper()}"
+    path = _AMP_PATH_RE.sub("", path)
+    if path.endswith("/index.html") or path.endswith("/index.htm"):
+        path = path.rsplit("/", 1)[0]
+    path = path.rstrip("/") or "/"
+
+    drop = _TRACKING_PARAMS | _AMAZON_PARAMS if "amazon." in host else _TRACKING_PARAMS
+    query = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith("utm_") and k.lower() not in drop
+    ]
+    return urlunsplit(("https", host, path, urlencode(sorted(query)), ""))
+
+
+def content_sketch(text: str) -> Optional[FrozenSet[int]]:
+    """
+    本文の近似重複判定用スケッチ（文字 3-gram の bottom-k MinHash）
+
+    NFKC・小文字化し、空白と記号を除いてから shingle を取る。短すぎる本文は判定しない（None）。
+    ハッシュは組み込み hash()（プロセス内で比較するだけなので十分）。
+    """
+    norm = unicodedata.normalize("NFKC", (text or "")[:_MAX_CONTENT_CHARS]).lower()
+    norm = "".join(ch for ch in norm if ch.isalnum())
+    if len(norm) < _MIN_CONTENT_CHARS:
+        return None
+    shingles = {norm[i:i + _SHINGLE] for i in range(len(norm) - _SHINGLE + 1)}
+    return frozenset(heapq.nsmallest(_SKETCH_SIZE, (hash(sh) for sh in shingles)))
+
+
+def sketch_similarity(a: FrozenSet[int], b: FrozenSet[int]) -> float:
+    """bottom-k スケッチから Jaccard 係数を推定する"""
+    k = min(_SKETCH_SIZE, len(a | b))
+    if k == 0:
+        return 0.0
+    union_bottom = heapq.nsmallest(k, a | b)
+    both = a & b
+    return sum(1 for h in union_bottom if h in both) / k
+
+
+def _result_link(r: Dict[str, Any]) -> str:
+    return r.get("url") or r.get("link") or r.get("info_link") or ""
+
+
+def dedupe_results(results: List[Dict[str, Any]], similarity: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    検索結果の重複排除（先に出てきたものを残す）
+
+    1. 正規化した URL が同じもの（Amazon の /dp/ と /gp/product/、計測パラメータ違い、モバイル版）
+    2. enriched_content（無ければ snippet）が近似重複のもの（転載記事・まとめサイトのコピー）
+       類似度の閾値は SEARCH_DEDUPE_SIMILARITY（既定 0.8）
+
+    落とした側にしか無いフィールド（enriched_content など）は残す側へ引き継ぐ。
+    ユーザー提供資料（source == "user"）は落とさない。
+    """
+    if not results or not dedupe_enabled():
+        return list(results or [])
+    if similarity is None:
+        try:
+            similarity = float(os.getenv("SEARCH_DEDUPE_SIMILARITY", "0.8"))
+        except ValueError:
+            similarity = 0.8
+
+    kept: List[Dict[str, Any]] = []
+    by_url: Dict[str, Dict[str, Any]] = {}
+    sketches: List[tuple] = []  # (スケッチ, 残した結果)
+    dropped = {"url": 0, "content": 0}
+
+    for r in results:
+        is_user = r.get("source") == "user"
+        link = _result_link(r)
+        key = canonicalize_url(link) if link else ""
+        if key and key in by_url and not is_user:
+            _merge_missing(by_url[key], r)
+            dropped["url"] += 1
+            continue
+
+        sketch = content_sketch(r.get("enriched_content") or r.get("snippet") or "")
+        if sketch is not None and not is_user:
+            dup = next((k for s, k in sketches if sketch_similarity(sketch, s) >= similarity), None)
+            if dup is not None:
+                _merge_missing(dup, r)
+                dropped["content"] += 1
+                logger.info(f"[Search Dedupe] near-duplicate of {_result_link(dup)[:60]}: {link[:60]}")
+                continue
+
+        item = dict(r)
+        kept.append(item)
+        if key:
+            by_url.setdefault(key, item)
+        if sketch is not None:
+            sketches.append((sketch, item))
+
+    for reason, n in dropped.items():
+        if n:
+            registry.inc("search_dedupe_dropped_total", {"reason": reason}, n,
+                         help_text="Search results dropped as duplicates before prompting")
+    return kept
+
+
+def _merge_missing(keep: Dict[str, Any], drop: Dict[str, Any]) -> None:
+    for k, v in drop.items():
+        if v and not keep.get(k):
+            keep[k] = v
+
+
 class SearchClient:
     """
     検索クライアント（堅牢化＋鮮度対応）
-    - タイムアウト、指数バックオフの簡易リトライ
+    - タイムアウト（接続/読み取りを分離）、指数バックオフの簡易リトライ
+    - プロバイダごとの keep-alive 接続プールを共有（services/http_pool.py）
+    - 結果はプロバイダ・正規化クエリ・鮮度バケット単位でキャッシュ（services/search_cache.py）
+    - 正規化 URL と本文の近似重複で重複排除（dedupe_results）
     - recency_days を Google CSE の dateRestrict に反映（例: d1 = 24時間以内）
     - gl（国ターゲット）/ lr（言語）指定
     """
@@ -57,6 +237,21 @@ class SearchClient:
         if not (query or "").strip():
             raise SearchError("query is required")
 
+        return dedupe_results(cached_search(
+            self.provider, query, top_k,
+            lambda: self._search_uncached(query, top_k, recency_days, gl, lr, extra_params),
+            recency_days=recency_days, gl=gl, lr=lr, extra_params=extra_params,
+        ))
+
+    def _search_uncached(
+        self,
+        query: str,
+        top_k: int,
+        recency_days: Optional[int],
+        gl: Optional[str],
+        lr: Optional[str],
+        extra_params: Optional[Dict[str, Any]],
+    ) -> List[Dict[str, Any]]:
         if self.provider == "google_cse":
             return self._google_cse(query, top_k, recency_days, gl, lr, extra_params or {})
         elif self.provider == "serpapi":
@@ -77,143 +272,27 @@ class SearchClient:
         author: Optional[str] = None,
         top_k: int = 10,
         layer1_threshold: int = 5,
-        layer2_threshold: int = 3,
     ) -> List[Dict[str, Any]]:
         """
-        書籍専用検索：3層の段階的検索戦略で信頼性と網羅性を両立
+        書籍専用検索（Web 検索のみ。書籍 API と WebFetch は使わない）
 
-        Layer 1: 信頼できるサイトを個別に検索（高信頼性）
-        Layer 2: サイト制限なしで著者+タイトル+品質キーワード（網羅性向上）
-        Layer 3: 著者名フォールバック（最終手段）
+        信頼できるサイトの個別検索と書評キーワード検索を同時に実行する
+        （services/book_search_planner.py）。
+        以前の Layer 3（著者名だけのフォールバック検索）は行わない。
 
         Args:
             book_title: 書籍タイトル
             author: 著者名（任意）
             top_k: 取得する検索結果数
-            layer1_threshold: Layer 2に移行する最小結果数
-            layer2_threshold: Layer 3に移行する最小結果数
+            layer1_threshold: この件数の信頼ドメインの結果がそろったら打ち切る
 
         Returns:
             正規化された検索結果のリスト
         """
         if not (book_title or "").strip():
             raise SearchError("book_title is required")
-
-        # 信頼できるドメインリストを取得
-        try:
-            from app.constants import TRUSTED_BOOK_SOURCES_DOMAINS, USE_TRUSTED_DOMAINS
-            trusted_domains = TRUSTED_BOOK_SOURCES_DOMAINS if USE_TRUSTED_DOMAINS else []
-        except ImportError:
-            logger.warning("app.constants not found, using hardcoded trusted domains")
-            trusted_domains = [
-                "amazon.co.jp",
-                "hanmoto.com",
-                "books.rakuten.co.jp",
-                "bookmeter.com",
-                "booklog.jp",
-                "honz.jp",
-            ]
-
-        all_results = []
-        seen_urls = set()
-
-        # ヘルパー関数: 重複を避けて結果を追加
-        def _add_unique(results: List[Dict[str, Any]]) -> int:
-            added = 0
-            for r in results:
-                url = r.get("info_link") or r.get("link")
-                if url and url not in seen_urls:
-                    seen_urls.add(url)
-                    all_results.append(r)
-                    added += 1
-            return added
-
-        # --- Layer 1: 信頼できるサイトを個別に検索 ---
-        logger.info(f"[Book Search Layer 1] Searching trusted sites for: {book_title}")
-
-        # 各サイトを並列検索（OR構文を使わず個別に）
-        layer1_queries = []
-        for domain in trusted_domains[:3]:  # 上位3サイト（Amazon, 版元, 楽天）
-            query = f"{book_title}"
-            if author:
-                query += f" {author}"
-            layer1_queries.append((query, domain))
-
-        with ThreadPoolExecutor(max_workers=(len(layer1_queries) or 1)) as executor:
-            futures = {
-                executor.submit(
-                    self.search,
-                    query=q,
-                    top_k=3,
-                    recency_days=None,
-                    gl="jp",
-                    lr="lang_ja",
-                    extra_params={"siteSearch": domain},
-                ): (q, domain) for q, domain in layer1_queries
-            }
-
-            for future in as_completed(futures):
-                q, domain = futures[future]
-                try:
-                    results = future.result()
-                    added = _add_unique(results)
-                    logger.info(f"[Layer 1] {domain}: {len(results)} results ({added} new)")
-                except Exception as e:
-                    logger.warning(f"[Layer 1] {domain} failed: {e}")
-
-        logger.info(f"[Layer 1] Total unique results: {len(all_results)}")
-
-        # Layer 1で十分な結果が得られた場合は終了
-        if len(all_results) >= layer1_threshold:
-            return all_results[:top_k]
-
-        # --- Layer 2: サイト制限なしで品質キーワード検索 ---
-        logger.info(f"[Book Search Layer 2] Broadening search (Layer 1 had {len(all_results)} results)")
-
-        layer2_query = f"{book_title}"
-        if author:
-            layer2_query += f" {author}"
-        layer2_query += " (書評 OR レビュー OR 要約 OR 内容紹介)"
-
-        try:
-            layer2_results = self.search(
-                query=layer2_query,
-                top_k=10,
-                recency_days=None,
-                gl="jp",
-                lr="lang_ja",
-            )
-            added = _add_unique(layer2_results)
-            logger.info(f"[Layer 2] Added {added} new results (from {len(layer2_results)} total)")
-        except Exception as e:
-            logger.warning(f"[Layer 2] Broad search failed: {e}")
-
-        logger.info(f"[Layer 2] Total unique results: {len(all_results)}")
-
-        # Layer 2で十分な結果が得られた場合は終了
-        if len(all_results) >= layer2_threshold:
-            return all_results[:top_k]
-
-        # --- Layer 3: 著者名フォールバック ---
-        if author:
-            logger.info(f"[Book Search Layer 3] Author fallback: {author}")
-            layer3_query = f"{author} 著書 書籍"
-
-            try:
-                layer3_results = self.search(
-                    query=layer3_query,
-                    top_k=10,
-                    recency_days=None,
-                    gl="jp",
-                    lr="lang_ja",
-                )
-                added = _add_unique(layer3_results)
-                logger.info(f"[Layer 3] Added {added} new results (from {len(layer3_results)} total)")
-            except Exception as e:
-                logger.warning(f"[Layer 3] Author fallback failed: {e}")
-
-        logger.info(f"[Final] Total unique results: {len(all_results)}")
-        return all_results[:top_k]
+        planner = BookSearchPlanner(self, enough_sources=layer1_threshold)
+        return planner.run(book_title, author=author, top_k=top_k, max_fetch=0, include_book_apis=False)
 
     # ---------------- Providers ----------------
     def _google_cse(
@@ -250,7 +329,7 @@ class SearchClient:
             params[k] = v
 
         url = "https://www.googleapis.com/customsearch/v1"
-        data = self._http_get_json(url, params)
+        data = self._http_get_json(url, params, "google_cse")
         items = (data or {}).get("items", [])[:top_k]
         return _normalize(items)
 
@@ -284,17 +363,19 @@ class SearchClient:
             params["hl"] = lr.replace("lang_", "")
 
         url = "https://serpapi.com/search.json"
-        data = self._http_get_json(url, params)
+        data = self._http_get_json(url, params, "serpapi")
         organic = (data or {}).get("organic_results", [])[:top_k]
         items = [{"title": o.get("title"), "url": o.get("link"), "snippet": o.get("snippet","")} for o in organic]
         return _normalize(items)
 
     def _google_books(self, query: str, top_k: int):
         results = self.google_books_client.search_books(query, max_results=top_k)
+        upsert_results("google_books", results)
         return results
 
     def _ndl(self, query: str, top_k: int):
         results = self.ndl_client.search_books(query, max_records=top_k)
+        upsert_results("ndl", results)
         return results
 
     def search_book_v2(
@@ -306,10 +387,9 @@ class SearchClient:
         """
         Hybrid書籍検索戦略：構造化データ + Web検索 + コンテンツ取得
 
-        Layer 1: Google Books API（構造化メタデータ）
-        Layer 2: NDL API（国会図書館公式データ）
-        Layer 3: 信頼できるドメインのWeb検索（書評・レビュー）
-        Layer 4: WebFetchでコンテンツ強化（上位3件）
+        Google Books API・NDL API・信頼できるドメインの Web 検索・書評キーワード検索を
+        1つの期限の中で同時に実行し、信頼ドメインの結果が届いた時点で WebFetch を始める
+        （services/book_search_planner.py）。
 
         Args:
             book_title: 書籍タイトル
@@ -321,215 +401,67 @@ class SearchClient:
         """
         if not (book_title or "").strip():
             raise SearchError("book_title is required")
+        return BookSearchPlanner(self).run(book_title, author=author, top_k=top_k, max_fetch=3)
 
-        all_results = []
-        seen_urls = set()
-
-        def _add_unique(results: List[Dict[str, Any]]) -> int:
-            added = 0
-            for r in results:
-                url = r.get("info_link") or r.get("link") or r.get("url")
-                if url and url not in seen_urls:
-                    seen_urls.add(url)
-                    all_results.append(r)
-                    added += 1
-            return added
-
-        # --- Layer 1: Google Books API（構造化データ） ---
-        # Lazy initialization with failure caching
-        if not hasattr(self, '_google_books_init_failed'):
-            self._google_books_init_failed = False
-
-        if not self._google_books_init_failed and (not hasattr(self, 'google_books_client') or self.google_books_client is None):
+    def _get_google_books_client(self) -> Optional[GoogleBooksClient]:
+        """Google Books クライアントを遅延初期化（失敗したら以後は試さない）"""
+        if getattr(self, "_google_books_init_failed", False):
+            return None
+        if getattr(self, "google_books_client", None) is None:
             try:
                 self.google_books_client = GoogleBooksClient(api_key=self.env.get("GOOGLE_API_KEY"))
-                logger.info("[Book Search V2] Google Books client initialized")
+                logger.info("[Book Search] Google Books client initialized")
             except Exception as e:
-                logger.warning(f"[Book Search V2] Google Books client init failed: {e}")
+                logger.warning(f"[Book Search] Google Books client init failed: {e}")
                 self.google_books_client = None
                 self._google_books_init_failed = True  # Cache failure
+        return self.google_books_client
 
-        logger.info(f"[Book Search V2 Layer 1] Searching Google Books for: {book_title}")
-        if self.google_books_client and not self._google_books_init_failed:
-            query = f"{book_title}"
-            if author:
-                query += f" {author}"
-            try:
-                google_books_results = self.google_books_client.search_books(query, max_results=top_k)
-                added = _add_unique(google_books_results)
-                logger.info(f"[Layer 1] Google Books: {len(google_books_results)} results ({added} new)")
-            except Exception as e:
-                logger.warning(f"[Layer 1] Google Books failed: {e}")
-        else:
-            logger.warning("[Layer 1] Google Books client not available, skipping")
-
-        # --- Layer 2: NDL API（国会図書館） ---
-        # Lazy initialization with failure caching
-        if not hasattr(self, '_ndl_init_failed'):
-            self._ndl_init_failed = False
-
-        if not self._ndl_init_failed and (not hasattr(self, 'ndl_client') or self.ndl_client is None):
+    def _get_ndl_client(self) -> Optional[NDLClient]:
+        """NDL クライアントを遅延初期化（失敗したら以後は試さない）"""
+        if getattr(self, "_ndl_init_failed", False):
+            return None
+        if getattr(self, "ndl_client", None) is None:
             try:
                 self.ndl_client = NDLClient()
-                logger.info("[Book Search V2] NDL client initialized")
+                logger.info("[Book Search] NDL client initialized")
             except Exception as e:
-                logger.warning(f"[Book Search V2] NDL client init failed: {e}")
+                logger.warning(f"[Book Search] NDL client init failed: {e}")
                 self.ndl_client = None
                 self._ndl_init_failed = True  # Cache failure
+        return self.ndl_client
 
-        logger.info(f"[Book Search V2 Layer 2] Searching NDL for: {book_title}")
-        if self.ndl_client and not self._ndl_init_failed:
-            try:
-                ndl_results = self.ndl_client.search_books(book_title, max_records=top_k)
-                added = _add_unique(ndl_results)
-                logger.info(f"[Layer 2] NDL: {len(ndl_results)} results ({added} new)")
-            except Exception as e:
-                logger.warning(f"[Layer 2] NDL failed: {e}")
-        else:
-            logger.warning("[Layer 2] NDL client not available, skipping")
+    def _fetch_book_content(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """書籍検索結果1件の WebFetch（enriched_content を付けたコピーを返す。失敗時は元の結果）"""
+        url = result.get("url") or result.get("link") or result.get("info_link") or ""
+        if not url:
+            return result
 
-        # --- Layer 3: 信頼できるドメインでのWeb検索（並列実行） ---
         try:
-            from app.constants import TRUSTED_BOOK_SOURCES_DOMAINS, USE_TRUSTED_DOMAINS
-            if USE_TRUSTED_DOMAINS:
-                logger.info(f"[Book Search V2 Layer 3] Searching trusted web domains in parallel")
-                base_query = f'"{book_title}"'
-                if author:
-                    base_query += f' "{author}"'
-                layer3_queries = [f"{base_query} site:{domain}" for domain in TRUSTED_BOOK_SOURCES_DOMAINS]
-                with ThreadPoolExecutor(max_workers=len(layer3_queries)) as executor:
-                    future_to_query = {executor.submit(self.search, q, top_k=2, gl="jp", lr="lang_ja"): q for q in layer3_queries}
-                    for future in as_completed(future_to_query):
-                        query = future_to_query[future]
-                        try:
-                            results = future.result()
-                            added = _add_unique(results)
-                            logger.info(f"[Layer 3] Query '{query}' found {len(results)} results ({added} new).")
-                        except Exception as exc:
-                            logger.warning(f"[Layer 3] Query '{query}' generated an exception: {exc}")
+            # キャッシュ付きのHTML取得（タイムアウト10秒。同一URLの同時取得は1回にまとめる）
+            text = fetch_page_text(url, user_agent="Mozilla/5.0 (compatible; BookSummaryBot/1.0)", timeout=10)
+            if text is not None:
+                # 最大3000文字に制限（書籍情報は長めに）
+                enriched_text = text[:3000] if len(text) > 3000 else text
+
+                result_copy = result.copy()
+                result_copy["enriched_content"] = enriched_text
+                # URLフィールドを正規化
+                if "url" not in result_copy:
+                    result_copy["url"] = url
+                logger.info(f"WebFetch success for {url[:60]}... (fetched {len(enriched_text)} chars)")
+                return result_copy
             else:
-                logger.info("[Book Search V2 Layer 3] Skipped trusted-domain search (disabled)")
-        except Exception as e:
-            logger.warning(f"[Layer 3] Web search failed: {e}")
-
-        logger.info(f"[Book Search V2] Total results before WebFetch: {len(all_results)}")
-
-        # --- Layer 4: WebFetchでコンテンツ強化 ---
-        if all_results:
-            logger.info(f"[Book Search V2 Layer 4] Enriching top results with WebFetch")
-            all_results = self._enrich_book_search_results(all_results, max_fetch=3)
-
-        return all_results[:top_k]
-
-    def _enrich_book_search_results(
-        self,
-        search_results: List[Dict[str, Any]],
-        max_fetch: int = 3,
-    ) -> List[Dict[str, Any]]:
-        """
-        書籍検索結果を WebFetch で強化（実際のHTMLコンテンツを取得）
-
-        Args:
-            search_results: 検索結果リスト
-            max_fetch: WebFetch を実行する最大件数（デフォルト3件）
-
-        Returns:
-            enriched_content フィールドを追加した検索結果
-        """
-        import requests
-        import re
-
-        # 信頼できるドメインリストを取得
-        try:
-            from app.constants import TRUSTED_BOOK_SOURCES_DOMAINS, USE_TRUSTED_DOMAINS
-            trusted_domains = TRUSTED_BOOK_SOURCES_DOMAINS if USE_TRUSTED_DOMAINS else []
-        except ImportError:
-            trusted_domains = [
-                "amazon.co.jp", "hanmoto.com", "books.rakuten.co.jp",
-                "bookmeter.com", "booklog.jp", "honz.jp"
-            ]
-
-        enriched_results = []
-
-        # 信頼できるドメインを優先的に選択
-        fetch_targets = []
-        if trusted_domains:
-            for r in search_results:
-                url = r.get("url") or r.get("link") or r.get("info_link") or ""
-                if any(domain in url for domain in trusted_domains):
-                    fetch_targets.append(r)
-                    if len(fetch_targets) >= max_fetch:
-                        break
-
-        # 信頼できるドメインが不足している場合は他の結果も追加
-        if len(fetch_targets) < max_fetch:
-            for r in search_results:
-                if r not in fetch_targets:
-                    fetch_targets.append(r)
-                    if len(fetch_targets) >= max_fetch:
-                        break
-
-        def fetch_content(result: Dict[str, Any]) -> Dict[str, Any]:
-            """単一URLのコンテンツを取得"""
-            url = result.get("url") or result.get("link") or result.get("info_link") or ""
-            if not url:
-                return result
-
-            try:
-                # 簡易的なHTML取得（タイムアウト10秒）
-                response = requests.get(url, timeout=10, headers={
-                    "User-Agent": "Mozilla/5.0 (compatible; BookSummaryBot/1.0)"
-                })
-                if response.status_code == 200:
-                    html = response.text
-                    # scriptとstyleタグを除去
-                    html = re.sub(r'<script[^>]*>.*?</script>', '', html, flags=re.DOTALL | re.IGNORECASE)
-                    html = re.sub(r'<style[^>]*>.*?</style>', '', html, flags=re.DOTALL | re.IGNORECASE)
-                    # HTMLタグを除去
-                    text = re.sub(r'<[^>]+>', ' ', html)
-                    # 連続する空白を1つに
-                    text = re.sub(r'\s+', ' ', text).strip()
-                    # 最大3000文字に制限（書籍情報は長めに）
-                    enriched_text = text[:3000] if len(text) > 3000 else text
-
-                    result_copy = result.copy()
-                    result_copy["enriched_content"] = enriched_text
-                    # URLフィールドを正規化
-                    if "url" not in result_copy:
-                        result_copy["url"] = url
-                    logger.info(f"WebFetch success for {url[:60]}... (fetched {len(enriched_text)} chars)")
-                    return result_copy
-                else:
-                    logger.warning(f"WebFetch failed for {url}: HTTP {response.status_code}")
-                    return result
-            except Exception as e:
-                logger.warning(f"WebFetch failed for {url}: {e}")
                 return result
-
-        # 並列でWebFetch実行
-        with ThreadPoolExecutor(max_workers=min(3, len(fetch_targets))) as executor:
-            futures = {executor.submit(fetch_content, r): r for r in fetch_targets}
-            for future in as_completed(futures):
-                try:
-                    enriched_result = future.result()
-                    enriched_results.append(enriched_result)
-                except Exception as e:
-                    logger.error(f"WebFetch thread error: {e}")
-                    # エラー時は元の結果をそのまま追加
-                    original = futures[future]
-                    enriched_results.append(original)
-
-        # WebFetch対象外の結果も追加
-        for r in search_results:
-            if r not in fetch_targets:
-                enriched_results.append(r)
-
-        return enriched_results
+        except Exception as e:
+            logger.warning(f"WebFetch failed for {url}: {e}")
+            return result
 
     def _enrich_search_results_with_webfetch(
         self,
         search_results: List[Dict[str, Any]],
         max_fetch: int = 3,
+        query: str = "",
     ) -> List[Dict[str, Any]]:
         """
         一般検索結果を WebFetch で強化（実際のHTMLコンテンツを取得）
@@ -538,15 +470,13 @@ class SearchClient:
         Args:
             search_results: 検索結果リスト
             max_fetch: WebFetch を実行する最大件数（デフォルト3件）
+            query: 取得対象を関連度で選ぶためのクエリ（空なら先頭から）
 
         Returns:
             enriched_content フィールドを追加した検索結果
         """
-        import requests
-        import re
-
         enriched_results = []
-        fetch_targets = search_results[:max_fetch]
+        fetch_targets = select_fetch_targets(query, search_results, max_fetch)
 
         def fetch_content(result: Dict[str, Any]) -> Dict[str, Any]:
             """単一URLのコンテンツを取得"""
@@ -555,19 +485,9 @@ class SearchClient:
                 return result
 
             try:
-                # 簡易的なHTML取得（タイムアウト10秒）
-                response = requests.get(url, timeout=10, headers={
-                    "User-Agent": "Mozilla/5.0 (compatible; DeepResearchBot/1.0)"
-                })
-                if response.status_code == 200:
-                    html = response.text
-                    # scriptとstyleタグを除去
-                    html = re.sub(r'<script[^>]*>.*?</script>', '', html, flags=re.DOTALL | re.IGNORECASE)
-                    html = re.sub(r'<style[^>]*>.*?</style>', '', html, flags=re.DOTALL | re.IGNORECASE)
-                    # HTMLタグを除去
-                    text = re.sub(r'<[^>]+>', ' ', html)
-                    # 連続する空白を1つに
-                    text = re.sub(r'\s+', ' ', text).strip()
+                # キャッシュ付きのHTML取得（タイムアウト10秒。同一URLの同時取得は1回にまとめる）
+                text = fetch_page_text(url, user_agent="Mozilla/5.0 (compatible; DeepResearchBot/1.0)", timeout=10)
+                if text is not None:
                     # 最大2000文字に制限（Deep Research用）
                     enriched_text = text[:2000] if len(text) > 2000 else text
 
@@ -579,24 +499,26 @@ class SearchClient:
                     logger.info(f"[DeepResearch] WebFetch success for {url[:60]}... ({len(enriched_text)} chars)")
                     return result_copy
                 else:
-                    logger.warning(f"[DeepResearch] WebFetch failed for {url}: HTTP {response.status_code}")
                     return result
             except Exception as e:
                 logger.warning(f"[DeepResearch] WebFetch failed for {url}: {e}")
                 return result
 
-        # 並列でWebFetch実行
-        with ThreadPoolExecutor(max_workers=min(3, len(fetch_targets))) as executor:
-            futures = {executor.submit(fetch_content, r): r for r in fetch_targets}
-            for future in as_completed(futures):
-                try:
-                    enriched_result = future.result()
-                    enriched_results.append(enriched_result)
-                except Exception as e:
-                    logger.error(f"[DeepResearch] WebFetch thread error: {e}")
-                    # エラー時は元の結果をそのまま追加
-                    original = futures[future]
-                    enriched_results.append(original)
+        # 並列でWebFetch実行（プロセス共通のエグゼキュータ。ホストごとの同時接続数を制限）
+        for original, future in fetch_executor().fan_out(
+            fetch_content,
+            fetch_targets,
+            host_of=lambda r: r.get("url") or r.get("link") or "",
+            timeout=WEBFETCH_FANOUT_TIMEOUT_SEC,
+            label="webfetch",
+        ):
+            try:
+                enriched_result = future.result()
+                enriched_results.append(enriched_result)
+            except Exception as e:
+                logger.error(f"[DeepResearch] WebFetch thread error: {e}")
+                # エラー時は元の結果をそのまま追加
+                enriched_results.append(original)
 
         # WebFetch対象外の結果も追加
         for r in search_results:
@@ -606,34 +528,22 @@ class SearchClient:
         return enriched_results
 
     # ---------------- HTTP helper ----------------
-    def _http_get_json(self, url: str, params: dict) -> dict:
-        last_exc = None
-        for attempt in range(self.retries + 1):
-            try:
-                r = requests.get(url, params=params, timeout=self.timeout)
-                if r.status_code == 429:
-                    raise SearchError("rate limited by provider (429)")
-                if 500 <= r.status_code < 600:
-                    raise SearchError(f"provider 5xx: {r.status_code}")
-                if r.status_code != 200:
-                    raise SearchError(f"http {r.status_code}: {r.text[:200]}")
-                return r.json()
-            except (requests.Timeout, requests.ConnectionError) as e:
-                last_exc = e
-                if attempt < self.retries:
-                    time.sleep(0.6 * (2 ** attempt))  # 0.6s, 1.2s, ...
-                    continue
-                raise SearchError(f"network error: {e}") from e
-            except SearchError as e:
-                last_exc = e
-                if "5xx" in str(e) and attempt < self.retries:
-                    time.sleep(0.6 * (2 ** attempt))
-                    continue
-                raise
-            except Exception as e:
-                last_exc = e
-                raise SearchError(f"unexpected error: {e}") from e
-        if last_exc:
-            raise SearchError(str(last_exc))
-        return {}
-
+    def _http_get_json(self, url: str, params: dict, provider: str) -> dict:
+        try:
+            r = search_transport(provider).get_with_retry(
+                url, retries=self.retries, params=params, timeout=http_timeout(self.timeout)
+            )
+        except (requests.Timeout, requests.ConnectionError) as e:
+            raise SearchError(f"network error: {e}") from e
+        except Exception as e:
+            raise SearchError(f"unexpected error: {e}") from e
+        if r.status_code == 429:
+            raise SearchError("rate limited by provider (429)")
+        if 500 <= r.status_code < 600:
+            raise SearchError(f"provider 5xx: {r.status_code}")
+        if r.status_code != 200:
+            raise SearchError(f"http {r.status_code}: {r.text[:200]}")
+        try:
+            return r.json()
+        except ValueError as e:
+            raise SearchError(f"unexpected error: {e}") from e
@@ -0,0 +1,153 @@
+# services/search_cache.py
+"""
+検索結果キャッシュ（プロセス内 LRU → Redis。services/tiered_cache.py）
+
+- キー = プロバイダ + 正規化クエリ + top_k + gl/lr/extra_params + 鮮度バケット
+- クエリの正規化: NFKC（全角英数・記号を半角へ）、小文字化、空白の連続を1つに、
+  日付表記（2026年10月16日 / 2026/10/16 / 2026-10-16）を ISO 形式にそろえる
+- TTL は recency_days から決まる鮮度バケットごと
+  （1日以内のニュース・天気は1時間、書籍など期間指定なしは数日）
+- 空の結果やエラーはキャッシュしない（一時的な失敗を固定しないため）
+- ヒット数 = プロバイダへの課金対象リクエストを節約した数として metrics に出力
+
+環境変数:
+    SEARCH_CACHE                  true/false（既定 true）
+    SEARCH_CACHE_MAX_ENTRIES      既定 1024
+    SEARCH_CACHE_MAX_BYTES        既定 8MB
+    SEARCH_CACHE_TTL_<BUCKET>     バケット別 TTL 秒（D1 / W1 / M1 / OLDER / ANY / BOOK）
+"""
+import os
+import re
+import json
+import hashlib
+import logging
+import unicodedata
+from typing import Any, Callable, Dict, List, Optional
+
+from services.metrics import registry
+from services.tiered_cache import TieredCache
+
+logger = logging.getLogger(__name__)
+
+# 鮮度バケット → 既定 TTL（秒）
+_BUCKET_TTLS: Dict[str, int] = {
+    "d1": 3600,          # 24時間以内（ニュース・天気）
+    "w1": 6 * 3600,      # 1週間以内
+    "m1": 86400,         # 1か月以内
+    "older": 3 * 86400,  # それより長い期間指定
+    "any": 86400,        # 期間指定なしの一般検索
+    "book": 7 * 86400,   # 書籍 API（Google Books / NDL）
+}
+
+_BOOK_PROVIDERS = ("google_books", "ndl")
+
+search_cache = TieredCache(
+    "search",
+    max_entries=int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "1024")),
+    max_bytes=int(os.getenv("SEARCH_CACHE_MAX_BYTES", str(8 * 1024 * 1024))),
+)
+
+_DATE_RES = (
+    re.compile(r"(\d{4})\s*年\s*(\d{1,2})\s*月\s*(\d{1,2})\s*日"),
+    re.compile(r"\b(\d{4})[/.-](\d{1,2})[/.-](\d{1,2})\b"),
+)
+
+
+def search_cache_enabled() -> bool:
+    return os.getenv("SEARCH_CACHE", "true").lower() == "true"
+
+
+def normalize_query(query: str) -> str:
+    """表記ゆれだけが違うクエリを同じキーにする"""
+    q = unicodedata.normalize("NFKC", query or "").lower()
+    for pattern in _DATE_RES:
+        q = pattern.sub(lambda m: f"{int(m.group(1)):04d}-{int(m.group(2)):02d}-{int(m.group(3)):02d}", q)
+    return re.sub(r"\s+", " ", q).strip()
+
+
+def recency_bucket(provider: str, recency_days: Optional[int]) -> str:
+    if recency_days is None:
+        if provider in _BOOK_PROVIDERS:
+            return "book"
+        return "any"
+    d = max(1, int(recency_days))
+    if d <= 1:
+        return "d1"
+    if d <= 7:
+        return "w1"
+    if d <= 31:
+        return "m1"
+    return "older"
+
+
+def bucket_ttl(bucket: str) -> int:
+    """SEARCH_CACHE_TTL_<BUCKET> で上書き可能（0 で無効）"""
+    env_val = os.getenv(f"SEARCH_CACHE_TTL_{bucket.upper()}")
+    if env_val is not None:
+        try:
+            return int(env_val)
+        except ValueError:
+            pass
+    return _BUCKET_TTLS.get(bucket, 0)
+
+
+def search_cache_key(
+    provider: str,
+    query: str,
+    top_k: int,
+    bucket: str,
+    gl: Optional[str] = None,
+    lr: Optional[str] = None,
+    extra_params: Optional[Dict[str, Any]] = None,
+) -> str:
+    material = json.dumps(
+        {
+            "provider": provider,
+            "q": normalize_query(query),
+            "top_k": int(top_k or 0),
+            "bucket": bucket,
+            "gl": (gl or "").lower(),
+            "lr": lr or "",
+            "extra": {str(k): str(v) for k, v in (extra_params or {}).items()},
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def cached_search(
+    provider: str,
+    query: str,
+    top_k: int,
+    fetch: Callable[[], List[Dict[str, Any]]],
+    recency_days: Optional[int] = None,
+    gl: Optional[str] = None,
+    lr: Optional[str] = None,
+    extra_params: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """キャッシュにあればそれを返し、無ければ fetch() を呼んで保存する"""
+    bucket = recency_bucket(provider, recency_days)
+    ttl = bucket_ttl(bucket)
+    if ttl <= 0 or not search_cache_enabled():
+        return fetch()
+
+    key = search_cache_key(provider, query, top_k, bucket, gl, lr, extra_params)
+    hit = search_cache.get(key)
+    labels = {"provider": provider, "bucket": bucket}
+    if hit is not None:
+        registry.inc("search_cache_total", {**labels, "result": "hit"},
+                     help_text="Search result cache lookups by provider and recency bucket")
+        registry.inc("search_provider_calls_saved_total", {"provider": provider},
+                     help_text="Provider search requests avoided by the result cache")
+        logger.info(f"[Search Cache] hit {provider}/{bucket}: {normalize_query(query)[:60]}")
+        # プロセス内 LRU の値を呼び出し側が書き換えないようにコピーを返す
+        return [dict(r) for r in hit]
+
+    registry.inc("search_cache_total", {**labels, "result": "miss"},
+                 help_text="Search result cache lookups by provider and recency bucket")
+    results = fetch()
+    if results:
+        # 呼び出し側が返した結果を書き換えても、保存した値に波及しないようにコピーを保存する
+        search_cache.set(key, [dict(r) for r in results], ttl)
+    return results
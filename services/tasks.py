@@ -4,6 +4,8 @@ import json
 from app import db
 from app.models import Conversation, Message, ResearchJob
 from datetime import datetime
+from services.rate_limiter import BACKGROUND, gemini_priority
+from services.metrics import gemini_caller
 
 # モックモードの判定
 USE_MOCK = os.getenv("USE_MOCK_GEMINI", "false").lower() == "true"
@@ -36,7 +38,8 @@ def generate_summary_and_title(conversation_id: int):
         convo_dump = [{"role": m.sender, "content": m.content} for m in msgs][-100:]
 
         try:
-            analysis = gemini.analyze_conversation(convo_dump)
+            with gemini_priority(BACKGROUND), gemini_caller("conversation_summary"):
+                analysis = gemini.analyze_conversation(convo_dump)
             new_summary = (analysis.get("summary") or "").strip()
             if new_summary:
                 convo.summary = new_summary
@@ -54,6 +57,62 @@ def generate_summary_and_title(conversation_id: int):
             print(f"[tasks] unexpected error: {e}")
 
 
+def update_conversation_memory(conversation_id: int):
+    """会話のローリングメモリ（古いターンの要約）を進める"""
+    print(f"[tasks] update_conversation_memory({conversation_id})")
+
+    from app import create_app
+    app = create_app()
+
+    with app.app_context():
+        from services.conversation_memory import memory_update_due, update_memory
+
+        if not memory_update_due(conversation_id):
+            return
+
+        gemini = GeminiClient(
+            primary_model=os.getenv("DEFAULT_GEMINI_MODEL", "gemini-1.5-flash"),
+            fallback_model=os.getenv("FALLBACK_GEMINI_MODEL", "gemini-1.5-pro"),
+            api_key=os.getenv("GEMINI_API_KEY")
+        )
+        try:
+            if update_memory(gemini, conversation_id):
+                print(f"[tasks] [OK] memory updated for conversation {conversation_id}")
+        except GeminiFallbackError as e:
+            print(f"[tasks] update_conversation_memory failed: {e}")
+        except Exception as e:
+            db.session.rollback()
+            print(f"[tasks] unexpected error: {e}")
+        finally:
+            db.session.remove()
+
+
+def backfill_conversation_summaries(batch_size: int = 50, concurrency: int = 4, restart: bool = False):
+    """全会話のサマリーを一括で作り直す（管理画面から起動。チェックポイントから再開可能）"""
+    print(f"[tasks] backfill_conversation_summaries(batch_size={batch_size}, concurrency={concurrency}, restart={restart})")
+
+    from app import create_app
+    app = create_app()
+
+    with app.app_context():
+        from services.backfill import run_backfill
+
+        gemini = GeminiClient(
+            primary_model=os.getenv("DEFAULT_GEMINI_MODEL", "gemini-1.5-flash"),
+            fallback_model=os.getenv("FALLBACK_GEMINI_MODEL", "gemini-1.5-pro"),
+            api_key=os.getenv("GEMINI_API_KEY")
+        )
+        try:
+            result = run_backfill(gemini, batch_size, concurrency, restart)
+            print(f"[tasks] [OK] backfill {result['status']}: {result.get('processed', 0)}/{result.get('total', 0)}")
+            return result
+        except Exception as e:
+            print(f"[tasks] [ERROR] backfill failed: {e}")
+            return {"error": str(e)}
+        finally:
+            db.session.remove()
+
+
 def execute_deep_research(job_id: int):
     """
     Deep Research タスク（RQワーカーで実行）
@@ -92,8 +151,9 @@ def execute_deep_research(job_id: int):
             job_record.status = "processing"
             db.session.commit()
 
-            # Deep Research実行
-            result = engine.execute(query, job=rq_job)
+            # Deep Research実行（チャットより低い優先度でレート制限を取得）
+            with gemini_priority(BACKGROUND):
+                result = engine.execute(query, job=rq_job)
 
             # 成功: データベースを更新
             job_record.status = "completed"
@@ -0,0 +1,174 @@
+# services/tiered_cache.py
+"""
+2層キャッシュ（プロセス内 LRU → Redis）
+
+- 値は JSON にシリアライズできるもの（dict / list / str など）
+- プロセス内 LRU はエントリ数とバイト数の両方で上限を持つ
+- Redis が使えない環境ではプロセス内 LRU のみで動作する
+- hit / miss / 節約バイト数などの統計を持つ（メトリクス出力用）
+- Redis を止める（mark_redis_failed）のは接続エラー・タイムアウトのときだけ。
+  壊れた値・他の用途の値は miss として扱い、そのキーを消す
+"""
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from redis.exceptions import ConnectionError as RedisConnectionError, RedisError, TimeoutError as RedisTimeoutError
+
+from services.redis_client import get_redis, mark_redis_failed
+
+logger = logging.getLogger(__name__)
+
+# Redis 自体が使えないことを示す例外（これ以外はキー単位の問題として扱う）
+_REDIS_DOWN = (RedisConnectionError, RedisTimeoutError)
+
+
+class TieredCache:
+    def __init__(
+        self,
+        namespace: str,
+        max_entries: int = 512,
+        max_bytes: int = 32 * 1024 * 1024,
+        use_redis: bool = True,
+    ) -> None:
+        self.namespace = namespace
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1024, int(max_bytes))
+        self.use_redis = use_redis
+
+        self._lock = threading.Lock()
+        # key -> (expires_at(monotonic), value, size_bytes)
+        self._mem: "OrderedDict[str, Tuple[float, Any, int]]" = OrderedDict()
+        self._mem_bytes = 0
+        self._stats: Dict[str, int] = {
+            "memory_hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "evictions": 0,
+            "bytes_saved": 0,
+        }
+        _register(self)
+
+    # ---------------- 内部 ----------------
+    def _redis_key(self, key: str) -> str:
+        return f"cache:{self.namespace}:{key}"
+
+    def _mem_put(self, key: str, value: Any, size: int, ttl: float) -> None:
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._mem.pop(key, None)
+            if old is not None:
+                self._mem_bytes -= old[2]
+            self._mem[key] = (time.monotonic() + ttl, value, size)
+            self._mem_bytes += size
+            while len(self._mem) > self.max_entries or self._mem_bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._mem.popitem(last=False)
+                self._mem_bytes -= evicted_size
+                self._stats["evictions"] += 1
+
+    def _redis_delete(self, r: Any, key: str) -> None:
+        try:
+            r.delete(self._redis_key(key))
+        except _REDIS_DOWN as e:
+            mark_redis_failed(e)
+        except RedisError as e:
+            logger.warning(f"[Cache:{self.namespace}] redis delete failed for {key[:16]}: {e}")
+
+    def _count(self, name: str, size: int = 0) -> None:
+        with self._lock:
+            self._stats[name] += 1
+            if size:
+                self._stats["bytes_saved"] += size
+
+    # ---------------- 公開 API ----------------
+    def get(self, key: str) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                expires_at, value, size = entry
+                if expires_at > now:
+                    self._mem.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    self._stats["bytes_saved"] += size
+                    return value
+                self._mem.pop(key, None)
+                self._mem_bytes -= size
+
+        r = get_redis() if self.use_redis else None
+        if r is not None:
+            try:
+                pipe = r.pipeline()
+                pipe.get(self._redis_key(key))
+                pipe.ttl(self._redis_key(key))
+                raw, ttl = pipe.execute()
+                if raw is not None:
+                    value = json.loads(raw)
+                    size = len(raw.encode("utf-8"))
+                    if ttl and ttl > 0:
+                        self._mem_put(key, value, size, ttl)
+                    self._count("redis_hits", size)
+                    return value
+            except _REDIS_DOWN as e:
+                mark_redis_failed(e)
+            except (ValueError, TypeError, AttributeError) as e:
+                # JSON として読めない値（壊れた値・別用途のキー）: miss として扱い、次の set で上書きさせる
+                logger.warning(f"[Cache:{self.namespace}] undecodable value for {key[:16]}: {e}; dropping")
+                self._redis_delete(r, key)
+            except RedisError as e:
+                logger.warning(f"[Cache:{self.namespace}] redis get failed for {key[:16]}: {e}")
+
+        self._count("misses")
+        return None
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        if ttl <= 0:
+            return
+        raw = json.dumps(value, ensure_ascii=False)
+        size = len(raw.encode("utf-8"))
+        self._mem_put(key, value, size, ttl)
+        self._count("sets")
+
+        r = get_redis() if self.use_redis else None
+        if r is not None:
+            try:
+                r.set(self._redis_key(key), raw, ex=max(1, int(ttl)))
+            except _REDIS_DOWN as e:
+                mark_redis_failed(e)
+            except RedisError as e:
+                logger.warning(f"[Cache:{self.namespace}] redis set failed for {key[:16]}: {e}")
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            old = self._mem.pop(key, None)
+            if old is not None:
+                self._mem_bytes -= old[2]
+        r = get_redis() if self.use_redis else None
+        if r is not None:
+            self._redis_delete(r, key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._stats)
+            out["memory_entries"] = len(self._mem)
+            out["memory_bytes"] = self._mem_bytes
+        return out
+
+
+# -------------------------------
+# プロセス内レジストリ（メトリクス出力用）
+# -------------------------------
+_caches: Dict[str, TieredCache] = {}
+
+
+def _register(cache: TieredCache) -> None:
+    _caches[cache.namespace] = cache
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: c.stats() for name, c in list(_caches.items())}
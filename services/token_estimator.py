@@ -0,0 +1,41 @@
+# services/token_estimator.py
+"""
+Gemini のトークン数をローカルで概算する（API の countTokens を呼ばない）
+
+- 日本語（かな・漢字）は概ね 1 文字 ≒ 1 トークン
+- 英数字・記号は概ね 4 文字 ≒ 1 トークン
+レート制限や文脈の予算計算に使う目安であり、厳密な値ではない。
+"""
+from typing import Dict, List
+
+
+def _is_cjk(ch: str) -> bool:
+    code = ord(ch)
+    return (
+        0x3040 <= code <= 0x30FF      # ひらがな・カタカナ
+        or 0x3400 <= code <= 0x9FFF   # CJK 統合漢字（拡張A含む）
+        or 0xF900 <= code <= 0xFAFF   # CJK 互換漢字
+        or 0xFF00 <= code <= 0xFFEF   # 全角英数・半角カナ
+        or 0xAC00 <= code <= 0xD7AF   # ハングル
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    cjk = 0
+    other = 0
+    for ch in text:
+        if _is_cjk(ch):
+            cjk += 1
+        elif not ch.isspace():
+            other += 1
+    return cjk + (other + 3) // 4 + 1
+
+
+def estimate_contents_tokens(contents: List[Dict[str, str]]) -> int:
+    """chat 風 contents（[{"role":..., "content":...}]）の合計（1メッセージあたり数トークンの枠を含む）"""
+    total = 0
+    for m in contents:
+        total += estimate_tokens(m.get("content") or m.get("text") or "") + 4
+    return total
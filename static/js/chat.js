@@ -1,5 +1,5 @@
-// static/js/chat.js v1.5
-console.log("[chat.js] Version 1.5 loaded - Summary display fix");
+// static/js/chat.js v1.6
+console.log("[chat.js] Version 1.6 loaded - Streaming chat");
 (() => {
   // ---------- 共通fetch ----------
   async function ajax(url, method = "GET", body = null, signal = undefined) {
@@ -23,6 +23,59 @@ console.log("[chat.js] Version 1.5 loaded - Summary display fix");
     return data;
   }
 
+  // /api/chat/stream 用: SSE を逐次読み出し、断片ごとに onDelta を呼ぶ
+  // 検索パスに回った場合はサーバが JSON を返すので、そのまま結果として返す
+  async function streamChat(url, body, onDelta) {
+    const csrf = document.querySelector('meta[name="csrf-token"]')?.getAttribute("content") || "";
+    const res = await fetch(url, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        "X-CSRFToken": csrf,
+        "Accept": "text/event-stream",
+      },
+      credentials: "same-origin",
+      body: JSON.stringify(body),
+    });
+    const ctype = res.headers.get("Content-Type") || "";
+    if (!ctype.includes("text/event-stream")) {
+      let data = {};
+      try { data = await res.json(); } catch (_) {}
+      if (!res.ok || data?.ok === false) {
+        throw new Error(data?.details || data?.error || `HTTP ${res.status}`);
+      }
+      return { streamed: false, ...data };
+    }
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder("utf-8");
+    let buf = "";
+    let done = null;
+    for (;;) {
+      const { value, done: eof } = await reader.read();
+      if (eof) break;
+      buf += decoder.decode(value, { stream: true });
+      let idx;
+      while ((idx = buf.indexOf("\n\n")) >= 0) {
+        const raw = buf.slice(0, idx);
+        buf = buf.slice(idx + 2);
+        let event = "message";
+        let dataLines = [];
+        raw.split("\n").forEach((line) => {
+          if (line.startsWith("event:")) event = line.slice(6).trim();
+          else if (line.startsWith("data:")) dataLines.push(line.slice(5).trim());
+        });
+        if (!dataLines.length) continue;
+        const payload = JSON.parse(dataLines.join("\n"));
+        if (event === "error") throw new Error(payload.error || "stream error");
+        if (event === "done") done = payload;
+        else if (payload.delta) onDelta(payload.delta);
+      }
+    }
+    if (!done) throw new Error("ストリームが途中で切断されました");
+    return { streamed: true, ...done };
+  }
+
   // /api/search_summarize 用のタイムアウト付き呼び出し（安全策）
   async function ajaxWithTimeout(url, method, body, timeoutMs = 180000) {  // 3分 - 長い検索・要約処理に対応
     const ctrl = new AbortController();
@@ -117,6 +170,7 @@ console.log("[chat.js] Version 1.5 loaded - Summary display fix");
       }
       msgBox.appendChild(div);
       msgBox.scrollTop = msgBox.scrollHeight;
+      return div;
     }
 
     function setSummary(text) {
@@ -540,18 +594,33 @@ console.log("[chat.js] Version 1.5 loaded - Summary display fix");
           // ローディング表示
           showLoading("応答生成中...");
 
+          let bubble = null;
           try {
-            // 通常のチャット
+            // 通常のチャット（断片が届いた順に描画）
             const chatPayload = {
               conversation_id: currentConversationId,
               message: text,
               model: (modelSel && modelSel.value) ? modelSel.value : ""
             };
-            const chatData = await ajax("/api/chat", "POST", chatPayload);
+            let streamedText = "";
+            const chatData = await streamChat("/api/chat/stream", chatPayload, (delta) => {
+              if (!bubble) {
+                hideLoading();
+                bubble = render("assistant", "");
+              }
+              streamedText += delta;
+              bubble.firstChild.textContent = streamedText;
+              msgBox.scrollTop = msgBox.scrollHeight;
+            });
             hideLoading();
-            render("assistant", chatData.reply || "(no reply)");
+            if (!chatData.streamed) {
+              render("assistant", chatData.reply || "(no reply)");
+            } else if (!bubble) {
+              render("assistant", "(no reply)");
+            }
           } catch (e) {
             hideLoading();
+            if (bubble) bubble.remove();
             throw e;
           }
         }
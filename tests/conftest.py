@@ -0,0 +1,14 @@
+# tests/conftest.py
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def _no_redis(monkeypatch):
+    """Redis を使わず、各モジュールのプロセス内フォールバックで動かす"""
+    monkeypatch.delenv("REDIS_URL", raising=False)
+    monkeypatch.delenv("VALKEY_URL", raising=False)
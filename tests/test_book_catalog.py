@@ -0,0 +1,113 @@
+# tests/test_book_catalog.py
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+from sqlalchemy.orm import Session
+
+from app.models import BookCatalogEntry, db
+from services import book_catalog
+from services.book_catalog import lookup, normalize_author, normalize_title, upsert_results
+
+GB_RESULT = {
+    "title": "嫌われる勇気 自己啓発の源流「アドラー」の教え",
+    "authors": ["岸見一郎", "古賀史健"],
+    "publisher": "ダイヤモンド社",
+    "isbn": "978-4-478-02581-9",
+    "info_link": "https://books.google.co.jp/books?id=abc123&hl=ja",
+    "description": "アドラー心理学の入門書",
+}
+NDL_RESULT = {
+    "title": "嫌われる勇気",
+    "author": "岸見一郎 著, 古賀史健 著",
+    "link": "https://ndlsearch.ndl.go.jp/books/R100000002-I000000000001",
+}
+
+
+@pytest.fixture(autouse=True)
+def _reset_probe_state():
+    book_catalog._fts_ready.clear()
+    book_catalog._fts_failed_at.clear()
+    yield
+    book_catalog._fts_ready.clear()
+    book_catalog._fts_failed_at.clear()
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'catalog.db'}"
+    db.init_app(app)
+    with app.app_context():
+        yield app
+
+
+def _backend():
+    with Session(db.engine) as s:
+        return book_catalog._search_backend(s)
+
+
+def test_normalize():
+    assert normalize_title("Ｐｙｔｈｏｎ 入門 第2版！") == "python入門第2版"
+    assert normalize_author("岸見 一郎 著, 古賀史健（訳）") == "岸見一郎,古賀史健"
+
+
+def test_no_app_context_is_a_noop():
+    assert upsert_results("ndl", [NDL_RESULT]) == 0
+    assert lookup("嫌われる勇気") == {}
+
+
+def test_upsert_and_lookup(app):
+    db.create_all()
+    assert upsert_results("google_books", [GB_RESULT]) == 1
+    assert upsert_results("ndl", [NDL_RESULT]) == 1
+    # 同じキーは上書き
+    assert upsert_results("ndl", [NDL_RESULT]) == 1
+    assert db.session.query(BookCatalogEntry).count() == 2
+    assert _backend() == "fts5"
+
+    found = lookup("嫌われる勇気", author="岸見一郎")
+    gb, gb_fresh = found["google_books"]
+    ndl, ndl_fresh = found["ndl"]
+    assert gb_fresh and ndl_fresh
+    assert gb[0]["authors"] == ["岸見一郎", "古賀史健"]
+    assert gb[0]["isbn"] == "9784478025819"
+    assert ndl[0]["url"] == NDL_RESULT["link"]
+
+    assert lookup("嫌われる勇気", author="村上春樹") == {}
+    assert lookup("まったく別の本のタイトル") == {}
+
+
+def test_old_entries_are_stale(app):
+    db.create_all()
+    upsert_results("ndl", [NDL_RESULT])
+    entry = db.session.query(BookCatalogEntry).one()
+    entry.fetched_at = datetime.utcnow() - timedelta(days=60)
+    db.session.commit()
+    _, fresh = lookup("嫌われる勇気")["ndl"]
+    assert not fresh
+
+
+def test_fts_probe_retries_after_failure(app):
+    # マイグレーション前（book_catalog テーブルが無い）に判定が走ると LIKE になる
+    assert _backend() == "like"
+    db.create_all()
+    # 失敗は一定時間覚えておき、毎回は判定しない
+    assert _backend() == "like"
+
+    url = str(db.engine.url)
+    book_catalog._fts_failed_at[url] = time.monotonic() - book_catalog._PROBE_RETRY_SEC - 1
+    assert _backend() == "fts5"
+    assert book_catalog._fts_ready[url]
+    assert url not in book_catalog._fts_failed_at
+
+
+def test_fts_backfills_rows_written_before_the_index(app):
+    db.create_all()
+    db.session.add(BookCatalogEntry(
+        source="ndl", source_key="k1", title="嫌われる勇気", title_norm=normalize_title("嫌われる勇気"),
+        fetched_at=datetime.utcnow(),
+    ))
+    db.session.commit()
+    assert "ndl" in lookup("嫌われる勇気")
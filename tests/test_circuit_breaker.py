@@ -0,0 +1,100 @@
+# tests/test_circuit_breaker.py
+import uuid
+
+import pytest
+
+from services.circuit_breaker import CircuitBreaker, error_class_for_status
+
+
+@pytest.fixture
+def cb():
+    # プロセス内ストアはモジュール共通なので、テストごとに prefix を分ける
+    return CircuitBreaker(prefix=f"test_cb_{uuid.uuid4().hex}")
+
+
+def _expire_open(cb, model, error_class):
+    """open 期限切れを再現する（tripped の印だけが残る）"""
+    cb._run("delete", cb._key(model, error_class, "open"))
+
+
+def test_error_class_for_status():
+    assert error_class_for_status(404) == "not_found"
+    assert error_class_for_status(429) == "rate_limit"
+    assert error_class_for_status(503) == "server"
+    assert error_class_for_status(400) == "client"
+
+
+def test_opens_after_threshold(cb):
+    for _ in range(2):
+        cb.record_failure("m", "rate_limit")
+    assert cb.allow("m")
+    cb.record_failure("m", "rate_limit")
+    assert cb._state("m", "rate_limit") == "open"
+    assert not cb.allow("m")
+
+
+def test_untracked_classes_do_not_open(cb):
+    for _ in range(10):
+        cb.record_failure("m", "client")
+        cb.record_failure("m", "throttled")
+    assert set(cb._states("m").values()) == {"closed"}
+    assert cb.allow("m")
+
+
+def test_filter_models_skips_open_but_keeps_last_resort(cb):
+    cb.record_failure("a", "not_found")
+    assert cb.filter_models(["a", "b"]) == ["b"]
+    cb.record_failure("b", "not_found")
+    assert cb.filter_models(["a", "b"]) == ["b"]
+
+
+def test_half_open_admits_a_single_probe(cb):
+    cb.record_failure("m", "not_found")
+    _expire_open(cb, "m", "not_found")
+    assert cb._state("m", "not_found") == "half_open"
+
+    # filter_models は状態を読むだけで probe 枠を取らない
+    assert cb.filter_models(["m"]) == ["m"]
+    assert cb.allow("m")
+    assert not cb.allow("m")
+
+
+def test_probe_success_closes(cb):
+    cb.record_failure("m", "not_found")
+    _expire_open(cb, "m", "not_found")
+    assert cb.allow("m")
+    cb.record_success("m", 0.1)
+    assert cb._state("m", "not_found") == "closed"
+    assert cb.allow("m")
+    assert cb.allow("m")
+
+
+def test_probe_failure_reopens(cb):
+    cb.record_failure("m", "not_found")
+    _expire_open(cb, "m", "not_found")
+    assert cb.allow("m")
+    cb.record_failure("m", "not_found")
+    assert cb._state("m", "not_found") == "open"
+
+
+def test_probe_released_on_unrelated_failure(cb):
+    cb.record_failure("m", "not_found")
+    _expire_open(cb, "m", "not_found")
+    assert cb.allow("m")
+    # probe がブレーカー対象外のエラーで終わっても枠は返り、次のリクエストが試せる
+    cb.record_failure("m", "throttled")
+    assert cb._state("m", "not_found") == "half_open"
+    assert cb.allow("m")
+
+
+def test_scoreboard_counts(cb):
+    cb.record_success("m", 0.2)
+    cb.record_success("m", 0.4)
+    cb.record_failure("m", "server")
+    cb.record_failure("m", "something_new")
+    row = next(r for r in cb.scoreboard() if r["model"] == "m")
+    assert row["ok"] == 2
+    assert row["requests"] == 4
+    assert row["errors"] == {"server": 1, "other": 1}
+    assert row["avg_latency_ms"] == 300
+    assert row["breakers"] == {}
@@ -0,0 +1,77 @@
+# tests/test_dedupe.py
+from services.search import canonicalize_url, content_sketch, dedupe_results, sketch_similarity
+
+ARTICLE = (
+    "この本は分散システムの設計で避けて通れない一貫性と可用性のトレードオフを、"
+    "実際の障害事例とともに丁寧に解説している。後半ではレプリケーションとパーティショニングの"
+    "具体的な設計パターンが紹介され、現場のエンジニアにとって実践的な内容になっている。"
+)
+OTHER = (
+    "料理初心者向けのレシピ集で、毎日の献立に使える簡単な和食のおかずを百種類以上収録している。"
+    "写真付きの手順と、作り置きや冷凍保存のコツも載っているので忙しい家庭にも向いている一冊である。"
+)
+
+
+def test_canonicalize_url():
+    assert canonicalize_url("http://www.Example.com/a/?utm_source=x&b=2&a=1#top") == "https://example.com/a?a=1&b=2"
+    assert canonicalize_url("https://m.example.com/a/index.html") == "https://example.com/a"
+    assert canonicalize_url("https://example.com/news/123/amp") == "https://example.com/news/123"
+    assert canonicalize_url("https://example.com:8080/a") == "https://example.com:8080/a"
+    assert canonicalize_url("ftp://example.com/a") == "ftp://example.com/a"
+
+
+def test_canonicalize_amazon_product_urls():
+    canonical = "https://amazon.co.jp/dp/4873118700"
+    assert canonicalize_url("https://www.amazon.co.jp/some-title/dp/4873118700/ref=sr_1_1?qid=1") == canonical
+    assert canonicalize_url("https://www.amazon.co.jp/gp/product/4873118700?tag=aff-22") == canonical
+    # Amazon 以外の ref パラメータは意味を持つことがあるので残す
+    assert canonicalize_url("https://example.com/a?ref=top") == "https://example.com/a?ref=top"
+
+
+def test_sketch_similarity():
+    a = content_sketch(ARTICLE)
+    assert sketch_similarity(a, content_sketch(ARTICLE)) == 1.0
+    # 空白・全角の違いや末尾の追記だけなら近似重複とみなせる
+    copy = content_sketch(ARTICLE.replace("、", " ") + "（転載）")
+    assert sketch_similarity(a, copy) >= 0.8
+    assert sketch_similarity(a, content_sketch(OTHER)) < 0.2
+    assert content_sketch("短い") is None
+
+
+def test_dedupe_by_canonical_url_keeps_first_and_merges_fields():
+    results = [
+        {"title": "A", "url": "https://www.amazon.co.jp/dp/4873118700"},
+        {"title": "A (mobile)", "url": "https://amazon.co.jp/gp/product/4873118700?ref=x",
+         "enriched_content": "本文"},
+        {"title": "B", "url": "https://example.com/b"},
+    ]
+    kept = dedupe_results(results)
+    assert [r["title"] for r in kept] == ["A", "B"]
+    assert kept[0]["enriched_content"] == "本文"
+    # 元の結果は書き換えない
+    assert "enriched_content" not in results[0]
+
+
+def test_dedupe_by_content():
+    results = [
+        {"url": "https://a.example.com/review", "snippet": ARTICLE},
+        {"url": "https://copy.example.net/x", "snippet": ARTICLE + "（転載）"},
+        {"url": "https://c.example.org/recipe", "snippet": OTHER},
+    ]
+    assert [r["url"] for r in dedupe_results(results)] == [
+        "https://a.example.com/review", "https://c.example.org/recipe",
+    ]
+
+
+def test_user_sources_are_never_dropped():
+    results = [
+        {"url": "https://example.com/a", "snippet": ARTICLE},
+        {"url": "https://example.com/a", "snippet": ARTICLE, "source": "user"},
+    ]
+    assert len(dedupe_results(results)) == 2
+
+
+def test_dedupe_can_be_disabled(monkeypatch):
+    monkeypatch.setenv("SEARCH_DEDUPE", "false")
+    results = [{"url": "https://example.com/a"}, {"url": "https://www.example.com/a/"}]
+    assert len(dedupe_results(results)) == 2
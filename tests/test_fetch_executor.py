@@ -0,0 +1,130 @@
+# tests/test_fetch_executor.py
+import contextvars
+import threading
+import time
+
+import pytest
+
+from services.fetch_executor import FetchDeadlineExceeded, FetchExecutor, FetchRejected, host_key
+
+
+def _blocker(ex, host="blocker"):
+    """ワーカーを塞ぐタスクを投入し、解放用の Event を返す"""
+    release = threading.Event()
+    started = threading.Event()
+
+    def run():
+        started.set()
+        release.wait(5)
+
+    fut = ex.submit(run, host=host)
+    assert started.wait(5)
+    return release, fut
+
+
+def test_host_key():
+    assert host_key("https://www.Example.com/a?b=1") == "example.com"
+    assert host_key("google_cse") == "google_cse"
+    assert host_key("") is None
+
+
+def test_per_host_limit():
+    ex = FetchExecutor(max_workers=8, per_host=2, max_queue=32)
+    lock = threading.Lock()
+    running = {"a.com": 0, "b.com": 0}
+    peak = {"a.com": 0, "b.com": 0}
+
+    def work(item):
+        host = item[0]
+        with lock:
+            running[host] += 1
+            peak[host] = max(peak[host], running[host])
+        time.sleep(0.05)
+        with lock:
+            running[host] -= 1
+        return item
+
+    items = [("a.com", i) for i in range(6)] + [("b.com", i) for i in range(6)]
+    results = [f.result() for _, f in ex.fan_out(work, items, host_of=lambda it: f"https://{it[0]}/", timeout=10)]
+    assert sorted(results) == sorted(items)
+    assert peak == {"a.com": 2, "b.com": 2}
+
+
+def test_nested_fan_out_steals_children_instead_of_deadlocking():
+    ex = FetchExecutor(max_workers=1, per_host=4, max_queue=32)
+
+    def child(i):
+        return i * 2
+
+    def parent():
+        return sorted(f.result() for _, f in ex.fan_out(child, range(3), timeout=5))
+
+    assert ex.submit(parent).result(timeout=5) == [0, 2, 4]
+    assert ex.stats()["stolen"] == 3
+
+
+def test_closing_fan_out_withdraws_queued_tasks():
+    ex = FetchExecutor(max_workers=1, per_host=1, max_queue=32)
+    executed = []
+
+    def work(i):
+        executed.append(i)
+        time.sleep(0.05)
+        return i
+
+    gen = ex.fan_out(work, range(5), timeout=5)
+    next(gen)
+    gen.close()
+    time.sleep(0.2)
+    # 1件目の完了時点で始まっていた1件だけが走り、残りは取り下げられる
+    assert len(executed) == 2
+    assert ex.stats()["cancelled"] == 3
+
+
+def test_deadline_expires_queued_tasks():
+    ex = FetchExecutor(max_workers=1, per_host=4, max_queue=32)
+    release, _ = _blocker(ex)
+    try:
+        outcomes = list(ex.fan_out(lambda i: i, range(2), timeout=0.1))
+    finally:
+        release.set()
+    assert len(outcomes) == 2
+    for _, f in outcomes:
+        with pytest.raises(FetchDeadlineExceeded):
+            f.result()
+
+
+def test_queue_full_is_rejected():
+    ex = FetchExecutor(max_workers=1, per_host=4, max_queue=1)
+    release, _ = _blocker(ex)
+    try:
+        queued = ex.submit(lambda: "ok")
+        rejected = ex.submit(lambda: "never")
+        with pytest.raises(FetchRejected):
+            rejected.result(timeout=1)
+    finally:
+        release.set()
+    assert queued.result(timeout=5) == "ok"
+
+
+def test_context_vars_reach_tasks():
+    var = contextvars.ContextVar("caller", default="")
+    ex = FetchExecutor(max_workers=2, per_host=2, max_queue=8)
+    token = var.set("chat")
+    try:
+        fut = ex.submit(var.get)
+    finally:
+        var.reset(token)
+    assert fut.result(timeout=5) == "chat"
+
+
+def test_task_errors_are_returned_in_future():
+    ex = FetchExecutor(max_workers=2, per_host=2, max_queue=8)
+
+    def boom(_):
+        raise ValueError("bad")
+
+    [(_, f)] = list(ex.fan_out(boom, [1], timeout=5))
+    with pytest.raises(ValueError):
+        f.result()
+    assert ex.stats()["failed"] == 1
@@ -0,0 +1,132 @@
+# tests/test_page_fetcher.py
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import pytest
+import requests
+
+from services import page_fetcher
+from services.page_fetcher import fetch_page_text, page_fetch_stats
+
+HTML = b"<html><head><title>Hello book</title></head><body><p>Hello book body text.</p></body></html>"
+
+
+class _Response:
+    def __init__(self, status_code, body=b"", headers=None):
+        self.status_code = status_code
+        self.headers = {"Content-Type": "text/html; charset=utf-8", **(headers or {})}
+        self._body = body
+
+    def iter_bytes(self, size):
+        for i in range(0, len(self._body), size):
+            yield self._body[i:i + size]
+
+
+class _Transport:
+    """handler(request_headers) -> _Response を呼ぶだけの webfetch_transport の代わり"""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = []
+
+    @contextmanager
+    def stream(self, method, url, timeout=None, headers=None):
+        self.requests.append(dict(headers or {}))
+        yield self.handler(headers or {})
+
+
+@pytest.fixture
+def transport(monkeypatch, tmp_path):
+    monkeypatch.setenv("WEBFETCH_DISK_CACHE_DIR", str(tmp_path))
+    t = _Transport(lambda headers: _Response(200, HTML, {"ETag": '"v1"'}))
+    monkeypatch.setattr(page_fetcher, "webfetch_transport", lambda: t)
+    return t
+
+
+def _url():
+    return f"https://example.com/{uuid.uuid4().hex}"
+
+
+def _delta(before, name):
+    return page_fetch_stats()[name] - before[name]
+
+
+def test_fresh_entry_is_served_without_network(transport):
+    url = _url()
+    assert "Hello book" in fetch_page_text(url)
+    assert "Hello book" in fetch_page_text(url)
+    assert len(transport.requests) == 1
+
+
+def test_stale_entry_is_revalidated_with_etag(transport, monkeypatch):
+    url = _url()
+    text = fetch_page_text(url)
+    monkeypatch.setenv("WEBFETCH_FRESH_TTL_SEC", "0")
+    transport.handler = lambda headers: _Response(304 if headers.get("If-None-Match") == '"v1"' else 200, b"")
+    before = page_fetch_stats()
+
+    assert fetch_page_text(url) == text
+    assert transport.requests[-1]["If-None-Match"] == '"v1"'
+    assert _delta(before, "revalidated") == 1
+    assert _delta(before, "downloads") == 0
+
+
+def test_http_error_is_negatively_cached(transport):
+    url = _url()
+    transport.handler = lambda headers: _Response(404)
+    assert fetch_page_text(url) is None
+    assert fetch_page_text(url) is None
+    assert len(transport.requests) == 1
+
+
+def test_non_text_content_is_not_read(transport):
+    transport.handler = lambda headers: _Response(200, b"%PDF-1.4", {"Content-Type": "application/pdf"})
+    assert fetch_page_text(_url()) is None
+
+
+def test_connection_error_is_negatively_cached(transport):
+    url = _url()
+
+    def fail(headers):
+        raise requests.ConnectionError("refused")
+
+    transport.handler = fail
+    assert fetch_page_text(url) is None
+    assert fetch_page_text(url) is None
+    assert len(transport.requests) == 1
+
+
+def test_disk_layer_survives_memory_eviction(transport):
+    url = _url()
+    text = fetch_page_text(url)
+    page_fetcher.page_cache.delete(page_fetcher._cache_key(url))
+    before = page_fetch_stats()
+    assert fetch_page_text(url) == text
+    assert _delta(before, "disk_hits") == 1
+    assert len(transport.requests) == 1
+
+
+def test_concurrent_fetches_share_one_download(transport):
+    url = _url()
+    release = threading.Event()
+
+    def slow(headers):
+        release.wait(5)
+        return _Response(200, HTML)
+
+    transport.handler = slow
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(fetch_page_text(url))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    # 全員がリーダーか待ち側に入るまで応答を止めておく
+    time.sleep(0.2)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert len(transport.requests) == 1
+    assert len(results) == 4
+    assert all(r and "Hello book" in r for r in results)
@@ -0,0 +1,85 @@
+# tests/test_ranking.py
+from services.ranking import bm25_scores, fit_to_budget, rank_results, select_fetch_targets, term_coverage, tokenize
+
+
+def _r(title, url, snippet="", **extra):
+    return {"title": title, "url": url, "snippet": snippet, **extra}
+
+
+def test_tokenize_bigrams_japanese_and_words_ascii():
+    assert tokenize("Ｐｙｔｈｏｎ入門 2版") == ["python", "入門", "2", "版"]
+    assert tokenize("分散システム") == ["分散", "散シ", "シス", "ステ", "テム"]
+
+
+def test_bm25_prefers_matching_and_shorter_documents():
+    docs = [
+        "料理 レシピ 和食",
+        "分散システム 設計",
+        "分散システム 設計 " + "その他の話題 " * 20,
+    ]
+    scores = bm25_scores("分散システム", docs)
+    assert scores[0] == 0.0
+    assert scores[1] > scores[2] > 0.0
+
+
+def test_bm25_rare_terms_weigh_more():
+    docs = ["python 入門", "python 機械学習", "python 機械学習 入門", "python"]
+    scores = bm25_scores("python 入門", docs)
+    # どの文書にもある python より、一部にしか無い 入門 が効く
+    assert scores[0] > scores[1]
+
+
+def test_rank_results_orders_by_score_and_keeps_ties_stable():
+    results = [
+        _r("料理の本", "https://a.example/1"),
+        _r("分散システム設計の本", "https://b.example/2"),
+        _r("料理の本2", "https://c.example/3"),
+    ]
+    ranked = rank_results("分散システム", results)
+    assert [r["url"] for r in ranked] == ["https://b.example/2", "https://a.example/1", "https://c.example/3"]
+    assert rank_results("", results) == results
+
+
+def test_term_coverage():
+    assert term_coverage("分散システム", "分散システム入門") == 1.0
+    assert term_coverage("分散システム", "料理") == 0.0
+
+
+def test_select_fetch_targets_skips_irrelevant_and_boosts_trusted():
+    results = [
+        _r("分散システム 設計 入門", "https://blog.example/a", "分散システムの設計"),
+        _r("分散システム 設計", "https://hanmoto.com/b", "分散システム"),
+        _r("今日の天気", "https://weather.example/c", "晴れ"),
+    ]
+    picked = select_fetch_targets("分散システム 設計", results, 3, trusted_domains=["hanmoto.com"])
+    assert [r["url"] for r in picked] == ["https://hanmoto.com/b", "https://blog.example/a"]
+
+
+def test_select_fetch_targets_without_scores_prefers_trusted_order():
+    results = [_r("a", "https://x.example/a"), _r("b", "https://hanmoto.com/b"), _r("c", "")]
+    picked = select_fetch_targets("", results, 2, trusted_domains=["hanmoto.com"])
+    assert [r["url"] for r in picked] == ["https://hanmoto.com/b", "https://x.example/a"]
+    assert select_fetch_targets("q", results, 0) == []
+    assert select_fetch_targets("", results, 2, exclude_urls=["https://x.example/a"])[0]["url"] == "https://hanmoto.com/b"
+
+
+def test_fit_to_budget_keeps_user_sources_and_best_result():
+    big = "分散システム " * 400
+    results = [
+        _r("料理", "https://a.example/1", "レシピ"),
+        _r("分散システム", "https://b.example/2", big),
+        _r("資料", "https://user.example/3", "メモ", source="user"),
+    ]
+    kept = fit_to_budget("分散システム", results, budget_tokens=50)
+    # ユーザー資料が先頭、最も関連度の高い資料は予算を超えても1件は残す
+    assert [r["url"] for r in kept] == ["https://user.example/3", "https://b.example/2"]
+
+
+def test_fit_to_budget_fills_gaps_with_smaller_sources():
+    results = [
+        _r("分散システム 設計", "https://a.example/1", "分散システム 設計"),
+        _r("分散システム", "https://b.example/2", "分散 " * 500),
+        _r("設計", "https://c.example/3", "設計"),
+    ]
+    kept = fit_to_budget("分散システム 設計", results, budget_tokens=60)
+    assert [r["url"] for r in kept] == ["https://a.example/1", "https://c.example/3"]
@@ -0,0 +1,92 @@
+# tests/test_rate_limiter.py
+import pytest
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from services import rate_limiter as rl
+from services.rate_limiter import BACKGROUND, GeminiRateLimited, RateLimiter, _LocalBuckets, gemini_priority
+
+
+def test_local_bucket_drains_and_refills():
+    b = _LocalBuckets()
+    for _ in range(5):
+        assert b.take("m", 0.0, 5, 1e12, 0, 0.0) == 0
+    # 6 件目は 1 リクエスト分（60000 / 5 ms）の補充を待つ
+    assert b.take("m", 0.0, 5, 1e12, 0, 0.0) == 12000
+    assert b.take("m", 12000.0, 5, 1e12, 0, 0.0) == 0
+
+
+def test_local_bucket_token_limit():
+    b = _LocalBuckets()
+    assert b.take("m", 0.0, 1e9, 1000, 600, 0.0) == 0
+    # 残り 400 トークンに 600 は入らない → 200 トークン分の補充待ち
+    assert b.take("m", 0.0, 1e9, 1000, 600, 0.0) == 12000
+
+
+def test_local_bucket_reserve_holds_back_background():
+    b = _LocalBuckets()
+    taken = 0
+    while b.take("m", 0.0, 10, 1e12, 0, 0.2) == 0:
+        taken += 1
+    # 2 割は interactive 用に残す
+    assert taken == 8
+    assert b.take("m", 0.0, 10, 1e12, 0, 0.0) == 0
+
+
+def test_acquire_without_limits_is_free(monkeypatch):
+    monkeypatch.delenv("GEMINI_RPM_LIMIT", raising=False)
+    monkeypatch.delenv("GEMINI_TPM_LIMIT", raising=False)
+    assert RateLimiter(prefix="test_rl_free").acquire("m", 10 ** 9) == 0.0
+
+
+def test_acquire_rejects_when_wait_exceeds_max(monkeypatch):
+    monkeypatch.setenv("GEMINI_RPM_LIMIT", "1")
+    monkeypatch.setenv("GEMINI_RL_MAX_WAIT_INTERACTIVE", "0.5")
+    limiter = RateLimiter(prefix="test_rl_reject")
+    assert limiter.acquire("m", 1) == 0.0
+    with pytest.raises(GeminiRateLimited):
+        limiter.acquire("m", 1)
+    stats = limiter.stats()["interactive"]
+    assert stats["acquired"] == 1
+    assert stats["rejected"] == 1
+    assert stats["queue_depth"] == 0
+
+
+def test_model_specific_limit(monkeypatch):
+    monkeypatch.setenv("GEMINI_RPM_LIMIT", "100")
+    monkeypatch.setenv("GEMINI_RPM_LIMIT_GEMINI_2_5_PRO", "2")
+    assert rl._model_limit("RPM", "gemini-2.5-pro") == 2
+    assert rl._model_limit("RPM", "gemini-2.5-flash") == 100
+
+
+def test_background_priority_uses_reserve(monkeypatch):
+    monkeypatch.setenv("GEMINI_RPM_LIMIT", "10")
+    monkeypatch.setenv("GEMINI_RL_RESERVE", "0.5")
+    monkeypatch.setenv("GEMINI_RL_MAX_WAIT_BACKGROUND", "0.1")
+    limiter = RateLimiter(prefix="test_rl_bg")
+    with gemini_priority(BACKGROUND):
+        for _ in range(5):
+            limiter.acquire("m", 0)
+        with pytest.raises(GeminiRateLimited):
+            limiter.acquire("m", 0)
+    # interactive は残しておいた枠を使える
+    assert limiter.acquire("m", 0) == 0.0
+
+
+class _BrokenRedis:
+    def register_script(self, script):
+        def _call(keys, args):
+            raise RedisConnectionError("down")
+        return _call
+
+
+def test_falls_back_to_local_buckets_when_redis_fails(monkeypatch):
+    failures = []
+    monkeypatch.setattr(rl, "get_redis", lambda: _BrokenRedis())
+    monkeypatch.setattr(rl, "mark_redis_failed", failures.append)
+    monkeypatch.setenv("GEMINI_RPM_LIMIT", "1")
+    monkeypatch.setenv("GEMINI_RL_MAX_WAIT_INTERACTIVE", "0.5")
+    limiter = RateLimiter(prefix="test_rl_fallback")
+    assert limiter.acquire("m", 1) == 0.0
+    with pytest.raises(GeminiRateLimited):
+        limiter.acquire("m", 1)
+    assert len(failures) == 2
@@ -0,0 +1,76 @@
+# tests/test_search_cache.py
+import uuid
+
+from services.search_cache import (
+    bucket_ttl,
+    cached_search,
+    normalize_query,
+    recency_bucket,
+    search_cache_key,
+)
+
+
+def test_normalize_query_folds_width_case_space_and_dates():
+    assert normalize_query("  ＡＢＣ　Ｎｅｗｓ  ") == "abc news"
+    assert normalize_query("天気 2026年10月6日") == "天気 2026-10-06"
+    assert normalize_query("天気 2026/10/6") == "天気 2026-10-06"
+    assert normalize_query("天気 2026.10.06") == "天気 2026-10-06"
+
+
+def test_recency_bucket():
+    assert recency_bucket("google_cse", 1) == "d1"
+    assert recency_bucket("google_cse", 0) == "d1"
+    assert recency_bucket("google_cse", 7) == "w1"
+    assert recency_bucket("google_cse", 30) == "m1"
+    assert recency_bucket("google_cse", 365) == "older"
+    assert recency_bucket("google_cse", None) == "any"
+    assert recency_bucket("ndl", None) == "book"
+
+
+def test_bucket_ttl_env_override(monkeypatch):
+    assert bucket_ttl("d1") == 3600
+    monkeypatch.setenv("SEARCH_CACHE_TTL_D1", "0")
+    assert bucket_ttl("d1") == 0
+
+
+def test_cache_key_ignores_spelling_but_not_parameters():
+    base = search_cache_key("google_cse", "Python  本", 10, "any")
+    assert search_cache_key("google_cse", "ｐｙｔｈｏｎ 本", 10, "any") == base
+    assert search_cache_key("google_cse", "python 本", 5, "any") != base
+    assert search_cache_key("google_cse", "python 本", 10, "d1") != base
+    assert search_cache_key("serpapi", "python 本", 10, "any") != base
+    assert search_cache_key("google_cse", "python 本", 10, "any", extra_params={"siteSearch": "a.jp"}) != base
+
+
+def test_cached_search_hits_and_returns_copies():
+    query = f"query {uuid.uuid4().hex}"
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return [{"title": "t", "url": "https://example.com/"}]
+
+    first = cached_search("google_cse", query, 10, fetch, recency_days=7)
+    first[0]["title"] = "changed"
+    second = cached_search("google_cse", query.upper(), 10, fetch, recency_days=7)
+    assert len(calls) == 1
+    assert second == [{"title": "t", "url": "https://example.com/"}]
+
+
+def test_cached_search_skips_empty_results_and_disabled_cache(monkeypatch):
+    query = f"empty {uuid.uuid4().hex}"
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return []
+
+    cached_search("google_cse", query, 10, fetch)
+    cached_search("google_cse", query, 10, fetch)
+    assert len(calls) == 2
+
+    monkeypatch.setenv("SEARCH_CACHE", "false")
+    calls.clear()
+    for _ in range(2):
+        cached_search("google_cse", query, 10, lambda: calls.append(1) or [{"url": "x"}])
+    assert len(calls) == 2